@@ -0,0 +1,284 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from src.grid_state import NATURE, BUILT, CENTRALITY, DENSITY_CODES
+from src.kernels import compiled_isobenefit_sweep
+from src.land_map import IsobenefitScenario, ClassicalScenario, MapBlock
+from src.simulation import run_isobenefit_simulation, update_map_snapshot
+
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SIZES = (50, 100, 200, 500, 1000)
+FILLS = (0.1, 0.3, 0.5)
+T_STAR = 10
+# number of blocks on which the single-block predicates are timed
+N_BLOCKS = 100
+
+
+def make_land(scenario, size, fill, seed=0, **kwargs):
+    # a size x size land where a fraction fill of the blocks is built, in blobs with a centrality every T_STAR
+    # blocks, so that the maps look like the ones of a simulation
+    land = scenario(size_x=size, size_y=size, T_star=T_STAR, random_seed=seed, **kwargs)
+    noise = gaussian_filter(np.random.default_rng(seed).random((size, size)), sigma=T_STAR / 2)
+    built = noise < np.quantile(noise, fill) if fill > 0 else np.zeros((size, size), dtype=bool)
+    land.grid.state[built] = BUILT
+    land.grid.density[built] = DENSITY_CODES['high']
+    centralities = built & (np.arange(size)[:, None] % T_STAR == 0) & (np.arange(size) % T_STAR == 0)
+    land.grid.state[centralities] = CENTRALITY
+    land.grid.density[centralities] = DENSITY_CODES['empty']
+    land.grid.inhabitants[:] = land.block_pop_by_density[land.grid.density]
+    land.grid.touch()
+    return land
+
+
+def sample_blocks(land, state=None, interior=True, seed=0):
+    # N_BLOCKS random blocks of the land, in its interior and with the given state if any
+    mask = land.get_interior_mask() if interior else np.ones(land.grid.state.shape, dtype=bool)
+    if state is not None:
+        mask &= land.grid.state == state
+    indices = np.flatnonzero(mask)
+    indices = np.random.default_rng(seed).choice(indices, size=min(N_BLOCKS, len(indices)), replace=False)
+    return list(zip(*[i.tolist() for i in np.unravel_index(indices, mask.shape)]))
+
+
+# every benchmark takes the map size and fill fraction, and returns a setup function and the timed function: setup
+# runs before each repetition, out of the timing, and its result is passed to the timed function. A third function,
+# when returned, is called with that result after each repetition, out of the timing too
+
+def bench_get_map_as_array(size, fill):
+    land = make_land(IsobenefitScenario, size, fill)
+    return lambda: land, lambda land: land.get_map_as_array()
+
+
+def bench_predicate(predicate, state):
+    # time of N_BLOCKS calls of a Land predicate, with the cached structures of the land already built
+    def bench(size, fill):
+        land = make_land(IsobenefitScenario, size, fill)
+        blocks = sample_blocks(land, state)
+        getattr(land, predicate)(*blocks[0])
+
+        def run(land):
+            for x, y in blocks:
+                getattr(land, predicate)(x, y)
+
+        return lambda: land, run
+
+    return bench
+
+
+def bench_set_current_counts(urbanism_model):
+    # counts computed from scratch, as on the first step or after a modification of the whole grid
+    def bench(size, fill):
+        land = make_land(IsobenefitScenario, size, fill)
+
+        def setup():
+            land.grid.touch()
+            return land
+
+        return setup, lambda land: land.set_current_counts(urbanism_model)
+
+    return bench
+
+
+def bench_update_map(scenario, urbanism_model, kernel):
+    def bench(size, fill):
+        def setup():
+            land = make_land(scenario, size, fill, kernel=kernel)
+            land.set_current_counts(urbanism_model)
+            return land
+
+        return setup, lambda land: land.update_map()
+
+    return bench
+
+
+def bench_steps(kernel, n_steps=100, workers=1):
+    # n_steps steps of the isobenefit model from a single centrality, with the counts of every step and no output,
+    # to compare the kernels on the maps of a simulation. The fill fraction does not apply
+    def bench(size, fill):
+        def setup():
+            land = IsobenefitScenario(size_x=size, size_y=size, T_star=T_STAR, neighboring_centrality_probability=5e-3,
+                                      isolated_centrality_probability=1e-1, max_population=10 ** 9, random_seed=0,
+                                      kernel=kernel, workers=workers)
+            land.set_centralities([MapBlock(size // 2, size // 2)])
+            return land
+
+        def run(land):
+            for _ in range(n_steps):
+                land.set_current_counts('isobenefit')
+                land.update_map()
+
+        return setup, run, lambda land: land.close()
+
+    return bench
+
+
+def bench_update_map_snapshot(size, fill):
+    land = make_land(IsobenefitScenario, size, fill)
+    canvas = np.empty((size, size, 4), dtype=np.uint8)
+    return lambda: land, lambda land: update_map_snapshot(land, canvas)
+
+
+def bench_simulation(urbanism_model, n_steps=5):
+    # n_steps steps of run_isobenefit_simulation from a single centrality, with the default outputs. The fill fraction
+    # does not apply
+    def bench(size, fill):
+        # each repetition runs in a new temporary directory, created and removed out of the timing
+        def run(directory):
+            cwd = os.getcwd()
+            os.chdir(directory.name)
+            try:
+                run_isobenefit_simulation(size, size, n_steps - 1, 'benchmark', 0.5, 5e-3, 1e-1, T_STAR, 0, None,
+                                          'list', 10 ** 9, 10000, urbanism_model, (0.7, 0.3, 0), (1, 0.1, 0.01))
+            finally:
+                os.chdir(cwd)
+
+        return tempfile.TemporaryDirectory, run, lambda directory: directory.cleanup()
+
+    return bench
+
+
+BENCHMARKS = {'get_map_as_array': bench_get_map_as_array,
+              'nature_stays_extended': bench_predicate('nature_stays_extended', NATURE),
+              'nature_stays_reachable': bench_predicate('nature_stays_reachable', NATURE),
+              'is_centrality_near': bench_predicate('is_centrality_near', None),
+              'set_current_counts_isobenefit': bench_set_current_counts('isobenefit'),
+              'set_current_counts_classical': bench_set_current_counts('classical'),
+              'update_map_isobenefit': bench_update_map(IsobenefitScenario, 'isobenefit', 'python'),
+              'update_map_isobenefit_numba': bench_update_map(IsobenefitScenario, 'isobenefit', 'numba'),
+              'update_map_classical': bench_update_map(ClassicalScenario, 'classical', 'python'),
+              'update_map_classical_vectorized': bench_update_map(ClassicalScenario, 'classical', 'vectorized'),
+              'steps_isobenefit': bench_steps('python'),
+              'steps_isobenefit_numba': bench_steps('numba'),
+              'steps_isobenefit_tiled': bench_steps('tiled'),
+              'steps_isobenefit_tiled_2_workers': bench_steps('tiled', workers=2),
+              'steps_isobenefit_tiled_4_workers': bench_steps('tiled', workers=4),
+              'update_map_snapshot': bench_update_map_snapshot,
+              'simulation_isobenefit': bench_simulation('isobenefit'),
+              'simulation_classical': bench_simulation('classical')}
+
+
+def time_benchmark(bench, size, fill, repeat):
+    setup, run, *teardown = bench(size, fill)
+    teardown = teardown[0] if teardown else lambda argument: None
+    # one untimed run first, e.g. for numba to compile
+    argument = setup()
+    run(argument)
+    teardown(argument)
+    times = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+        teardown(argument)
+    return {'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times)),
+            'max': max(times), 'repeat': repeat}
+
+
+def get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(names, sizes, fills, repeat, output_filepath):
+    # times every benchmark on every size and fill fraction, and saves the results as JSON, with the revision and
+    # the machine they were measured on
+    results = []
+    for name in names:
+        if name.endswith('_numba') and compiled_isobenefit_sweep() is None:
+            print(f"{name:32s} skipped: numba is not installed")
+            continue
+        for size in sizes:
+            for fill in (fills if not name.startswith(('simulation', 'steps')) else [0]):
+                timing = time_benchmark(BENCHMARKS[name], size, fill, repeat)
+                results.append(dict({'benchmark': name, 'size': size, 'fill': fill}, **timing))
+                print(f"{name:32s} size={size:5d} fill={fill:.2f} min={timing['min']:.6f}s "
+                      f"median={timing['median']:.6f}s", flush=True)
+
+    report = {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+              'revision': get_revision(),
+              'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                          'cpu_count': os.cpu_count(), 'python': platform.python_version(),
+                          'numpy': np.__version__},
+              'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    with open(output_filepath, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def compare(report, baseline_filepath):
+    # ratio of the median times of the report to the ones of a previous report, for the cases found in both
+    with open(baseline_filepath) as f:
+        baseline = {(r['benchmark'], r['size'], r['fill']): r for r in json.load(f)['results']}
+    for result in report['results']:
+        previous = baseline.get((result['benchmark'], result['size'], result['fill']))
+        if previous is not None:
+            print(f"{result['benchmark']:32s} size={result['size']:5d} fill={result['fill']:.2f} "
+                  f"{result['median'] / previous['median']:.2f}x")
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="""Time the hot paths of the simulation on maps of several sizes and fill fractions.
+        """,
+        epilog="Example: python benchmarks/run_benchmarks.py --sizes 50 100 --benchmarks update_map_isobenefit",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument('--benchmarks',
+                        nargs='+',
+                        choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help="benchmarks to run, all by default")
+
+    parser.add_argument('--sizes',
+                        nargs='+',
+                        type=int,
+                        default=SIZES,
+                        help="side of the square maps")
+
+    parser.add_argument('--fills',
+                        nargs='+',
+                        type=float,
+                        default=FILLS,
+                        help="fractions of built blocks of the maps")
+
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help="number of timed runs of each case")
+
+    parser.add_argument('--output',
+                        type=str,
+                        help="JSON file of the results, by default under benchmarks/results")
+
+    parser.add_argument('--compare',
+                        type=str,
+                        help="JSON file of previous results, to print the ratio of the new times to them")
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = create_arg_parser().parse_args()
+    # the simulation logs every step
+    logging.disable(logging.INFO)
+    output = args.output or os.path.join(RESULTS_PATH, time.strftime("%Y%m%d-%H%M%S", time.localtime()) + '.json')
+    report = run_benchmarks(args.benchmarks, args.sizes, args.fills, args.repeat, output)
+    print(f"results written to {output}")
+    if args.compare is not None:
+        compare(report, args.compare)
@@ -0,0 +1,44 @@
+import argparse
+import os
+
+from src import logger
+from src.trajectory import export_snapshots
+
+LOGGER = logger.get_logger()
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="""Render the PNG snapshots of a simulation from its trajectory file.
+        """,
+        epilog="Example: python export-snapshots.py --output-path simulations/20200101-120000 --steps 10 20",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument('--output-path',
+                        required=True,
+                        type=str,
+                        help="folder of the simulation, where the snapshots are saved next to its trajectory.npz")
+
+    parser.add_argument('--steps',
+                        required=False,
+                        type=int,
+                        nargs='+',
+                        help="steps to render, by default all of them")
+
+    parser.add_argument('--compress-level',
+                        required=False,
+                        type=int,
+                        default=6,
+                        help="PNG compression level of the map snapshots, from 0 (fastest) to 9 (smallest)")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    LOGGER.info(args)
+    paths = export_snapshots(os.path.join(args.output_path, 'trajectory.npz'), args.output_path, steps=args.steps,
+                             compress_level=args.compress_level)
+    LOGGER.info(f"Saved {len(paths)} snapshots in {args.output_path}")
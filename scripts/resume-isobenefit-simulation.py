@@ -0,0 +1,49 @@
+import argparse
+
+from src import logger
+from src.simulation import resume_isobenefit_simulation
+
+LOGGER = logger.get_logger()
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="""Resume a simulation from its latest checkpoint.
+        """,
+        epilog="Example: python resume-isobenefit-simulation.py --output-path simulations/20200101-120000",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument('--output-path',
+                        required=True,
+                        type=str,
+                        help="folder of the simulation to resume, as in its metadata.json")
+
+    parser.add_argument('--snapshot-workers',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help="number of background threads writing the map snapshots")
+
+    parser.add_argument('--compress-level',
+                        required=False,
+                        type=int,
+                        default=6,
+                        help="PNG compression level of the map snapshots, from 0 (fastest) to 9 (smallest)")
+
+    parser.add_argument('--profile',
+                        required=False,
+                        type=str,
+                        choices=['cprofile', 'pyinstrument'],
+                        help="profile the simulation with cProfile (profile.prof and profile.txt in the output path) "
+                             "or pyinstrument, if installed (profile.html)")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    LOGGER.info(args)
+    resume_isobenefit_simulation(output_path=args.output_path, snapshot_workers=args.snapshot_workers,
+                                 compress_level=args.compress_level, profiler=args.profile)
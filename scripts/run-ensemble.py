@@ -0,0 +1,116 @@
+import argparse
+
+from src import logger
+from src.ensemble import run_ensemble_simulation
+
+LOGGER = logger.get_logger()
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="""Run an ensemble of simulations of the same model with different seeds in one process.
+        """,
+        epilog="Example: python run-ensemble.py --size-x 60 --size-y 60 --n-steps 50 --n-members 100",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument('--n-steps',
+                        required=True,
+                        type=int,
+                        help="number of steps for the simulation")
+
+    parser.add_argument('--size-x',
+                        required=True,
+                        type=int,
+                        help="width of the land map")
+
+    parser.add_argument('--size-y',
+                        required=True,
+                        type=int,
+                        help="height of the land map")
+
+    parser.add_argument('--n-members',
+                        required=True,
+                        type=int,
+                        help="number of simulations in the ensemble")
+
+    parser.add_argument('--output-path',
+                        required=False,
+                        type=str,
+                        help="output path to store simulation results")
+
+    parser.add_argument('--build-probability',
+                        required=False,
+                        type=float,
+                        default=0.5,
+                        help="probability of building a new block")
+
+    parser.add_argument('--neighboring-centrality-probability',
+                        required=False,
+                        type=float,
+                        default=5e-3,
+                        help="probability of building a new centrality next to a constructed area")
+
+    parser.add_argument('--isolated-centrality-probability',
+                        required=False,
+                        type=float,
+                        default=1e-1,
+                        help="probability of building a new centrality in a natural area")
+
+    parser.add_argument('--T',
+                        required=False,
+                        type=int,
+                        default=10,
+                        help="standard maximum distance from centralities and nature")
+
+    parser.add_argument('--random-seed',
+                        required=False,
+                        type=int,
+                        default=42,
+                        help="root of the random seeds of the members")
+
+    parser.add_argument('--input-filepath',
+                        required=False,
+                        type=str,
+                        help="image filepath for initial configuration")
+
+    parser.add_argument('--initialization-mode',
+                        required=False,
+                        type=str,
+                        default='list',
+                        help="initial configuration can be set via an input image or via a list of initial centralities")
+
+    parser.add_argument('--max-population',
+                        required=False,
+                        type=int,
+                        default=1000000,
+                        help="maximum population reachable by each simulation")
+
+    parser.add_argument('--max-ab-km2',
+                        required=False,
+                        type=int,
+                        default=10000,
+                        help="maximum population density (ab/km^2) in the simulation")
+
+    parser.add_argument('--urbanism-model',
+                        required=False,
+                        type=str,
+                        default='classical',
+                        help="City urbanism model. Choose one of 'isobenefit' and 'classical'")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    LOGGER.info(args)
+    run_ensemble_simulation(size_x=args.size_x, size_y=args.size_y, n_steps=args.n_steps,
+                            output_path_prefix=args.output_path, n_members=args.n_members,
+                            build_probability=args.build_probability,
+                            neighboring_centrality_probability=args.neighboring_centrality_probability,
+                            isolated_centrality_probability=args.isolated_centrality_probability, T_star=args.T,
+                            random_seed=args.random_seed, input_filepath=args.input_filepath,
+                            initialization_mode=args.initialization_mode, max_population=args.max_population,
+                            max_ab_km2=args.max_ab_km2, prob_distribution=(0.7, 0.3, 0),
+                            density_factors=(1, 0.1, 0.01), urbanism_model=args.urbanism_model)
@@ -1,5 +1,7 @@
 import argparse
 
+from PIL import Image
+
 from src import logger
 from src.simulation import run_isobenefit_simulation
 
@@ -71,6 +73,12 @@ def create_arg_parser():
                         type=str,
                         help="image filepath for initial configuration")
 
+    parser.add_argument('--max-image-pixels',
+                        required=False,
+                        type=int,
+                        help="number of pixels above which Pillow reports an input image as a decompression bomb, "
+                             "by default its own limit. Images of more than twice this number are refused")
+
     parser.add_argument('--initialization-mode',
                         required=True,
                         type=str,
@@ -94,6 +102,82 @@ def create_arg_parser():
                         default='isobenefit',
                         help="City urbanism model. Choose one of 'isobenefit' and 'standard'")
 
+    parser.add_argument('--kernel',
+                        required=False,
+                        type=str,
+                        default='python',
+                        help="implementation of the map update. 'vectorized' is available for the classical model, "
+                             "'tiled' (experimental, tiles checked on --workers processes) and 'numba' (compiled, needs "
+                             "numba) for the isobenefit model")
+
+    parser.add_argument('--workers',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help="number of processes of the 'tiled' kernel, which have not been measured to be faster than "
+                             "one")
+
+    parser.add_argument('--storage',
+                        required=False,
+                        type=str,
+                        default='memory',
+                        help="where the grid arrays live: 'memory', or 'grid-files' for memory-mapped files under the "
+                             "output path, which can be read while the simulation runs. The distance fields, nature "
+                             "topology and step masks stay in RAM, so that the map must still fit in memory")
+
+    parser.add_argument('--tile-rows',
+                        required=False,
+                        type=int,
+                        help="number of map rows processed at once in a step, by default the whole map")
+
+    parser.add_argument('--checkpoint-interval',
+                        required=False,
+                        type=int,
+                        help="save a checkpoint every given number of steps, to resume the simulation with "
+                             "scripts/resume-isobenefit-simulation.py, not with --metrics-format parquet")
+
+    parser.add_argument('--snapshot-workers',
+                        required=False,
+                        type=int,
+                        default=1,
+                        help="number of background threads writing the map snapshots")
+
+    parser.add_argument('--compress-level',
+                        required=False,
+                        type=int,
+                        default=6,
+                        help="PNG compression level of the map snapshots, from 0 (fastest) to 9 (smallest)")
+
+    parser.add_argument('--snapshots',
+                        action='store_true',
+                        help="also save a PNG snapshot per step while running. By default only the trajectory file is "
+                             "saved, from which scripts/export-snapshots.py renders the snapshots")
+
+    parser.add_argument('--no-distances-csv',
+                        action='store_true',
+                        help="do not write the distances of the built blocks to minimal_distances_map.csv, only "
+                             "the distance maps to minimal_distances.npz")
+
+    parser.add_argument('--timings',
+                        action='store_true',
+                        help="write the time spent in each phase of every step, with the number of candidate blocks "
+                             "and of predicate rejections, to timings.csv")
+
+    parser.add_argument('--profile',
+                        required=False,
+                        type=str,
+                        choices=['cprofile', 'pyinstrument'],
+                        help="profile the simulation with cProfile (profile.prof and profile.txt in the output path) "
+                             "or pyinstrument, if installed (profile.html)")
+
+    parser.add_argument('--metrics-format',
+                        required=False,
+                        type=str,
+                        default='csv',
+                        choices=['csv', 'npy', 'parquet'],
+                        help="format of current_counts and timings: text (csv), a numpy record array (npy) or "
+                             "Parquet, if pyarrow is installed")
+
     return parser
 
 
@@ -114,11 +198,31 @@ if __name__ == "__main__":
     max_population = args.max_population
     max_ab_km2 = args.max_ab_km2
     urbanism_model = args.urbanism_model
+    kernel = args.kernel
+    snapshot_workers = args.snapshot_workers
+    compress_level = args.compress_level
+    save_snapshots = args.snapshots
+    save_distances_csv = not args.no_distances_csv
+    storage = args.storage
+    tile_rows = args.tile_rows
+    checkpoint_interval = args.checkpoint_interval
+    workers = args.workers
+    timings = args.timings
+    profiler = args.profile
+    metrics_format = args.metrics_format
     LOGGER.info(args)
+    if args.max_image_pixels is not None:
+        # set once before the run, as the limit is global to Pillow
+        Image.MAX_IMAGE_PIXELS = args.max_image_pixels
     run_isobenefit_simulation(size_x=size_x, size_y=size_y, n_steps=n_steps, output_path_prefix=output_path,
                               build_probability=build_probability,
                               neighboring_centrality_probability=neighboring_centrality_probability,
                               isolated_centrality_probability=isolated_centrality_probability, T_star=T,
                               random_seed=random_seed, input_filepath=input_file_path,
                               initialization_mode=initialization_mode, max_population=max_population,
-                              max_ab_km2=max_ab_km2, urbanism_model=urbanism_model)
+                              max_ab_km2=max_ab_km2, urbanism_model=urbanism_model, kernel=kernel,
+                              snapshot_workers=snapshot_workers, compress_level=compress_level,
+                              save_snapshots=save_snapshots, storage=storage, tile_rows=tile_rows,
+                              checkpoint_interval=checkpoint_interval, workers=workers, timings=timings,
+                              profiler=profiler, metrics_format=metrics_format,
+                              save_distances_csv=save_distances_csv)
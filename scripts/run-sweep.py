@@ -0,0 +1,42 @@
+import argparse
+
+from src import logger
+from src.sweep import load_sweep_spec, run_sweep
+
+LOGGER = logger.get_logger()
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="""Run a parameter sweep of simulations on a pool of processes.
+        """,
+        epilog="Example: python run-sweep.py --spec sweep.json --workers 8",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument('--spec',
+                        required=True,
+                        type=str,
+                        help="JSON or YAML file describing the sweep, with the keys 'base', 'grid', 'runs', "
+                             "'repetitions', 'seed' and 'name'")
+
+    parser.add_argument('--output-path',
+                        required=False,
+                        type=str,
+                        help="output path of the sweep, by default its name in the spec. One of them is required")
+
+    parser.add_argument('--workers',
+                        required=False,
+                        type=int,
+                        help="number of simulations run at the same time, by default the number of cores")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    LOGGER.info(args)
+    spec = load_sweep_spec(args.spec)
+    summary_filepath = run_sweep(spec, output_path_prefix=args.output_path, workers=args.workers)
+    LOGGER.info(f"sweep summary written to {summary_filepath}")
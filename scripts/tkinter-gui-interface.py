@@ -1,6 +1,14 @@
+import queue
+import threading
 import tkinter as tk
 
-from src.simulation import run_isobenefit_simulation
+from src.image_io import render_grid
+from src.simulation import StepConsumer, run_isobenefit_simulation
+
+# time between two refreshes of the map, in milliseconds
+REFRESH_INTERVAL = 40
+# largest side of the map on the screen, in pixels
+CANVAS_SIZE = 480
 
 args_types = {'urbanism_model': str,
               'size_x': int,
@@ -127,14 +135,11 @@ def make_density_parameters_entries(root):
     return density_paramenters
 
 
-def simluation_wrapper(entries, arguments_types):
+def read_arguments(entries, arguments_types):
     input_args = {}
-    print(entries)
     for entry_name, entry_widget in entries.items():
-        print(entry_name)
         _dtype = arguments_types[entry_name]
         if entry_name == 'prob_distribution':
-            print(entry_widget)
             input_args['prob_distribution'] = (
             _dtype(entry_widget['high_prob'].get()), _dtype(entry_widget['medium_prob'].get()),
             _dtype(entry_widget['low_prob'].get()))
@@ -146,17 +151,153 @@ def simluation_wrapper(entries, arguments_types):
             input_args[entry_name] = _dtype(entry_widget.get())
 
     input_args.update({'input_filepath': None, 'initialization_mode': 'list', 'output_path_prefix': None})
-    run_isobenefit_simulation(**input_args)
+    return input_args
+
+
+class SimulationCancelled(Exception):
+    pass
+
+
+class LiveConsumer(StepConsumer):
+    # hands the maps of the steps over to the GUI through frames, a queue of at most one frame: a step only copies
+    # its map when the previous frame has been displayed, so that the simulation never waits for the display. The
+    # map of the last step is always handed over. Steps wait while resumed is cleared, and stop once cancelled is set.
+
+    def __init__(self, frames, resumed, cancelled):
+        self.frames = frames
+        self.resumed = resumed
+        self.cancelled = cancelled
+        self._last_record = None
+
+    def consume(self, record):
+        self.resumed.wait()
+        if self.cancelled.is_set():
+            raise SimulationCancelled()
+        self._last_record = record
+        if self.frames.empty():
+            self.frames.put_nowait(self._frame(record))
+
+    def close(self):
+        if self._last_record is not None:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                pass
+            self.frames.put_nowait(self._frame(self._last_record))
+
+    @staticmethod
+    def _frame(record):
+        grid = record.grid
+        return record.iteration, record.counts['current_population'], grid.state.copy(), grid.density.copy()
+
+
+class LiveSimulation:
+    # runs simulations on a worker thread, and draws the latest map they handed over on canvas every
+    # REFRESH_INTERVAL milliseconds
+
+    def __init__(self, root, canvas, status, buttons):
+        self.root = root
+        self.canvas = canvas
+        self.status = status
+        self.buttons = buttons
+        self.frames = queue.Queue(maxsize=1)
+        self.resumed = threading.Event()
+        self.cancelled = threading.Event()
+        self._thread = None
+        self._outcome = None
+        self._image = None
+        self._image_item = canvas.create_image(0, 0, anchor=tk.NW)
+
+    def start(self, arguments):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.resumed.set()
+        self.cancelled.clear()
+        self._thread = threading.Thread(target=self._run, args=(arguments,), daemon=True)
+        self._thread.start()
+        self.buttons['run'].configure(state=tk.DISABLED)
+        self.buttons['pause'].configure(state=tk.NORMAL, text='Pause')
+        self.buttons['cancel'].configure(state=tk.NORMAL)
+        self.status.configure(text='Running')
+        self.root.after(REFRESH_INTERVAL, self._poll)
+
+    def toggle_pause(self):
+        if self.resumed.is_set():
+            self.resumed.clear()
+            self.buttons['pause'].configure(text='Resume')
+        else:
+            self.resumed.set()
+            self.buttons['pause'].configure(text='Pause')
+
+    def cancel(self):
+        self.cancelled.set()
+        self.resumed.set()
+
+    def _run(self, arguments):
+        consumer = LiveConsumer(self.frames, self.resumed, self.cancelled)
+        try:
+            run_isobenefit_simulation(**arguments, consumers=[consumer])
+            self._outcome = 'Simulation ended'
+        except SimulationCancelled:
+            self._outcome = 'Simulation cancelled'
+        except Exception as error:
+            self._outcome = f"Simulation failed: {error}"
+
+    def _poll(self):
+        try:
+            self._draw(*self.frames.get_nowait())
+        except queue.Empty:
+            pass
+        if self._thread.is_alive() or not self.frames.empty():
+            self.root.after(REFRESH_INTERVAL, self._poll)
+        else:
+            self.status.configure(text=self._outcome)
+            self.buttons['run'].configure(state=tk.NORMAL)
+            self.buttons['pause'].configure(state=tk.DISABLED, text='Pause')
+            self.buttons['cancel'].configure(state=tk.DISABLED)
+
+    def _draw(self, iteration, population, state, density):
+        # the map as a binary PPM image, scaled up by a whole factor to fit the canvas
+        rgb = render_grid(state, density)[..., :3]
+        scale = max(1, CANVAS_SIZE // max(rgb.shape[:2]))
+        rgb = rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+        header = f"P6 {rgb.shape[1]} {rgb.shape[0]} 255\n".encode()
+        self._image = tk.PhotoImage(data=header + rgb.tobytes(), format='PPM')
+        self.canvas.itemconfigure(self._image_item, image=self._image)
+        self.canvas.configure(width=rgb.shape[1], height=rgb.shape[0])
+        self.status.configure(text=f"step: {iteration}, population: {population:.0f}")
+
+
+def start_simulation(live_simulation, entries, arguments_types):
+    try:
+        arguments = read_arguments(entries, arguments_types)
+    except ValueError as error:
+        live_simulation.status.configure(text=f"Invalid parameter: {error}")
+        return
+    live_simulation.start(arguments)
 
 
 if __name__ == '__main__':
     root = tk.Tk()
 
-    ents = make_interface(root, string_inputs)
-    print(ents)
-    run_button = tk.Button(root, text='Run simulation',
-                           command=(lambda e=ents: simluation_wrapper(e, args_types)))
-    run_button.pack(side=tk.LEFT, padx=5, pady=5)
-    quit_button = tk.Button(root, text='Quit', command=root.quit)
-    quit_button.pack(side=tk.LEFT, padx=5, pady=5)
+    form = tk.Frame(root)
+    form.pack(side=tk.LEFT, fill=tk.Y)
+    view = tk.Frame(root)
+    view.pack(side=tk.RIGHT, fill=tk.BOTH, expand=tk.YES)
+    canvas = tk.Canvas(view, width=CANVAS_SIZE, height=CANVAS_SIZE)
+    canvas.pack(side=tk.TOP, padx=5, pady=5)
+    status = tk.Label(view, text='', anchor='w')
+    status.pack(side=tk.TOP, fill=tk.X, padx=5)
+
+    ents = make_interface(form, string_inputs)
+    buttons = {'run': tk.Button(form, text='Run simulation'),
+               'pause': tk.Button(form, text='Pause', state=tk.DISABLED),
+               'cancel': tk.Button(form, text='Cancel', state=tk.DISABLED),
+               'quit': tk.Button(form, text='Quit', command=root.quit)}
+    live_simulation = LiveSimulation(root, canvas, status, buttons)
+    buttons['run'].configure(command=lambda e=ents: start_simulation(live_simulation, e, args_types))
+    buttons['pause'].configure(command=live_simulation.toggle_pause)
+    buttons['cancel'].configure(command=live_simulation.cancel)
+    for button in buttons.values():
+        button.pack(side=tk.LEFT, padx=5, pady=5)
     root.mainloop()
@@ -0,0 +1,55 @@
+import numpy as np
+
+from src.grid_state import NATURE, CENTRALITY
+
+
+class ChangeSet:
+    # blocks modified by a land update, as flat indices into the grid with their state, density level and
+    # inhabitants before and after the update
+
+    def __init__(self, shape, indices, old_state, new_state, old_density, new_density, old_inhabitants,
+                 new_inhabitants):
+        self.shape = shape
+        self.indices = indices
+        self.old_state = old_state
+        self.new_state = new_state
+        self.old_density = old_density
+        self.new_density = new_density
+        self.old_inhabitants = old_inhabitants
+        self.new_inhabitants = new_inhabitants
+
+    @classmethod
+    def from_journal(cls, journal, grid):
+        # journal entries are (indices, state, density, inhabitants) arrays recorded before each modification:
+        # the first entry of a block holds its value before the update. Blocks left unchanged are dropped.
+        empty = np.zeros(0, dtype=np.intp)
+        journal = [(empty, grid.state.flat[empty], grid.density.flat[empty], grid.inhabitants.flat[empty])] + journal
+        indices, state, density, inhabitants = [np.concatenate(entries) for entries in zip(*journal)]
+        indices, first = np.unique(indices, return_index=True)
+        old_state, old_density, old_inhabitants = state[first], density[first], inhabitants[first]
+        new_state = grid.state.flat[indices]
+        new_density = grid.density.flat[indices]
+        new_inhabitants = grid.inhabitants.flat[indices]
+        changed = (old_state != new_state) | (old_density != new_density) | (old_inhabitants != new_inhabitants)
+        return cls(grid.state.shape, indices[changed], old_state[changed], new_state[changed], old_density[changed],
+                   new_density[changed], old_inhabitants[changed], new_inhabitants[changed])
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def x(self):
+        return np.unravel_index(self.indices, self.shape)[0]
+
+    @property
+    def y(self):
+        return np.unravel_index(self.indices, self.shape)[1]
+
+    @property
+    def added_blocks(self):
+        return int(np.count_nonzero((self.old_state == NATURE) & (self.new_state != NATURE) &
+                                    (self.new_state != CENTRALITY)))
+
+    @property
+    def added_centralities(self):
+        return int(np.count_nonzero((self.old_state != CENTRALITY) & (self.new_state == CENTRALITY)))
@@ -0,0 +1,33 @@
+import json
+import os
+
+import numpy as np
+
+CHECKPOINT_FILENAME = 'checkpoint.npz'
+
+
+def save_checkpoint(output_path, land, iteration, trajectory_position):
+    # the land state at the end of an iteration, with the position of the trajectory file at that point. The file
+    # is written next to the previous checkpoint and renamed over it, so a checkpoint is either complete or absent.
+    arrays, values = land.get_checkpoint()
+    offset, directory = trajectory_position
+    values['iteration'] = iteration
+    values['trajectory_offset'] = offset
+    arrays['trajectory_directory'] = np.frombuffer(directory, dtype=np.uint8)
+    arrays['values'] = np.array(json.dumps(values))
+    filepath = os.path.join(output_path, CHECKPOINT_FILENAME)
+    with open(f"{filepath}.tmp", 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{filepath}.tmp", filepath)
+    return filepath
+
+
+def load_checkpoint(output_path, land):
+    # restores the land saved by save_checkpoint and returns the iteration and the trajectory position
+    with np.load(os.path.join(output_path, CHECKPOINT_FILENAME), allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    values = json.loads(str(arrays.pop('values')))
+    land.restore_checkpoint(arrays, values)
+    return values['iteration'], (values['trajectory_offset'], arrays['trajectory_directory'].tobytes())
@@ -0,0 +1,193 @@
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+NO_SOURCE = np.iinfo(np.int32).max
+
+
+def to_distances(dist2):
+    # euclidean distances from squared distances, infinite where there is no source at all
+    distances = np.sqrt(dist2.astype(np.float64))
+    distances[dist2 == NO_SOURCE] = np.inf
+    return distances
+
+
+class DistanceField:
+    # exact squared euclidean distance of every cell from its nearest source cell, together with the flat
+    # index of that source. The field is updated locally when a single source is removed or added, so that it does
+    # not need to be recomputed over the whole map. When journal is a list, every update appends to it the flat
+    # indices of the modified cells with their previous squared distance; it is reset to None when it grows
+    # larger than an eighth of the map, beyond which reading it is slower than going through the whole field.
+
+    def __init__(self, sources):
+        self.shape = sources.shape
+        self.rebuild(sources)
+
+    @classmethod
+    def from_arrays(cls, sources, dist2, nearest, radius_bound):
+        # field saved with its arrays (e.g. in a checkpoint), with an empty journal
+        field = cls.__new__(cls)
+        field.shape = sources.shape
+        field.sources = np.array(sources, dtype=bool)
+        field.dist2 = np.array(dist2, dtype=np.int32)
+        field.nearest = np.array(nearest, dtype=np.int32)
+        field.radius_bound = int(radius_bound)
+        field.start_journal()
+        return field
+
+    def rebuild(self, sources):
+        self.journal = None
+        self._journal_size = 0
+        self.sources = np.array(sources, dtype=bool)
+        if self.sources.any():
+            indices = distance_transform_edt(~self.sources, return_distances=False, return_indices=True)
+            rows, cols = np.indices(self.shape)
+            self.dist2 = ((rows - indices[0]) ** 2 + (cols - indices[1]) ** 2).astype(np.int32)
+            self.nearest = np.ravel_multi_index(indices, self.shape).astype(np.int32)
+        else:
+            self.dist2 = np.full(self.shape, NO_SOURCE, dtype=np.int32)
+            self.nearest = np.full(self.shape, -1, dtype=np.int32)
+        self.radius_bound = self._radius(self.dist2.max())
+
+    def start_journal(self):
+        self.journal = []
+        self._journal_size = 0
+
+    def _record(self, indices, dist2):
+        if self.journal is None:
+            return
+        self._journal_size += len(indices)
+        if self._journal_size > self.dist2.size // 8:
+            self.journal = None
+        else:
+            self.journal.append((indices, dist2))
+
+    def distances(self, mask):
+        return to_distances(self.dist2[mask])
+
+    def _radius(self, dist2):
+        if dist2 == NO_SOURCE:
+            return max(self.shape)
+        return int(np.ceil(np.sqrt(dist2)))
+
+    def _window(self, x, y, radius):
+        return (max(x - radius, 0), min(x + radius + 1, self.shape[0]),
+                max(y - radius, 0), min(y + radius + 1, self.shape[1]))
+
+    def without_source(self, x, y):
+        # returns the flat indices of the cells whose nearest source is (x,y), with their squared distances and
+        # nearest sources once (x,y) is removed. The field itself is not modified.
+        return self.without_sources(np.array([x]), np.array([y]))
+
+    def without_sources(self, xs, ys):
+        # same as without_source, for the cells whose nearest source is any of the sources (xs, ys)
+        removed = np.ravel_multi_index((xs, ys), self.shape)
+        x0, x1, y0, y1 = self._window(xs.min(), ys.min(), self.radius_bound)
+        x1, y1 = self._window(xs.max(), ys.max(), self.radius_bound)[1::2]
+        ax, ay = np.nonzero(np.isin(self.nearest[x0:x1, y0:y1], removed))
+        ax += x0
+        ay += y0
+        affected = np.ravel_multi_index((ax, ay), self.shape)
+        if len(affected) == 0:
+            return affected, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+        # nearest sources are searched in a box around the affected cells, which is enlarged until every
+        # distance found is certainly shorter than the distance to any source outside of the box.
+        pad = self.radius_bound + 1
+        while True:
+            r0, r1 = max(ax.min() - pad, 0), min(ax.max() + pad + 1, self.shape[0])
+            c0, c1 = max(ay.min() - pad, 0), min(ay.max() + pad + 1, self.shape[1])
+            covers_map = r0 == 0 and c0 == 0 and r1 == self.shape[0] and c1 == self.shape[1]
+            local_sources = self.sources[r0:r1, c0:c1].copy()
+            local_sources[xs - r0, ys - c0] = False
+            if local_sources.any():
+                indices = distance_transform_edt(~local_sources, return_distances=False, return_indices=True)
+                nx = indices[0][ax - r0, ay - c0] + r0
+                ny = indices[1][ax - r0, ay - c0] + c0
+                new_dist2 = (ax - nx) ** 2 + (ay - ny) ** 2
+                margin = np.full(len(ax), np.inf)
+                if r0 > 0:
+                    margin = np.minimum(margin, ax - r0 + 1)
+                if r1 < self.shape[0]:
+                    margin = np.minimum(margin, r1 - ax)
+                if c0 > 0:
+                    margin = np.minimum(margin, ay - c0 + 1)
+                if c1 < self.shape[1]:
+                    margin = np.minimum(margin, c1 - ay)
+                if covers_map or (new_dist2 <= margin ** 2).all():
+                    new_nearest = np.ravel_multi_index((nx, ny), self.shape)
+                    return affected, new_dist2.astype(np.int32), new_nearest.astype(np.int32)
+            elif covers_map:
+                return (affected, np.full(len(affected), NO_SOURCE, dtype=np.int32),
+                        np.full(len(affected), -1, dtype=np.int32))
+            pad *= 2
+
+    def remove_source(self, x, y, removal=None):
+        return self.remove_sources(np.array([x]), np.array([y]), removal)
+
+    def remove_sources(self, xs, ys, removal=None):
+        # sources far apart are removed by groups of nearby ones, so that the update of each group only covers the
+        # cells around it. The cells affected by several groups are then returned once per group, the last time with
+        # their final values. When the windows of the groups cover more than the map, the field is computed again
+        # as a whole, and only the cells that changed are returned
+        if removal is None and len(xs) > 1:
+            size = 4 * (self.radius_bound + 1)
+            groups = (xs // size) * (self.shape[1] // size + 1) + ys // size
+            order = np.argsort(groups, kind='stable')
+            bounds = np.flatnonzero(np.diff(groups[order])) + 1
+            if (len(bounds) + 1) * (size + 2 * self.radius_bound + 3) ** 2 > self.dist2.size:
+                sources = self.sources.copy()
+                sources[xs, ys] = False
+                changed = self._rebuild_recorded(sources)
+                return changed, self.dist2.flat[changed], self.nearest.flat[changed]
+            if len(bounds) > 0:
+                removals = [self.remove_sources(xs[group], ys[group]) for group in np.split(order, bounds)]
+                return tuple(np.concatenate(arrays) for arrays in zip(*removals))
+        if removal is None:
+            removal = self.without_sources(xs, ys)
+        affected, new_dist2, new_nearest = removal
+        self._record(affected, self.dist2.flat[affected])
+        self.sources[xs, ys] = False
+        self.dist2.flat[affected] = new_dist2
+        self.nearest.flat[affected] = new_nearest
+        if len(new_dist2) > 0:
+            self.radius_bound = max(self.radius_bound, self._radius(new_dist2.max()))
+        return removal
+
+    def add_source(self, x, y):
+        if self.sources[x, y]:
+            return
+        no_sources = not self.sources.any()
+        self.sources[x, y] = True
+        # only cells closer to (x,y) than radius_bound can get closer to the new source than to their current one
+        x0, x1, y0, y1 = self._window(x, y, self.radius_bound)
+        rows, cols = np.ogrid[x0:x1, y0:y1]
+        dist2 = (rows - x) ** 2 + (cols - y) ** 2
+        window_dist2 = self.dist2[x0:x1, y0:y1]
+        closer = dist2 < window_dist2
+        rows, cols = np.nonzero(closer)
+        self._record(np.ravel_multi_index((rows + x0, cols + y0), self.shape), window_dist2[closer])
+        window_dist2[closer] = dist2[closer]
+        self.nearest[x0:x1, y0:y1][closer] = np.ravel_multi_index((x, y), self.shape)
+        if no_sources:
+            self.radius_bound = self._radius(self.dist2.max())
+
+    def add_sources(self, xs, ys):
+        # same as add_source for the sources (xs, ys). When their windows cover more than the map, the field is
+        # computed again as a whole, and only the cells that changed are recorded
+        if len(xs) * (2 * self.radius_bound + 1) ** 2 <= self.dist2.size:
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self.add_source(x, y)
+            return
+        sources = self.sources.copy()
+        sources[xs, ys] = True
+        self._rebuild_recorded(sources)
+
+    def _rebuild_recorded(self, sources):
+        # computes the field again for the given sources, and records and returns the cells that changed distance
+        dist2 = self.dist2
+        journal, journal_size = self.journal, self._journal_size
+        self.rebuild(sources)
+        self.journal, self._journal_size = journal, journal_size
+        changed = np.flatnonzero(self.dist2 != dist2)
+        self._record(changed, dist2.flat[changed])
+        return changed
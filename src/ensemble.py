@@ -0,0 +1,210 @@
+import csv
+import os
+import time
+
+import numpy as np
+
+from src import logger
+from src.grid_state import GRID_ARRAYS, NATURE, BUILT, CENTRALITY, DENSITY_CODES
+from src.initialization_utils import get_central_coord
+from src.kernels import any_neighbor, classical_step, isobenefit_candidates
+from src.land_map import DENSITY_LEVEL_CODES, ClassicalScenario, IsobenefitScenario
+from src.metrics import counts_dtype
+from src.simulation import make_output_path, save_metadata, initialize_land, spawn_seeds
+
+
+class Ensemble:
+    # K independent maps of the same scenario stacked in (K, size_x, size_y) arrays, whose steps select the candidate
+    # blocks of all the members at once. Member k is a land of the scenario with random_seed=random_seeds[k], starting
+    # from the same grid, whose grid arrays are views of the stacked ones: it keeps its distance fields and counts up
+    # to date from its own changes, and follows the same rules and random draws as a separate run of the scenario.
+    # Members whose population exceeds max_population stop growing.
+    SCENARIO = None
+    URBANISM_MODEL = None
+    KERNEL = None
+
+    def __init__(self, grid, random_seeds, build_probability=0.5, neighboring_centrality_probability=5e-3,
+                 isolated_centrality_probability=1e-1, T_star=5, max_population=500000, max_ab_km2=10000,
+                 prob_distribution=(0.7, 0.3, 0), density_factors=(1, 0.1, 0.01)):
+        self.n_members = len(random_seeds)
+        self.size_x, self.size_y = grid.state.shape
+        for name in GRID_ARRAYS:
+            setattr(self, name, np.repeat(getattr(grid, name)[None], self.n_members, axis=0))
+        self.members = []
+        for k, seed in enumerate(random_seeds):
+            member = self.SCENARIO(self.size_x, self.size_y, build_probability=build_probability,
+                                   neighboring_centrality_probability=neighboring_centrality_probability,
+                                   isolated_centrality_probability=isolated_centrality_probability, T_star=T_star,
+                                   max_population=max_population, max_ab_km2=max_ab_km2,
+                                   prob_distribution=prob_distribution, density_factors=density_factors,
+                                   random_seed=seed, kernel=self.KERNEL)
+            for name in GRID_ARRAYS:
+                setattr(member.grid, name, getattr(self, name)[k])
+            member.grid.touch()
+            self.members.append(member)
+        self.T_star = T_star
+        self.max_population = max_population
+        self.interior = self.members[0].get_interior_mask()
+
+        self.active = np.ones(self.n_members, dtype=bool)
+        self.statistics = {name: np.zeros(self.n_members) for name in self.member_statistics()}
+        self.set_current_counts()
+
+    @classmethod
+    def member_statistics(cls):
+        # statistics of each member, the columns of current_counts for the model of the ensemble
+        return counts_dtype(cls.URBANISM_MODEL).names[1:]
+
+    def draw_step(self):
+        # the random draws of every active member, stacked. Inactive members draw nothing: a uniform of 1 never
+        # passes the probability tests
+        uniform = np.ones((self.n_members, self.size_x, self.size_y))
+        density_levels = np.zeros((self.n_members, self.size_x, self.size_y), dtype=int)
+        for k in np.flatnonzero(self.active):
+            uniform[k], density_levels[k] = self.members[k].draw_step()
+        return uniform, density_levels
+
+    def set_current_counts(self):
+        # the statistics of Land.set_current_counts for every member, updated by the members whose map can change
+        for k in np.flatnonzero(self.active):
+            member = self.members[k]
+            member.set_current_counts(self.URBANISM_MODEL)
+            counts = member.get_current_counts(self.URBANISM_MODEL, 0, 0, 0)
+            for name in self.member_statistics()[2:]:
+                self.statistics[name][k] = counts[name]
+        self.active &= self.statistics['current_population'] <= self.max_population
+
+
+class ClassicalEnsemble(Ensemble):
+    # the rules of all the members are evaluated at once by the batched classical_step kernel, as in
+    # ClassicalScenario with kernel='vectorized'
+    SCENARIO = ClassicalScenario
+    URBANISM_MODEL = 'classical'
+    KERNEL = 'vectorized'
+
+    def update_map(self):
+        # one step of every active member. Returns the number of blocks and centralities added to each member.
+        uniform, density_levels = self.draw_step()
+        member = self.members[0]
+        enough_built_blocks = (self.statistics['current_built_blocks'] /
+                               self.statistics['current_centralities']) > 100
+        new_blocks, new_centralities, to_medium, to_high = classical_step(
+            self.state, self.density, uniform, self.interior, enough_built_blocks[:, None, None],
+            member.build_probability, member.neighboring_centrality_probability,
+            member.isolated_centrality_probability,
+            member.isolated_centrality_probability / np.sqrt(self.size_x * self.size_y))
+        for k in np.flatnonzero(self.active):
+            member = self.members[k]
+            member.set_blocks(new_blocks[k], BUILT, DENSITY_LEVEL_CODES[density_levels[k]])
+            member.set_blocks(to_medium[k], BUILT, DENSITY_CODES['medium'])
+            member.set_blocks(to_high[k], BUILT, DENSITY_CODES['high'])
+            member.set_blocks(new_centralities[k], CENTRALITY)
+        return np.count_nonzero(new_blocks, axis=(1, 2)), np.count_nonzero(new_centralities, axis=(1, 2))
+
+
+class IsobenefitEnsemble(Ensemble):
+    # the candidate blocks of all the members are selected at once by the batched isobenefit_candidates kernel,
+    # then every member checks its own candidates in order, with the compiled sweep of the 'numba' kernel. The
+    # members give the same maps as IsobenefitScenario with kernel='numba' or kernel='python'.
+    SCENARIO = IsobenefitScenario
+    URBANISM_MODEL = 'isobenefit'
+    KERNEL = 'numba'
+
+    def update_map(self):
+        # one step of every active member. Returns the number of blocks and centralities added to each member.
+        uniform, density_levels = self.draw_step()
+        member = self.members[0]
+        centrality_near = np.zeros((self.n_members, self.size_x, self.size_y), dtype=bool)
+        for k in np.flatnonzero(self.active):
+            centrality_near[k] = self.members[k].get_centrality_near_mask()
+        is_candidate, new_block = isobenefit_candidates(
+            (self.state == NATURE) & self.interior, any_neighbor(self.state != NATURE), centrality_near, uniform,
+            member.build_probability, member.neighboring_centrality_probability,
+            member.isolated_centrality_probability / (self.size_x * self.size_y))
+        built_blocks = np.count_nonzero(self.state == BUILT, axis=(1, 2))
+        centralities = np.count_nonzero(self.state == CENTRALITY, axis=(1, 2))
+        for k in np.flatnonzero(self.active):
+            x, y = np.nonzero(is_candidate[k])
+            self.members[k].update_candidates(x, y, new_block[k][x, y], density_levels[k][x, y])
+        return (np.count_nonzero(self.state == BUILT, axis=(1, 2)) - built_blocks,
+                np.count_nonzero(self.state == CENTRALITY, axis=(1, 2)) - centralities)
+
+
+ENSEMBLES = {'classical': ClassicalEnsemble, 'isobenefit': IsobenefitEnsemble}
+
+
+def run_ensemble_simulation(size_x, size_y, n_steps, output_path_prefix, n_members, build_probability,
+                            neighboring_centrality_probability, isolated_centrality_probability, T_star, random_seed,
+                            input_filepath, initialization_mode, max_population, max_ab_km2, prob_distribution,
+                            density_factors, urbanism_model='classical', quantiles=(0.05, 0.5, 0.95)):
+    # runs n_members simulations of the urbanism model in one process. members.csv holds the statistics of every
+    # member at every step, aggregate.csv their mean and quantiles over the members.
+    logger.configure_logging()
+    LOGGER = logger.get_logger()
+
+    output_path = make_output_path(output_path_prefix)
+    random_seeds = spawn_seeds(random_seed, n_members)
+    metadata = {'size_x': size_x,
+                'size_y': size_y,
+                'n_steps': n_steps,
+                'output_path': output_path,
+                'n_members': n_members,
+                'build_probability': build_probability,
+                'neighboring_centrality_probability': neighboring_centrality_probability,
+                'isolated_centrality_probability': isolated_centrality_probability,
+                'T_star': T_star,
+                'random_seed': random_seed,
+                'random_seeds': random_seeds,
+                'input_filepath': input_filepath,
+                'initialization_mode': initialization_mode,
+                'max_population': max_population,
+                'max_ab_km2': max_ab_km2,
+                'urbanism_model': urbanism_model,
+                'prob_distribution': prob_distribution,
+                'density_factors': density_factors,
+                'quantiles': quantiles}
+    save_metadata(metadata, output_path)
+
+    t_zero = time.time()
+    land = initialize_land(size_x, size_y, build_probability, neighboring_centrality_probability,
+                           isolated_centrality_probability, T_star, max_population, max_ab_km2,
+                           mode=initialization_mode, filepath=input_filepath,
+                           amenities_list=get_central_coord(size_x=size_x, size_y=size_y),
+                           urbanism_model=urbanism_model, prob_distribution=prob_distribution,
+                           density_factors=density_factors)
+    ensemble = ENSEMBLES[urbanism_model](land.grid, random_seeds, build_probability=build_probability,
+                                         neighboring_centrality_probability=neighboring_centrality_probability,
+                                         isolated_centrality_probability=isolated_centrality_probability,
+                                         T_star=T_star, max_population=max_population, max_ab_km2=max_ab_km2,
+                                         prob_distribution=prob_distribution, density_factors=density_factors)
+
+    member_statistics = ensemble.member_statistics()
+    statistics = member_statistics[2:]
+    aggregates = [f"{name}_mean" for name in statistics] + [f"{name}_q{q:g}" for name in statistics
+                                                             for q in quantiles]
+    with open(os.path.join(output_path, 'members.csv'), 'w', newline='') as members_file, \
+            open(os.path.join(output_path, 'aggregate.csv'), 'w', newline='') as aggregate_file:
+        members = csv.writer(members_file)
+        members.writerow(('iteration', 'member', 'active') + member_statistics)
+        aggregate = csv.writer(aggregate_file)
+        aggregate.writerow(['iteration', 'active_members'] + aggregates)
+
+        i = 0
+        while True:
+            stats = ensemble.statistics
+            for k in range(n_members):
+                members.writerow([i, k, int(ensemble.active[k])] + [stats[name][k] for name in member_statistics])
+            values = np.stack([stats[name] for name in statistics])
+            aggregate.writerow([i, np.count_nonzero(ensemble.active)] + list(values.mean(axis=1)) +
+                               list(np.quantile(values, quantiles, axis=1).T.ravel()))
+            if i > n_steps or not ensemble.active.any():
+                break
+            start = time.time()
+            stats['added_blocks'], stats['added_centralities'] = ensemble.update_map()
+            ensemble.set_current_counts()
+            i += 1
+            LOGGER.info(f"step: {i}, duration: {time.time() - start} seconds, active members: "
+                        f"{np.count_nonzero(ensemble.active)}")
+
+    LOGGER.info(f"Ensemble simulation ended. Total duration: {time.time() - t_zero} seconds")
+    return output_path
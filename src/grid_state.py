@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+
+GRID_ARRAYS = ('state', 'density', 'inhabitants')
+GRID_DTYPES = {'state': np.int8, 'density': np.int8, 'inhabitants': np.float32}
+
+NATURE = 0
+BUILT = 1
+CENTRALITY = 2
+
+DENSITY_CODES = {'empty': 0, 'low': 1, 'medium': 2, 'high': 3}
+DENSITY_NAMES = {code: name for name, code in DENSITY_CODES.items()}
+
+
+class GridState:
+    # state holds one of NATURE, BUILT, CENTRALITY per block, density the DENSITY_CODES level.
+    # revision is increased whenever the arrays are modified behind the back of the Land update methods,
+    # so that cached structures can tell whether they are still in sync with the grid.
+    # When a directory is given, the arrays are memory-mapped .npy files in it instead of living in RAM, so that
+    # other processes can map them with GridState.open (or np.load(..., mmap_mode='r')) while the simulation runs.
+
+    def __init__(self, size_x, size_y, directory=None):
+        self.size_x = size_x
+        self.size_y = size_y
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        for name in GRID_ARRAYS:
+            if directory is None:
+                array = np.zeros(shape=(size_x, size_y), dtype=GRID_DTYPES[name])
+            else:
+                array = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+',
+                                                  dtype=GRID_DTYPES[name], shape=(size_x, size_y))
+            setattr(self, name, array)
+        self.revision = 0
+
+    @classmethod
+    def open(cls, directory, mode='r'):
+        # maps the arrays saved in directory by a memory-mapped grid: read-only by default, 'r+' to modify them
+        grid = cls.__new__(cls)
+        grid.directory = directory
+        for name in GRID_ARRAYS:
+            setattr(grid, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode))
+        grid.size_x, grid.size_y = grid.state.shape
+        grid.revision = 0
+        return grid
+
+    def touch(self):
+        self.revision += 1
+
+    def flush(self):
+        if self.directory is not None:
+            for name in GRID_ARRAYS:
+                getattr(self, name).flush()
+
+    def view(self):
+        # read-only views of the grid arrays, which follow the later modifications of the grid without copying it
+        view = GridState.__new__(GridState)
+        view.size_x, view.size_y = self.size_x, self.size_y
+        view.directory = None
+        for name in GRID_ARRAYS:
+            array = getattr(self, name).view()
+            array.flags.writeable = False
+            setattr(view, name, array)
+        view.revision = self.revision
+        return view
+
+    def snapshot(self, out=None):
+        # read-only copy of the grid arrays. When a previous snapshot is passed as out, its buffers are reused.
+        if out is None:
+            out = GridState(self.size_x, self.size_y)
+        for name in GRID_ARRAYS:
+            array = getattr(out, name)
+            array.flags.writeable = True
+            np.copyto(array, getattr(self, name))
+            array.flags.writeable = False
+        out.touch()
+        return out
@@ -1,13 +1,31 @@
+import warnings
+
 from PIL import Image
 import numpy as np
 from matplotlib import cm
 
+from src.grid_state import NATURE, BUILT, CENTRALITY, DENSITY_CODES
+
+
+def open_image(filepath, max_pixels=None):
+    # the pixels of an image, as a (height, width) or (height, width, bands) array, of at most max_pixels pixels when
+    # given. Large rasters, e.g. tiled TIFF city masks, are read without the decompression bomb warning of Pillow, up
+    # to its hard limit of twice Image.MAX_IMAGE_PIXELS, which applications reading larger ones raise at startup
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        with Image.open(filepath) as pic:
+            if max_pixels is not None and pic.width * pic.height > max_pixels:
+                raise ValueError(f"{filepath} has {pic.width * pic.height} pixels, more than the {max_pixels} allowed.")
+            return np.asarray(pic)
 
-def import_2Darray_from_image(filepath):
-    pic = Image.open(filepath)
-    data = np.array(pic.getdata()).reshape(pic.size[1], pic.size[0], -1).mean(axis=2)
-    data_rescaled = (data - data.min()) / (data.max() - data.min())
-    return data_rescaled
+
+def import_2Darray_from_image(filepath, dtype=np.float64, max_pixels=None):
+    # mean of the bands of every pixel, rescaled to [0, 1]
+    data = open_image(filepath, max_pixels=max_pixels)
+    data = data.mean(axis=2, dtype=dtype) if data.ndim == 3 else data.astype(dtype)
+    data -= data.min()
+    data /= data.max()
+    return data
 
 
 def plot_image_from_2Darray(normalized_data_array, color_map=cm.gist_earth):
@@ -16,7 +34,34 @@ def plot_image_from_2Darray(normalized_data_array, color_map=cm.gist_earth):
     img.show()
 
 
-def save_image_from_2Darray(canvas, filepath, format='png'):
-    data_mapped = np.uint8(255 * canvas)
+def save_image_from_2Darray(canvas, filepath, format='png', compress_level=6):
+    # uint8 canvases are saved as they are, float ones are expected in [0, 1]
+    data_mapped = canvas if canvas.dtype == np.uint8 else np.uint8(255 * canvas)
     img = Image.fromarray(data_mapped)
-    img.save(filepath, format=format)
+    if format == 'png':
+        img.save(filepath, format=format, compress_level=compress_level)
+    else:
+        img.save(filepath, format=format)
+
+
+def make_palette():
+    # RGBA colour in [0, 1] of every (state, density level) pair, flattened as state * len(DENSITY_CODES) + density
+    nature = (0 / 255, 158 / 255, 96 / 255)  # green
+    built = {'empty': np.ones(3) * 2 / 3, 'low': np.ones(3) * 2 / 3, 'medium': np.ones(3) / 3, 'high': np.zeros(3)}
+    colors = np.ones(shape=(3, len(DENSITY_CODES), 4))
+    colors[NATURE, :, :3] = nature
+    colors[CENTRALITY, :, :3] = np.ones(3)
+    for name, code in DENSITY_CODES.items():
+        colors[BUILT, code, :3] = built[name]
+    return colors.reshape(-1, 4)
+
+
+FLOAT_PALETTE = make_palette()
+PALETTE = np.uint8(255 * FLOAT_PALETTE)
+
+
+def render_grid(state, density, out=None):
+    # RGBA image of the map, one pixel per block: uint8, or with colours in [0, 1] when out is a float array
+    codes = state * np.int8(len(DENSITY_CODES)) + density
+    palette = PALETTE if out is None or out.dtype == np.uint8 else FLOAT_PALETTE.astype(out.dtype, copy=False)
+    return np.take(palette, codes, axis=0, out=out)
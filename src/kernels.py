@@ -0,0 +1,267 @@
+from functools import lru_cache
+from types import FunctionType
+
+import numpy as np
+
+from src.grid_state import NATURE, BUILT, CENTRALITY, DENSITY_CODES
+
+
+def any_neighbor(mask):
+    # True where at least one of the 4 neighbours is True, along the last two axes
+    result = np.zeros_like(mask)
+    result[..., 1:, :] |= mask[..., :-1, :]
+    result[..., :-1, :] |= mask[..., 1:, :]
+    result[..., :, 1:] |= mask[..., :, :-1]
+    result[..., :, :-1] |= mask[..., :, 1:]
+    return result
+
+
+def classical_step(state, density, uniform, interior, enough_built_blocks, build_probability,
+                   neighboring_centrality_probability, isolated_centrality_probability, isolated_new_probability):
+    # one step of the classical model as masked array operations. All the rules are evaluated on the state at the
+    # start of the step; the arrays may have leading dimensions (e.g. a batch of maps), in which case
+    # enough_built_blocks must broadcast against them. Returns the masks of new built blocks, new centralities and
+    # blocks moving to the medium and high density levels.
+    is_nature = (state == NATURE) & interior
+    is_built = (state == BUILT) & interior
+    built_neighbor = any_neighbor(state != NATURE)
+    centrality_neighbor = any_neighbor(state == CENTRALITY)
+
+    new_blocks = is_nature & built_neighbor & (uniform < build_probability)
+    isolated_centralities = is_nature & ~built_neighbor & enough_built_blocks & (uniform < isolated_new_probability)
+    to_medium = is_built & (density == DENSITY_CODES['low']) & (uniform < 0.1)
+    to_high = is_built & (density == DENSITY_CODES['medium']) & (uniform < 0.01)
+    centrality_probability = np.where(centrality_neighbor, neighboring_centrality_probability,
+                                      isolated_centrality_probability)
+    promoted = is_built & (density == DENSITY_CODES['high']) & enough_built_blocks & (
+            uniform < centrality_probability)
+    return new_blocks, isolated_centralities | promoted, to_medium, to_high
+
+
+def isobenefit_candidates(is_nature, built_neighbor, centrality_near, uniform, build_probability,
+                          neighboring_centrality_probability, isolated_new_probability):
+    # the candidate blocks of a step of the isobenefit model as masked array operations, from the masks of the
+    # natural blocks of the interior, of the blocks next to a built one and of the blocks near a centrality. The
+    # arrays may have leading dimensions (e.g. a batch of maps). Returns the mask of the candidates and the mask of
+    # the blocks that would be new built blocks rather than centralities.
+    new_block = built_neighbor & centrality_near & (uniform < build_probability)
+    neighboring_centrality = built_neighbor & ~centrality_near & (uniform < neighboring_centrality_probability)
+    isolated_centrality = ~built_neighbor & (uniform < isolated_new_probability)
+    return is_nature & (new_block | neighboring_centrality | isolated_centrality), new_block
+
+
+# the 8 blocks around a block in circular order, as in nature_topology.RING
+RING_X = np.array([-1, -1, -1, 0, 1, 1, 1, 0])
+RING_Y = np.array([-1, 0, 1, 1, 1, 0, -1, -1])
+
+
+@lru_cache(maxsize=None)
+def compiled_isobenefit_sweep():
+    # isobenefit_sweep compiled with numba, which is optional: None when it is not installed. The function and its
+    # helpers are compiled in a copy of the module namespace, where they call each other's compiled versions.
+    try:
+        import numba
+    except ImportError:
+        return None
+    namespace = dict(globals())
+    for function in [isobenefit_sweep, _is_nature, _run, _count_narrow_runs, _narrow_after, _splits_neighbors,
+                     _regions, _find, _neighbor_regions, _stays_reachable, _reaches_nature]:
+        function = FunctionType(function.__code__, namespace, function.__name__)
+        namespace[function.__name__] = numba.njit(cache=True)(function)
+    return namespace['isobenefit_sweep']
+
+
+def isobenefit_sweep(nature, xs, ys, T_star, is_reachable):
+    # the checks of IsobenefitScenario.update_map on the candidate blocks (xs, ys), in order, over the array of
+    # natural blocks: a candidate is accepted when nature stays extended and reachable without it, and is then
+    # removed from nature. is_reachable tells whether every block has a natural block within T_star at the start.
+    # Written with plain loops for numba, see compiled_isobenefit_sweep; returns the mask of accepted candidates.
+    accepted = np.zeros(len(xs), dtype=np.bool_)
+    if not is_reachable:
+        return accepted
+    # scratch arrays of the region searches, allocated once: labels is left at zero after every search
+    labels = np.zeros(nature.shape, dtype=np.int32)
+    queue = np.empty(nature.size, dtype=np.int64)
+    components = _regions(nature, labels, queue)
+    narrow_rows = _count_narrow_runs(nature, T_star)
+    narrow_cols = _count_narrow_runs(nature.T, T_star)
+    narrow_rows_total = np.count_nonzero(narrow_rows)
+    narrow_cols_total = np.count_nonzero(narrow_cols)
+    for k in range(len(xs)):
+        x, y = xs[k], ys[k]
+        narrow_row = _narrow_after(narrow_rows[x], _run(nature, x, y, 0, -1), _run(nature, x, y, 0, 1), T_star)
+        narrow_col = _narrow_after(narrow_cols[y], _run(nature, x, y, -1, 0), _run(nature, x, y, 1, 0), T_star)
+        rows_total = narrow_rows_total - int(narrow_rows[x] > 0) + int(narrow_row > 0)
+        cols_total = narrow_cols_total - int(narrow_cols[y] > 0) + int(narrow_col > 0)
+        nature[x, y] = False
+        if not (_is_nature(nature, x - 1, y) or _is_nature(nature, x + 1, y) or _is_nature(nature, x, y - 1) or
+                _is_nature(nature, x, y + 1)):
+            new_components = components - 1
+        elif _splits_neighbors(nature, x, y):
+            new_components = components + _neighbor_regions(nature, x, y, labels, queue) - 1
+        else:
+            new_components = components
+        if new_components == 1 and rows_total == 0 and cols_total == 0 and _stays_reachable(nature, x, y, T_star):
+            accepted[k] = True
+            narrow_rows[x], narrow_cols[y] = narrow_row, narrow_col
+            narrow_rows_total, narrow_cols_total = rows_total, cols_total
+            components = new_components
+        else:
+            nature[x, y] = True
+    return accepted
+
+
+def _is_nature(nature, x, y):
+    return 0 <= x < nature.shape[0] and 0 <= y < nature.shape[1] and nature[x, y]
+
+
+def _run(nature, x, y, dx, dy):
+    # number of natural blocks following (x,y) in the direction (dx, dy)
+    length = 0
+    x, y = x + dx, y + dy
+    while _is_nature(nature, x, y):
+        length += 1
+        x, y = x + dx, y + dy
+    return length
+
+
+def _count_narrow_runs(nature, T_star):
+    # number of runs of natural blocks shorter than T_star in every row
+    counts = np.zeros(nature.shape[0], dtype=np.int64)
+    for i in range(nature.shape[0]):
+        length = 0
+        for j in range(nature.shape[1] + 1):
+            if j < nature.shape[1] and nature[i, j]:
+                length += 1
+            else:
+                if 0 < length < T_star:
+                    counts[i] += 1
+                length = 0
+    return counts
+
+
+def _narrow_after(count, before, after, T_star):
+    # narrow runs of a row once the block between runs of before and after blocks is removed from its run
+    return count - int(before + after + 1 < T_star) + int(0 < before < T_star) + int(0 < after < T_star)
+
+
+def _splits_neighbors(nature, x, y):
+    # same as NatureTopology.splits_neighbors
+    ring = np.zeros(8, dtype=np.bool_)
+    for k in range(8):
+        ring[k] = _is_nature(nature, x + RING_X[k], y + RING_Y[k])
+    if ring.all() or int(ring[1]) + int(ring[3]) + int(ring[5]) + int(ring[7]) < 2:
+        return False
+    first_gap = 0
+    while ring[first_gap]:
+        first_gap += 1
+    arcs = -1
+    arc = 0
+    for step in range(1, 9):
+        k = (first_gap + step) % 8
+        if not ring[k]:
+            arc += 1
+        elif k % 2 == 1:
+            if arcs == -1:
+                arcs = arc
+            elif arcs != arc:
+                return True
+    return False
+
+
+def _regions(nature, labels, parent):
+    # number of natural regions: every run of natural blocks along a row is joined with the runs it touches in the
+    # previous row. parent holds the union-find forest of the runs
+    regions = 0
+    runs = 0
+    for x in range(nature.shape[0]):
+        for y in range(nature.shape[1]):
+            if not nature[x, y]:
+                continue
+            if y > 0 and nature[x, y - 1]:
+                labels[x, y] = labels[x, y - 1]
+            else:
+                labels[x, y] = runs
+                parent[runs] = runs
+                runs += 1
+                regions += 1
+            if x > 0 and nature[x - 1, y]:
+                run, previous_run = _find(parent, labels[x, y]), _find(parent, labels[x - 1, y])
+                if run != previous_run:
+                    parent[run] = previous_run
+                    regions -= 1
+    labels[:, :] = 0
+    return regions
+
+
+def _find(parent, label):
+    while parent[label] != label:
+        parent[label] = parent[parent[label]]
+        label = parent[label]
+    return label
+
+
+def _neighbor_regions(nature, x, y, labels, queue):
+    # number of distinct natural regions among the 4-neighbours of (x,y). The regions are filled breadth first
+    # from all the neighbours at once, and fills that meet are merged: the search stops when at most one fill is
+    # still growing, so that it only visits the blocks around (x,y) unless a region is closed far from it.
+    size_y = nature.shape[1]
+    parent = np.arange(5)
+    # number of queued blocks of every fill, by the label of its root
+    frontier = np.zeros(5, dtype=np.int64)
+    head, tail = 0, 0
+    for k in range(1, 8, 2):
+        nx, ny = x + RING_X[k], y + RING_Y[k]
+        if _is_nature(nature, nx, ny):
+            label = (k + 1) // 2
+            labels[nx, ny] = label
+            queue[tail] = nx * size_y + ny
+            tail += 1
+            frontier[label] = 1
+    growing = tail
+    closed = 0
+    while growing > 1:
+        i, j = queue[head] // size_y, queue[head] % size_y
+        head += 1
+        root = _find(parent, labels[i, j])
+        for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            ni, nj = i + di, j + dj
+            if 0 <= ni < nature.shape[0] and 0 <= nj < size_y and nature[ni, nj]:
+                if labels[ni, nj] == 0:
+                    labels[ni, nj] = root
+                    queue[tail] = ni * size_y + nj
+                    tail += 1
+                    frontier[root] += 1
+                else:
+                    other = _find(parent, labels[ni, nj])
+                    if other != root:
+                        parent[other] = root
+                        frontier[root] += frontier[other]
+                        frontier[other] = 0
+                        growing -= 1
+        frontier[root] -= 1
+        if frontier[root] == 0:
+            closed += 1
+            growing -= 1
+    for k in range(tail):
+        labels[queue[k] // size_y, queue[k] % size_y] = 0
+    return closed + growing
+
+
+def _stays_reachable(nature, x, y, T_star):
+    # whether every built block closer than T_star to (x,y), which is no longer natural, still has a natural
+    # block within T_star. The blocks further away keep their closest natural block
+    for i in range(max(x - T_star, 0), min(x + T_star + 1, nature.shape[0])):
+        for j in range(max(y - T_star, 0), min(y + T_star + 1, nature.shape[1])):
+            if (i - x) ** 2 + (j - y) ** 2 <= T_star ** 2 and not nature[i, j] and \
+                    not _reaches_nature(nature, i, j, T_star):
+                return False
+    return True
+
+
+def _reaches_nature(nature, x, y, T_star):
+    for i in range(max(x - T_star, 0), min(x + T_star + 1, nature.shape[0])):
+        for j in range(max(y - T_star, 0), min(y + T_star + 1, nature.shape[1])):
+            if nature[i, j] and (i - x) ** 2 + (j - y) ** 2 <= T_star ** 2:
+                return True
+    return False
@@ -1,41 +1,187 @@
-import copy
+import multiprocessing
 import os
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 
 import numpy as np
 from scipy.ndimage import measurements as measure
 
 from src import logger
+from src.change_set import ChangeSet
+from src.distance_field import DistanceField, to_distances
+from src.grid_state import GRID_ARRAYS, GridState, NATURE, BUILT, CENTRALITY, DENSITY_CODES, DENSITY_NAMES
 from src.image_io import import_2Darray_from_image
+from src.kernels import any_neighbor, classical_step, compiled_isobenefit_sweep, isobenefit_candidates, \
+    isobenefit_sweep
+from src.metrics import COUNTS_COLUMNS, counts_dtype
+from src.nature_topology import RING, NatureTopology, ring_splits_neighbors
+from src.timings import NO_TIMINGS
 
 LOGGER = logger.get_logger()
 
 DENSITY_LEVELS = ['high', 'medium', 'low']
+DENSITY_LEVEL_CODES = np.array([DENSITY_CODES[level] for level in DENSITY_LEVELS], dtype=np.int8)
+# rescaled intensities of an image at or below which a block is built, and at or above which it is a centrality
+IMAGE_THRESHOLDS = (0, 1)
+CHECKPOINT_COUNTERS = ('current_population', 'current_centralities', 'current_built_blocks', 'current_free_nature',
+                       '_inhabited_blocks', 'avg_dist_from_nature', 'avg_dist_from_centr', 'max_dist_from_nature',
+                       'max_dist_from_centr', 'avg_dist_from_nature_wide', 'max_dist_from_nature_wide')
 
 
 class MapBlock:
-    def __init__(self, x, y, inhabitants=0):
+    # a MapBlock is a view on one cell of a GridState. Blocks created on their own (e.g. to pass
+    # coordinates to Land.set_centralities) are backed by a private 1x1 grid.
+    __slots__ = ('x', 'y', '_grid', '_i', '_j')
+
+    def __init__(self, x, y, inhabitants=0, grid=None, index=None):
         self.x = x
         self.y = y
-        self.is_nature = True
-        self.is_built = False
-        self.is_centrality = False
-        self.inhabitants = inhabitants
+        if grid is None:
+            grid = GridState(1, 1)
+            index = (0, 0)
+            grid.inhabitants[0, 0] = inhabitants
+        self._grid = grid
+        self._i, self._j = index
+
+    def _get_state(self):
+        return self._grid.state[self._i, self._j]
+
+    def _set_state(self, value):
+        self._grid.state[self._i, self._j] = value
+        self._grid.touch()
+
+    @property
+    def is_nature(self):
+        return self._get_state() == NATURE
+
+    @is_nature.setter
+    def is_nature(self, value):
+        if value:
+            self._set_state(NATURE)
+        elif self._get_state() == NATURE:
+            self._set_state(BUILT)
+
+    @property
+    def is_built(self):
+        return self._get_state() != NATURE
+
+    @is_built.setter
+    def is_built(self, value):
+        if not value:
+            self._set_state(NATURE)
+        elif self._get_state() == NATURE:
+            self._set_state(BUILT)
+
+    @property
+    def is_centrality(self):
+        return self._get_state() == CENTRALITY
+
+    @is_centrality.setter
+    def is_centrality(self, value):
+        if value:
+            self._set_state(CENTRALITY)
+        elif self._get_state() == CENTRALITY:
+            self._set_state(BUILT)
+
+    @property
+    def inhabitants(self):
+        return self._grid.inhabitants[self._i, self._j]
+
+    @inhabitants.setter
+    def inhabitants(self, value):
+        self._grid.inhabitants[self._i, self._j] = value
+        self._grid.touch()
+
+    @property
+    def density_level(self):
+        return DENSITY_NAMES[self._grid.density[self._i, self._j]]
+
+    @density_level.setter
+    def density_level(self, value):
+        self._grid.density[self._i, self._j] = DENSITY_CODES[value]
+        self._grid.touch()
 
     def set_block_population(self, block_population, density_level, population_density):
         self.inhabitants = block_population * population_density[density_level]
         self.density_level = density_level
 
 
+class MapRow:
+    __slots__ = ('_grid', '_i')
+
+    def __init__(self, grid, i):
+        self._grid = grid
+        self._i = i
+
+    def __len__(self):
+        return self._grid.size_y
+
+    def __getitem__(self, j):
+        if j < 0:
+            j += self._grid.size_y
+        if not 0 <= j < self._grid.size_y:
+            raise IndexError(f"block index {j} out of range")
+        # x and y follow the historical convention of map[y][x]
+        return MapBlock(j, self._i, grid=self._grid, index=(self._i, j))
+
+    def __iter__(self):
+        return (self[j] for j in range(self._grid.size_y))
+
+
+class MapView:
+    # list-of-lists like access to the grid, kept for backward compatibility: land.map[x][y].is_built
+    __slots__ = ('_grid',)
+
+    def __init__(self, grid):
+        self._grid = grid
+
+    def __len__(self):
+        return self._grid.size_x
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._grid.size_x
+        if not 0 <= i < self._grid.size_x:
+            raise IndexError(f"row index {i} out of range")
+        return MapRow(self._grid, i)
+
+    def __iter__(self):
+        return (self[i] for i in range(self._grid.size_x))
+
+
 class Land:
+    KERNELS = ('python',)
+    STORAGES = ('memory', 'grid-files')
+
     def __init__(self, size_x, size_y, build_probability=0.5, neighboring_centrality_probability=5e-3,
                  isolated_centrality_probability=1e-1, T_star=5,
                  max_population=500000, max_ab_km2=10000, prob_distribution=(0.7, 0.3, 0),
-                 density_factors=(1, 0.1, 0.01)):
+                 density_factors=(1, 0.1, 0.01), random_seed=None, kernel='python', storage='memory',
+                 storage_path=None, tile_rows=None, workers=1):
+        if kernel not in self.KERNELS:
+            raise ValueError(f"Invalid kernel value: {kernel}. Must be one of {self.KERNELS}.")
+        if storage not in self.STORAGES:
+            raise ValueError(f"Invalid storage value: {storage}. Must be one of {self.STORAGES}.")
+        if storage == 'grid-files' and storage_path is None:
+            raise ValueError("A storage_path directory is needed for the 'grid-files' storage.")
+        if kernel == 'numba' and compiled_isobenefit_sweep() is None:
+            LOGGER.warning("numba is not installed: the 'numba' kernel runs as interpreted python, much slower")
+        self.kernel = kernel
+        self.storage = storage
         self.size_x = size_x
         self.size_y = size_y
         self.T_star = T_star
-        self.map = [[MapBlock(x, y, inhabitants=0) for x in range(size_y)] for y in range(size_x)]
+        # with the 'grid-files' storage the grid arrays are memory-mapped files, which other processes can map while
+        # the simulation runs. The distance fields, the nature topology and the step masks stay map-sized arrays in
+        # RAM, so that the map must still fit in memory
+        self.grid = GridState(size_x, size_y, directory=storage_path if storage == 'grid-files' else None)
+        # the step masks and random draws are computed on bands of tile_rows rows, the whole map by default
+        self.tile_rows = size_x if tile_rows is None else tile_rows
+        # processes of the kernels that work on tiles in parallel, one per core when None
+        self.workers = os.cpu_count() if workers is None else workers
+        self._executor = None
+        self._shared_memory = {}
+        self.map = MapView(self.grid)
         self.build_probability = build_probability
         self.neighboring_centrality_probability = neighboring_centrality_probability
         self.isolated_centrality_probability = isolated_centrality_probability
@@ -46,6 +192,10 @@ class Land:
         self.probability_distribution = prob_distribution
         self.population_density = {'high': density_factors[0], 'medium': density_factors[1], 'low': density_factors[2],
                                    'empty': 0}
+        self.block_pop_by_density = np.zeros(len(DENSITY_CODES), dtype=np.float32)
+        for level, code in DENSITY_CODES.items():
+            self.block_pop_by_density[code] = self.block_pop * self.population_density[level]
+        self.rng = np.random.default_rng(random_seed)
 
         self.avg_dist_from_nature = 0
         self.avg_dist_from_centr = 0
@@ -58,171 +208,508 @@ class Land:
         self.avg_dist_from_nature_wide = 0
         self.max_dist_from_nature_wide = 0
 
+        # structures describing the natural blocks and the centralities, updated block by block in set_block and
+        # rebuilt whenever the grid has been modified elsewhere
+        self._cache_revision = None
+        self._nature_field = None
+        self._nature_topology = None
+        self._centrality_field = None
+        self._max_built_dist2 = 0
+        self._pending_removal = None
+        # labels and sizes of the natural regions, with the distance field of the wide ones (see get_wide_nature),
+        # updated from the change-sets of set_current_counts
+        self._nature_regions = None
+        self._wide_nature_field = None
+
+        # blocks modified since the last counts and during the current step, see ChangeSet.from_journal
+        self._journal = None
+        self._journal_size = 0
+        self._step_journal = None
+        self._counts_revision = None
+        self._inhabited_blocks = 0
+        self._distance_stats = {}
+        # phases timings and predicate counts of the steps, see timings.StepTimings
+        self.timings = NO_TIMINGS
+
     def check_consistency(self):
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                block = self.map[x][y]
-                assert (block.is_nature and not block.is_built) or (
-                        block.is_built and not block.is_nature), f"({x},{y}) block has ambiguous coordinates"
+        state, inhabitants = self.get_map_as_array()
+        invalid = (state != NATURE) & (state != BUILT) & (state != CENTRALITY)
+        inhabited_nature = (state == NATURE) & (inhabitants != 0)
+        ambiguous = np.argwhere(invalid | inhabited_nature)
+        if len(ambiguous) > 0:
+            x, y = ambiguous[0]
+            raise AssertionError(f"({x},{y}) block has ambiguous coordinates")
 
     def get_map_as_array(self):
-        map_array = np.zeros(shape=(self.size_x, self.size_y))
-        population_array = np.ones(shape=(self.size_x, self.size_y))
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                if self.map[x][y].is_built:
-                    map_array[x, y] = 1
-                if self.map[x][y].is_centrality:
-                    map_array[x, y] = 2
-                population_array[x, y] = self.map[x][y].inhabitants
-
-        return map_array, population_array
+        return self.grid.state, self.grid.inhabitants
+
+    def get_checkpoint(self):
+        # arrays and JSON-serializable values needed to continue the simulation exactly where it is. They are meant
+        # to be taken right after set_current_counts, when the journals are empty.
+        arrays = {name: getattr(self.grid, name) for name in GRID_ARRAYS}
+        values = {'rng': self.rng.bit_generator.state, 'distance_stats': {}, 'fields': {},
+                  'counters': {attribute: np.asarray(getattr(self, attribute)).item()
+                               for attribute in CHECKPOINT_COUNTERS}}
+        if self._cache_revision == self.grid.revision:
+            for name, field in [('nature', self._nature_field), ('centrality', self._centrality_field),
+                                ('wide_nature', self._wide_nature_field)]:
+                if field is not None:
+                    for array_name in ['sources', 'dist2', 'nearest']:
+                        arrays[f"{name}_{array_name}"] = getattr(field, array_name)
+                    values['fields'][name] = field.radius_bound
+                    if self._distance_stats.get(name, (None,))[0] is field:
+                        values['distance_stats'][name] = [float(x) for x in self._distance_stats[name][1:]]
+            values['max_built_dist2'] = int(self._max_built_dist2)
+        return arrays, values
+
+    def restore_checkpoint(self, arrays, values):
+        for name in GRID_ARRAYS:
+            getattr(self.grid, name)[:] = arrays[name]
+        self.grid.touch()
+        self.rng.bit_generator.state = values['rng']
+        for attribute, value in values['counters'].items():
+            setattr(self, attribute, np.asarray(value)[()])
+        self._check_cache_revision()
+        self._journal = []
+        self._journal_size = 0
+        self._counts_revision = self.grid.revision
+        self._distance_stats = {}
+        for name, radius_bound in values['fields'].items():
+            field = DistanceField.from_arrays(arrays[f"{name}_sources"], arrays[f"{name}_dist2"],
+                                              arrays[f"{name}_nearest"], radius_bound)
+            setattr(self, f"_{name}_field", field)
+            if name in values['distance_stats']:
+                self._distance_stats[name] = (field, *values['distance_stats'][name])
+        self._max_built_dist2 = values.get('max_built_dist2', 0)
+        if self._wide_nature_field is not None:
+            self._nature_regions = self._label_nature_regions()
+
+    def _record(self, indices):
+        # keeps the values of the blocks about to be modified, for the change-set of the step and the counts
+        entry = (indices, self.grid.state.flat[indices], self.grid.density.flat[indices],
+                 self.grid.inhabitants.flat[indices])
+        if self._step_journal is not None:
+            self._step_journal.append(entry)
+        if self._journal is not None:
+            self._journal_size += len(indices)
+            if self._journal_size > self.grid.state.size:
+                self._journal = None
+            else:
+                self._journal.append(entry)
+
+    def map_tiles(self, function, *iterables):
+        # function applied to the items of iterables, on a pool of self.workers processes when there are several
+        if self.workers <= 1:
+            return list(map(function, *iterables))
+        if self._executor is None:
+            # spawned rather than forked: the simulation may already run threads, e.g. the snapshot writers
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return list(self._executor.map(function, *iterables))
+
+    def share_arrays(self, **arrays):
+        # copies the arrays to blocks of shared memory, allocated on the first call and reused on the next ones, and
+        # returns what the processes of map_tiles need to read them, see attach_arrays
+        specs = {}
+        for name, array in arrays.items():
+            if name not in self._shared_memory:
+                self._shared_memory[name] = SharedMemory(create=True, size=max(array.nbytes, 1))
+            memory = self._shared_memory[name]
+            np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf), array)
+            specs[name] = (memory.name, array.shape, array.dtype.str)
+        return specs
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for memory in self._shared_memory.values():
+            memory.close()
+            memory.unlink()
+        self._shared_memory = {}
+
+    def start_step(self):
+        self._step_journal = []
+
+    def end_step(self):
+        changes = ChangeSet.from_journal(self._step_journal, self.grid)
+        self._step_journal = None
+        self.timings.count('accepted_blocks', len(changes))
+        LOGGER.info(f"added blocks: {changes.added_blocks}")
+        LOGGER.info(f"added centralities: {changes.added_centralities}")
+        return changes
+
+    def set_block(self, x, y, state, density_level='empty'):
+        self._record(np.array([x * self.size_y + y]))
+        previous_state = self.grid.state[x, y]
+        if previous_state == NATURE and state != NATURE:
+            self._remove_nature(x, y)
+        elif previous_state != NATURE and state == NATURE:
+            self._cache_revision = None
+        if previous_state != CENTRALITY and state == CENTRALITY:
+            self._add_centrality(x, y)
+        elif previous_state == CENTRALITY and state != CENTRALITY:
+            self._cache_revision = None
+        self.grid.state[x, y] = state
+        self.grid.density[x, y] = DENSITY_CODES[density_level]
+        self.grid.inhabitants[x, y] = self.block_pop * self.population_density[density_level]
+
+    def set_blocks(self, mask, state, density_codes=DENSITY_CODES['empty']):
+        # bulk version of set_block, see set_blocks_at
+        if np.ndim(density_codes) > 0:
+            density_codes = density_codes[mask]
+        self.set_blocks_at(np.flatnonzero(mask), state, density_codes)
+
+    def set_blocks_at(self, indices, state, density_codes=DENSITY_CODES['empty']):
+        # same as set_blocks, for the blocks at the given flat indices. The distance fields and the nature topology
+        # are updated in place when blocks only leave nature or become centralities
+        self._record(indices)
+        previous_state = self.grid.state.flat[indices]
+        self.grid.state.flat[indices] = state
+        self.grid.density.flat[indices] = density_codes
+        self.grid.inhabitants.flat[indices] = self.block_pop_by_density[density_codes]
+        if state == NATURE or (state != CENTRALITY and (previous_state == CENTRALITY).any()):
+            self._cache_revision = None
+            return
+        self._check_cache_revision()
+        self._pending_removal = None
+        removed = indices[previous_state == NATURE]
+        if len(removed) > 0:
+            xs, ys = np.unravel_index(removed, self.grid.state.shape)
+            if self._nature_topology is not None:
+                for x, y in zip(xs.tolist(), ys.tolist()):
+                    self._nature_topology.remove(x, y)
+            if self._nature_field is not None:
+                # the blocks already taken out of the field, see remove_nature_sources
+                is_source = self._nature_field.sources[xs, ys]
+                if is_source.any():
+                    self.remove_nature_sources(xs[is_source], ys[is_source])
+        added = indices[previous_state != CENTRALITY] if state == CENTRALITY else indices[:0]
+        if len(added) > 0 and self._centrality_field is not None:
+            self._centrality_field.add_sources(*np.unravel_index(added, self.grid.state.shape))
 
     def set_centralities(self, centralities: list):
         for centrality in centralities:
             x, y = centrality.x, centrality.y
-            self.map[x][y].is_centrality = True
-            self.map[x][y].is_built = True
-            self.map[x][y].is_nature = False
-            self.map[x][y].inhabitants = 0
+            self.grid.state[x, y] = CENTRALITY
+            self.grid.inhabitants[x, y] = 0
+        self.grid.touch()
 
     def is_any_neighbor_built(self, x, y):
         assert self.T_star <= x <= self.size_x - self.T_star, f"point ({x},{y}) is not in the 'interior' of the land"
         assert self.T_star <= y <= self.size_y - self.T_star, f"point ({x},{y}) is not in the 'interior' of the land"
-        return (self.map[x - 1][y].is_built or self.map[x + 1][y].is_built or self.map[x][y - 1].is_built or
-                self.map[x][y + 1].is_built)
+        state = self.grid.state
+        return (state[x - 1, y] != NATURE or state[x + 1, y] != NATURE or state[x, y - 1] != NATURE or
+                state[x, y + 1] != NATURE)
 
     def is_centrality_near(self, x, y):
         assert self.T_star <= x <= self.size_x - self.T_star, f"point ({x},{y}) is not in the 'interior' of the land"
         assert self.T_star <= y <= self.size_y - self.T_star, f"point ({x},{y}) is not in the 'interior' of the land"
 
-        for i in range(x - self.T_star, x + self.T_star + 1):
-            for j in range(y - self.T_star, y + self.T_star + 1):
-                if self.map[i][j].is_centrality:
-                    if d(x, y, i, j) <= self.T_star:
-                        return True
-        return False
+        window = self.grid.state[x - self.T_star:x + self.T_star + 1, y - self.T_star:y + self.T_star + 1]
+        i, j = np.nonzero(window == CENTRALITY)
+        return bool((d(x, y, i + x - self.T_star, j + y - self.T_star) <= self.T_star).any())
+
+    def tiles(self):
+        # bands of rows (x0, x1) covering the map, in order
+        return [(x0, min(x0 + self.tile_rows, self.size_x)) for x0 in range(0, self.size_x, self.tile_rows)]
+
+    def draw_step(self, x0=0, x1=None):
+        # random draws for every block of the rows x0:x1, taken in bulk from the land generator. The generator
+        # yields the same numbers whether a step is drawn at once or band after band.
+        x1 = self.size_x if x1 is None else x1
+        return draw_blocks(self.rng, (x1 - x0, self.size_y), self.probability_distribution)
+
+    def get_interior_mask(self, x0=0, x1=None):
+        x1 = self.size_x if x1 is None else x1
+        mask = np.zeros(shape=(x1 - x0, self.size_y), dtype=bool)
+        rows = slice(max(self.T_star - x0, 0), max(min(self.size_x - self.T_star, x1) - x0, 0))
+        mask[rows, self.T_star:self.size_y - self.T_star] = True
+        return mask
+
+    def _halo(self, x0, x1, rows):
+        # rows x0:x1 extended by the given number of rows on both sides, and the position of x0:x1 inside them
+        h0, h1 = max(x0 - rows, 0), min(x1 + rows, self.size_x)
+        return h0, h1, slice(x0 - h0, x1 - h0)
+
+    def get_built_neighbor_mask(self, x0=0, x1=None):
+        # is_any_neighbor_built evaluated on every block of the rows x0:x1 at once
+        h0, h1, band = self._halo(x0, self.size_x if x1 is None else x1, 1)
+        return any_neighbor(self.grid.state[h0:h1] != NATURE)[band]
+
+    def get_centrality_near_mask(self, x0=0, x1=None):
+        # is_centrality_near evaluated on every block of the rows x0:x1 at once, from the distance field of the
+        # centralities, which the steps keep up to date
+        return self.get_centrality_field().dist2[x0:x1] <= self.T_star ** 2
 
     def nature_stays_extended(self, x, y):
         # this method assumes that x,y belongs to a natural region
-        land_array, _ = self.get_map_as_array()
-        land_array[x, y] = 1
-        nature_array = np.where(land_array == 0, 1, 0)
-        labels, num_features = measure.label(nature_array)
-        is_nature_extended = False
-        if num_features == 1:
-            is_nature_extended = True
-
-        is_wide_enough_height = np.apply_along_axis(partial(is_nature_wide_along_axis, T_star=self.T_star), axis=1,
-                                                    arr=nature_array)
-        is_wide_enough_width = np.apply_along_axis(partial(is_nature_wide_along_axis, T_star=self.T_star), axis=0,
-                                                   arr=nature_array)
-        narrow_places_h = len(is_wide_enough_height) - is_wide_enough_height.sum()
-        narrow_places_w = len(is_wide_enough_width) - is_wide_enough_width.sum()
-
-        return narrow_places_h == 0 and narrow_places_w == 0 and is_nature_extended
+        return self.get_nature_topology().stays_extended_without(x, y)
+
+    def _check_cache_revision(self):
+        if self._cache_revision != self.grid.revision:
+            self._cache_revision = self.grid.revision
+            self._nature_field = None
+            self._nature_topology = None
+            self._centrality_field = None
+            self._pending_removal = None
+            self._nature_regions = None
+            self._wide_nature_field = None
+
+    def get_nature_field(self):
+        # distance of every block from the closest natural block
+        self._check_cache_revision()
+        if self._nature_field is None:
+            nature_array = self.grid.state == NATURE
+            self._nature_field = DistanceField(nature_array)
+            built_dist2 = self._nature_field.dist2[~nature_array]
+            self._max_built_dist2 = built_dist2.max() if len(built_dist2) > 0 else 0
+        return self._nature_field
+
+    def get_nature_topology(self):
+        # connected natural regions and natural runs along rows and columns
+        self._check_cache_revision()
+        if self._nature_topology is None:
+            self._nature_topology = NatureTopology(self.grid.state == NATURE, self.T_star)
+        return self._nature_topology
+
+    def get_centrality_field(self):
+        # distance of every block from the closest centrality
+        self._check_cache_revision()
+        if self._centrality_field is None:
+            self._centrality_field = DistanceField(self.grid.state == CENTRALITY)
+        return self._centrality_field
+
+    def _add_centrality(self, x, y):
+        self._check_cache_revision()
+        if self._centrality_field is not None:
+            self._centrality_field.add_source(x, y)
+
+    def _nature_removal(self, x, y):
+        if self._pending_removal is not None and self._pending_removal[0] == (x, y):
+            return self._pending_removal[1]
+        removal = self.get_nature_field().without_source(x, y)
+        self._pending_removal = ((x, y), removal)
+        return removal
+
+    def _remove_nature(self, x, y):
+        self._check_cache_revision()
+        if self._nature_topology is not None:
+            self._nature_topology.remove(x, y)
+        if self._nature_field is not None:
+            removal = self._nature_removal(x, y)
+            self._nature_field.remove_source(x, y, removal)
+            self._pending_removal = None
+            self._max_built_dist2 = max(self._max_built_dist2, self._removal_built_dist2(x, y, removal))
+
+    def remove_nature_sources(self, xs, ys, removal=None):
+        # takes the natural blocks (xs, ys) out of the nature field before they are set, with the change of the field
+        # when it is already known (see DistanceField.without_sources)
+        affected, new_dist2, _ = self.get_nature_field().remove_sources(xs, ys, removal)
+        self._pending_removal = None
+        is_built = ~self._nature_field.sources.flat[affected]
+        if is_built.any():
+            self._max_built_dist2 = max(self._max_built_dist2, new_dist2[is_built].max())
+
+    def _removal_built_dist2(self, x, y, removal):
+        # largest distance from nature among the built blocks affected by turning (x,y) into a built block
+        affected, new_dist2, _ = removal
+        is_built = self.grid.state.flat[affected] != NATURE
+        is_built |= affected == np.ravel_multi_index((x, y), (self.size_x, self.size_y))
+        return new_dist2[is_built].max() if is_built.any() else 0
 
     def nature_stays_reachable(self, x, y):
-        land_array, _ = self.get_map_as_array()
-        land_array[x, y] = 1
-        x_built, y_built = np.where(land_array > 0)
-        x_nature, y_nature = np.where(land_array == 0)
-        return np.sqrt((x_built[:, None] - x_nature) ** 2 + (y_built[:, None] - y_nature) ** 2).min(
-            axis=1).max() <= self.T_star
-
-    def set_configuration_from_image(self, filepath):
-        array_map = import_2Darray_from_image(filepath)
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                if array_map[x, y] == 1:
-                    self.map[x][y].is_built = True
-                    self.map[x][y].is_centrality = True
-                    self.map[x][y].is_nature = False
-
-                if array_map[x, y] == 0:
-                    self.map[x][y].is_built = True
-                    self.map[x][y].is_centrality = False
-                    self.map[x][y].is_nature = False
+        self.get_nature_field()
+        max_dist2 = self._max_built_dist2
+        if self.grid.state[x, y] == NATURE:
+            max_dist2 = max(max_dist2, self._removal_built_dist2(x, y, self._nature_removal(x, y)))
+        return max_dist2 <= self.T_star ** 2
+
+    def set_configuration_from_image(self, filepath, thresholds=IMAGE_THRESHOLDS):
+        # the blocks of the image (the mean of its bands rescaled to [0, 1], see import_2Darray_from_image) at most
+        # thresholds[0] are built, and the ones at least thresholds[1] are centralities. The other blocks are left
+        # as they are, as well as the pixels beyond the size of the land
+        array_map = import_2Darray_from_image(filepath, dtype=np.float32)
+        assert array_map.shape[0] >= self.size_x and array_map.shape[1] >= self.size_y, \
+            f"image of {array_map.shape[0]}x{array_map.shape[1]} pixels is smaller than the land"
+        array_map = array_map[:self.size_x, :self.size_y]
+        state = self.grid.state
+        state[array_map >= thresholds[1]] = CENTRALITY
+        state[array_map <= thresholds[0]] = BUILT
+        self.grid.touch()
 
     def set_current_counts(self, urbanism_model):
-        land_array, population_array = self.get_map_as_array()
-        self.current_population = population_array.sum()
-        self.current_centralities = np.where(land_array == 2, 1, 0).sum()
-        self.current_built_blocks = np.where(land_array > 0, 1, 0).sum()
-        self.current_free_nature = np.where(land_array == 0, 1, 0).sum()
-        tot_inhabited_blocks = np.where(land_array == 1, 1, 0).sum()
+        # counts are updated from the blocks modified since the previous call, unless the grid has been modified
+        # outside of set_block/set_blocks or too many blocks have changed, in which case they are recomputed
+        if self._journal is None or self._counts_revision != self.grid.revision:
+            changes = None
+            self._count_blocks()
+        else:
+            changes = ChangeSet.from_journal(self._journal, self.grid)
+            self._update_block_counts(changes)
+        self._journal = []
+        self._journal_size = 0
+        self._counts_revision = self.grid.revision
+        self._update_wide_nature(changes)
 
+        tot_inhabited_blocks = self._inhabited_blocks
+        sum_dist_from_centr, max_dist_from_centr = self._distance_stat('centrality', self.get_centrality_field(),
+                                                                       changes)
+        sum_dist_from_nature, max_dist_from_nature = self._distance_stat('nature', self.get_nature_field(), changes)
         if tot_inhabited_blocks == 0:
             self.avg_dist_from_nature = 0
             self.avg_dist_from_centr = 0
             self.max_dist_from_nature = 0
             self.max_dist_from_centr = 0
         else:
-            x_centr, y_centr = np.where(land_array == 2)
-            x_built, y_built = np.where(land_array == 1)
-            distances_from_centr = np.sqrt(
-                (x_built[:, None] - x_centr) ** 2 + (y_built[:, None] - y_centr) ** 2).min(
-                axis=1)
-            self.avg_dist_from_centr = distances_from_centr.sum() / tot_inhabited_blocks
-            self.max_dist_from_centr = distances_from_centr.max()
-
-            x_nature, y_nature = np.where(land_array == 0)
+            self.avg_dist_from_centr = sum_dist_from_centr / tot_inhabited_blocks
+            self.max_dist_from_centr = max_dist_from_centr
 
             if urbanism_model == 'classical':
-                nature_array = np.where(land_array == 0, 1, 0)
-                features, labels = measure.label(nature_array)
-                unique, counts = np.unique(features, return_counts=True)
-                large_natural_regions = counts[1:] >= self.T_star ** 2
-                large_natural_regions_labels = unique[1:][large_natural_regions]
-                x_nature_wide, y_nature_wide = np.where(np.isin(features, large_natural_regions_labels))
-                distances_from_nature_wide = np.sqrt(
-                    (x_built[:, None] - x_nature_wide) ** 2 + (y_built[:, None] - y_nature_wide) ** 2).min(
-                    axis=1)
-                self.avg_dist_from_nature_wide = distances_from_nature_wide.sum() / tot_inhabited_blocks
-                self.max_dist_from_nature_wide = distances_from_nature_wide.max()
-
-            distances_from_nature = np.sqrt(
-                (x_built[:, None] - x_nature) ** 2 + (y_built[:, None] - y_nature) ** 2).min(
-                axis=1)
-            self.avg_dist_from_nature = distances_from_nature.sum() / tot_inhabited_blocks
-            self.max_dist_from_nature = distances_from_nature.max()
-
-    def set_record_counts_header(self, output_path, urbanism_model):
-        filename = os.path.join(output_path, 'current_counts.csv')
-        with open(filename, "a") as f:
-            if urbanism_model == 'isobenefit':
-                f.write(
-                    "iteration,added_blocks,added_centralities,current_built_blocks,current_centralities,"
-                    "current_free_nature,current_population,avg_dist_from_nature,avg_dist_from_centr,max_dist_from_nature,max_dist_from_centr\n")
-            elif urbanism_model == 'classical':
-                f.write(
-                    "iteration,added_blocks,added_centralities,current_built_blocks,current_centralities,"
-                    "current_free_nature,current_population,avg_dist_from_nature,avg_dist_from_wide_nature,"
-                    "avg_dist_from_centr,max_dist_from_nature,max_dist_from_wide_nature,max_dist_from_centr\n")
-            else:
-                raise ValueError(
-                    f"Invalid urbanism_model value: {urbanism_model}. Must be 'classical' or 'isobenefit'.")
-
-    def record_current_counts(self, output_path, iteration, added_blocks, added_centralities, urbanism_model):
-        filename = os.path.join(output_path, 'current_counts.csv')
-        with open(filename, "a") as f:
-            if urbanism_model == 'isobenefit':
-                f.write(
-                    f"{iteration},{added_blocks},{added_centralities},"
-                    f"{self.current_built_blocks},{self.current_centralities},"
-                    f"{self.current_free_nature},{self.current_population},"
-                    f"{self.avg_dist_from_nature},{self.avg_dist_from_centr},"
-                    f"{self.max_dist_from_nature},{self.max_dist_from_centr}\n")
-            elif urbanism_model == 'classical':
-                f.write(
-                    f"{iteration},{added_blocks},{added_centralities},"
-                    f"{self.current_built_blocks},{self.current_centralities},"
-                    f"{self.current_free_nature},{self.current_population},"
-                    f"{self.avg_dist_from_nature},{self.avg_dist_from_nature_wide},{self.avg_dist_from_centr},"
-                    f"{self.max_dist_from_nature},{self.max_dist_from_nature_wide},{self.max_dist_from_centr}\n")
-            else:
-                raise ValueError(
-                    f"Invalid urbanism_model value: {urbanism_model}. Must be 'classical' or 'isobenefit'.")
+                sum_dist_from_nature_wide, max_dist_from_nature_wide = self._distance_stat(
+                    'wide_nature', self.get_wide_nature_field(), changes)
+                self.avg_dist_from_nature_wide = sum_dist_from_nature_wide / tot_inhabited_blocks
+                self.max_dist_from_nature_wide = max_dist_from_nature_wide
+
+            self.avg_dist_from_nature = sum_dist_from_nature / tot_inhabited_blocks
+            self.max_dist_from_nature = max_dist_from_nature
+
+    def get_wide_nature_field(self):
+        # distance of every block from the closest natural block of a region of at least T_star^2 blocks
+        self._check_cache_revision()
+        if self._wide_nature_field is None:
+            self._nature_regions = self._label_nature_regions()
+            labels, sizes = self._nature_regions
+            self._wide_nature_field = DistanceField(sizes[labels] >= self.T_star ** 2)
+        return self._wide_nature_field
+
+    def _label_nature_regions(self):
+        # label of the natural region of every block, 0 for the other blocks, and the size of every region
+        labels = measure.label(self.grid.state == NATURE)[0]
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        return labels, sizes
+
+    def _update_wide_nature(self, changes):
+        # removes from the wide nature field the blocks that left nature, and the regions that got smaller than
+        # T_star^2 blocks. The regions are labelled again when a removed block may split one, and the field is
+        # dropped when blocks returned to nature
+        self._check_cache_revision()
+        if self._wide_nature_field is None:
+            return
+        if changes is None or (changes.new_state == NATURE).any():
+            self._nature_regions = None
+            self._wide_nature_field = None
+            return
+        labels, sizes = self._nature_regions
+        xs, ys = np.unravel_index(changes.indices[changes.old_state == NATURE], labels.shape)
+        removed_labels = labels[xs, ys]
+        is_split = False
+        for x, y, label in zip(xs.tolist(), ys.tolist(), removed_labels.tolist()):
+            is_split = is_split or ring_splits_neighbors([0 <= x + dx < labels.shape[0] and
+                                                          0 <= y + dy < labels.shape[1] and
+                                                          labels[x + dx, y + dy] > 0 for dx, dy in RING])
+            labels[x, y] = 0
+            sizes[label] -= 1
+        sources = self._wide_nature_field.sources
+        if is_split:
+            self._nature_regions = labels, sizes = self._label_nature_regions()
+            left_x, left_y = np.nonzero(sources & (sizes[labels] < self.T_star ** 2))
+        else:
+            is_source = sources[xs, ys]
+            left_x, left_y = xs[is_source], ys[is_source]
+            shrunk = np.unique(removed_labels[sizes[removed_labels] < self.T_star ** 2])
+            if len(shrunk) > 0:
+                shrunk_x, shrunk_y = np.nonzero(sources & np.isin(labels, shrunk))
+                left_x, left_y = np.concatenate([left_x, shrunk_x]), np.concatenate([left_y, shrunk_y])
+        if len(left_x) > 0:
+            self._wide_nature_field.remove_sources(left_x, left_y)
+
+    def _count_blocks(self):
+        land_array, population_array = self.get_map_as_array()
+        self.current_population = population_array.sum(dtype=np.float64)
+        self.current_centralities = (land_array == CENTRALITY).sum()
+        self.current_built_blocks = (land_array != NATURE).sum()
+        self.current_free_nature = land_array.size - self.current_built_blocks
+        self._inhabited_blocks = (land_array == BUILT).sum()
+
+    def _update_block_counts(self, changes):
+        self.current_population += (changes.new_inhabitants.sum(dtype=np.float64) -
+                                    changes.old_inhabitants.sum(dtype=np.float64))
+        for attribute, state in [('current_centralities', changes.new_state == CENTRALITY),
+                                 ('current_built_blocks', changes.new_state != NATURE),
+                                 ('_inhabited_blocks', changes.new_state == BUILT)]:
+            setattr(self, attribute, getattr(self, attribute) + np.count_nonzero(state))
+        for attribute, state in [('current_centralities', changes.old_state == CENTRALITY),
+                                 ('current_built_blocks', changes.old_state != NATURE),
+                                 ('_inhabited_blocks', changes.old_state == BUILT)]:
+            setattr(self, attribute, getattr(self, attribute) - np.count_nonzero(state))
+        self.current_free_nature = self.grid.state.size - self.current_built_blocks
+
+    def _distance_stat(self, name, field, changes):
+        # sum and maximum of the distances of the inhabited blocks from the sources of field. They are updated from
+        # the blocks that changed state and the cells of the field that changed distance since the previous counts.
+        stat = self._distance_stats.get(name)
+        if changes is None or stat is None or stat[0] is not field or field.journal is None:
+            stat = None
+        else:
+            _, total, maximum = stat
+            empty = [(np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int32))]
+            field_indices, field_dist2 = [np.concatenate(entries) for entries in zip(*(empty + field.journal))]
+            field_indices, first = np.unique(field_indices, return_index=True)
+            touched = np.union1d(changes.indices, field_indices)
+            new_dist2 = field.dist2.flat[touched]
+            old_dist2 = new_dist2.copy()
+            old_dist2[np.searchsorted(touched, field_indices)] = field_dist2[first]
+            new_state = self.grid.state.flat[touched]
+            old_state = new_state.copy()
+            old_state[np.searchsorted(touched, changes.indices)] = changes.old_state
+            old_distances = to_distances(old_dist2[old_state == BUILT])
+            new_distances = to_distances(new_dist2[new_state == BUILT])
+            total += new_distances.sum() - old_distances.sum()
+            if (old_distances == maximum).any():
+                maximum = self._max_distance(field)
+            elif len(new_distances) > 0:
+                maximum = max(maximum, new_distances.max())
+            stat = (field, total, maximum) if np.isfinite(total) else None
+        if stat is None:
+            distances = field.distances(self.grid.state == BUILT)
+            stat = (field, distances.sum(), distances.max() if len(distances) > 0 else 0)
+        field.start_journal()
+        self._distance_stats[name] = stat
+        return stat[1], stat[2]
+
+    def _max_distance(self, field):
+        distances = field.distances(self.grid.state == BUILT)
+        return distances.max() if len(distances) > 0 else 0
+
+    def get_current_counts(self, urbanism_model, iteration, added_blocks, added_centralities):
+        # the row of current_counts of the counts set by set_current_counts, see metrics.COUNTS_COLUMNS
+        dtype = counts_dtype(urbanism_model)
+        values = {'iteration': iteration, 'added_blocks': added_blocks, 'added_centralities': added_centralities}
+        for name, _, attribute in COUNTS_COLUMNS:
+            if attribute is not None and name in dtype.names:
+                values[name] = getattr(self, attribute)
+        return np.array(tuple(values[name] for name in dtype.names), dtype=dtype)[()]
+
+
+def draw_blocks(rng, shape, probability_distribution):
+    # a uniform number per block to test against the step probabilities, and the index in DENSITY_LEVELS of the
+    # density of the block if it is built
+    draws = rng.random(shape + (2,))
+    cumulative_probability = np.cumsum(probability_distribution)
+    density_levels = np.searchsorted(cumulative_probability, draws[..., 1], side='right')
+    return draws[..., 0], np.minimum(density_levels, len(DENSITY_LEVELS) - 1)
+
+
+def get_wide_nature(land_array, T_star):
+    # natural blocks belonging to regions of at least T_star^2 blocks
+    nature_array = np.where(land_array == NATURE, 1, 0)
+    features, labels = measure.label(nature_array)
+    unique, counts = np.unique(features, return_counts=True)
+    large_natural_regions = counts[1:] >= T_star ** 2
+    large_natural_regions_labels = unique[1:][large_natural_regions]
+    return np.isin(features, large_natural_regions_labels)
 
 
 def d(x1, y1, x2, y2):
@@ -238,111 +725,308 @@ def is_nature_wide_along_axis(array_1d, T_star):
         return True
 
 
+def check_tile(state, nearest, T_star, window, xs, ys):
+    # nature_stays_extended and nature_stays_reachable of the candidates (xs, ys) of one tile, checked in order and
+    # removed from nature when they pass. window (x0, x1, y0, y1) is the part of the map read by the checks, which
+    # extends 2*T_star blocks beyond the tile, and nearest holds the closest natural block of every block, as in the
+    # nature field of the land. Provided the whole map is extended and reachable, removing a candidate keeps it
+    # extended when no natural run along its row and column gets shorter than T_star, and reachable when the blocks
+    # whose closest natural block it was have another one within T_star. The candidates whose natural neighbours
+    # may get disconnected are left out, for a check on the whole map. Returns the positions in xs of the accepted
+    # and of the left out candidates, and the change of the nature field once the accepted ones are removed, as
+    # returned by DistanceField.without_sources.
+    x0, x1, y0, y1 = window
+    size_y = state.shape[1]
+    nature = state[x0:x1, y0:y1] == NATURE
+    window_nearest = nearest[x0:x1, y0:y1].copy()
+    is_changed = np.zeros(nature.shape, dtype=bool)
+    accepted, deferred = [], []
+    for k, (x, y) in enumerate(zip((xs - x0).tolist(), (ys - y0).tolist())):
+        ring = [_is_nature(nature, x + dx, y + dy) for dx, dy in RING]
+        if ring_splits_neighbors(ring):
+            deferred.append(k)
+            continue
+        # a block without natural neighbours is the only natural region
+        if not any(ring[1::2]) or any(0 < _run(nature, x, y, dx, dy, T_star) < T_star for dx, dy in RING[1::2]):
+            continue
+        # the blocks whose closest natural block is (x,y) are within T_star of it, and their closest natural block
+        # without it within 2*T_star
+        bx, by = max(x - T_star, 0), max(y - T_star, 0)
+        ax, ay = np.nonzero(window_nearest[bx:x + T_star + 1, by:y + T_star + 1] == (x + x0) * size_y + y + y0)
+        ax, ay = ax + bx, ay + by
+        bx, by = max(x - 2 * T_star, 0), max(y - 2 * T_star, 0)
+        sources = nature[bx:x + 2 * T_star + 1, by:y + 2 * T_star + 1].copy()
+        sources[x - bx, y - by] = False
+        sx, sy = np.nonzero(sources)
+        if len(sx) == 0:
+            continue
+        sx, sy = sx + bx, sy + by
+        dist2 = (ax[:, None] - sx) ** 2 + (ay[:, None] - sy) ** 2
+        closest = dist2.argmin(axis=1)
+        if (dist2[np.arange(len(ax)), closest] > T_star ** 2).any():
+            continue
+        nature[x, y] = False
+        window_nearest[ax, ay] = (sx[closest] + x0) * size_y + sy[closest] + y0
+        is_changed[ax, ay] = True
+        accepted.append(k)
+
+    cx, cy = np.nonzero(is_changed)
+    new_nearest = window_nearest[cx, cy]
+    new_dist2 = (cx + x0 - new_nearest // size_y) ** 2 + (cy + y0 - new_nearest % size_y) ** 2
+    return accepted, deferred, (cx + x0) * size_y + cy + y0, new_dist2.astype(np.int32), new_nearest
+
+
+def check_shared_tile(specs, T_star, window, xs, ys):
+    # check_tile on the arrays shared by Land.share_arrays, in a process of Land.map_tiles
+    arrays = attach_arrays(specs)
+    return check_tile(arrays['state'], arrays['nearest'], T_star, window, xs, ys)
+
+
+# blocks of shared memory opened by the process, by name
+_SHARED_MEMORY = {}
+
+
+def attach_arrays(specs):
+    # the arrays shared by Land.share_arrays, opened once per process
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        if name not in _SHARED_MEMORY:
+            _SHARED_MEMORY[name] = SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=_SHARED_MEMORY[name].buf)
+    return arrays
+
+
+def _is_nature(nature, x, y):
+    return 0 <= x < nature.shape[0] and 0 <= y < nature.shape[1] and nature[x, y]
+
+
+def _run(nature, x, y, dx, dy, T_star):
+    # number of natural blocks following (x,y) in the direction (dx, dy), counted up to T_star
+    length = 0
+    while length < T_star and _is_nature(nature, x + (length + 1) * dx, y + (length + 1) * dy):
+        length += 1
+    return length
+
+
 class IsobenefitScenario(Land):
+    # kernel='python' checks the candidate blocks of a step one after the other in raster order, each of them
+    # seeing the blocks built before it. kernel='tiled' splits the map into square tiles of TILE_SIZE blocks (at
+    # least 2*T_star) coloured like a 2x2 checkerboard, and checks the tiles of one colour at a time (see
+    # check_tile), on self.workers processes that read the grid and the nature field from shared memory: tiles of
+    # the same colour are a whole tile apart, so that the blocks built in one cannot change the checks of another.
+    # Inside a tile the candidates are checked in raster order, seeing the
+    # blocks built before them in the tile and in the tiles of the previous colours. The candidates that could
+    # split a natural region are then checked on the whole map, in tile and raster order, before the next colour.
+    # The result only depends on the random seed, not on the number of workers, but differs from the 'python'
+    # kernel. Steps starting from a map whose nature is not extended or reachable use the 'python' order.
+    # kernel='numba' runs the checks of the 'python' kernel, with the same results, as a compiled loop over the
+    # arrays of the grid (see kernels.isobenefit_sweep); numba is optional.
+    KERNELS = ('python', 'tiled', 'numba')
+    TILE_SIZE = 128
+    TILE_COLORS = [(0, 0), (0, 1), (1, 0), (1, 1)]
+
     def update_map(self):
-        added_blocks = 0
-        added_centrality = 0
-        copy_land = copy.deepcopy(self)
-        for x in range(self.T_star, self.size_x - self.T_star):
-            for y in range(self.T_star, self.size_y - self.T_star):
-                block = self.map[x][y]
-                assert (block.is_nature and not block.is_built) or (
-                        block.is_built and not block.is_nature), f"({x},{y}) block has ambiguous coordinates"
-                if block.is_nature:
-                    if copy_land.is_any_neighbor_built(x, y):
-                        if copy_land.is_centrality_near(x, y):
-                            if self.nature_stays_extended(x, y):
-                                if np.random.rand() < self.build_probability:
-                                    if self.nature_stays_reachable(x, y):
-                                        density_level = np.random.choice(DENSITY_LEVELS,
-                                                                         p=self.probability_distribution)
-                                        block.is_nature = False
-                                        block.is_built = True
-                                        block.set_block_population(self.block_pop, density_level,
-                                                                   self.population_density)
-                                        added_blocks += 1
-                        else:
-                            if np.random.rand() < self.neighboring_centrality_probability:
-                                if self.nature_stays_extended(x, y):
-                                    if self.nature_stays_reachable(x, y):
-                                        block.is_centrality = True
-                                        block.is_built = True
-                                        block.is_nature = False
-                                        block.set_block_population(self.block_pop, 'empty', self.population_density)
-                                        added_centrality += 1
-
-                    else:
-                        if np.random.rand() < self.isolated_centrality_probability / (self.size_x * self.size_y):
-                            if self.nature_stays_extended(x, y):
-                                if self.nature_stays_reachable(x, y):
-                                    block.is_centrality = True
-                                    block.is_built = True
-                                    block.is_nature = False
-                                    block.set_block_population(self.block_pop, 'empty', self.population_density)
-                                    added_centrality += 1
-        LOGGER.info(f"added blocks: {added_blocks}")
-        LOGGER.info(f"added centralities: {added_centrality}")
-        return added_blocks, added_centrality
+        self.start_step()
+        self.update_candidates(*self.get_candidates())
+        return self.end_step()
+
+    def update_candidates(self, x, y, is_new_block, density_level):
+        # checks the candidate blocks of a step with the kernel of the land, and builds the accepted ones
+        if self.kernel == 'tiled' and self._tiles_apply():
+            self._update_tiles(x, y, is_new_block, density_level)
+        elif self.kernel == 'numba':
+            self._update_compiled(x, y, is_new_block, density_level)
+        else:
+            self._update_blocks(x, y, is_new_block, density_level)
+
+    def get_candidates(self):
+        # coordinates, kind and density level of the candidate blocks, in raster order. They are selected band by
+        # band on the grid as it is at the start of the step, before any of them is modified
+        candidates = []
+        for x0, x1 in self.tiles():
+            with self.timings.phase('rng'):
+                uniform, density_levels = self.draw_step(x0, x1)
+            with self.timings.phase('is_centrality_near'):
+                centrality_near = self.get_centrality_near_mask(x0, x1)
+            with self.timings.phase('candidates'):
+                is_candidate, new_block = isobenefit_candidates(
+                    self.get_interior_mask(x0, x1) & (self.grid.state[x0:x1] == NATURE),
+                    self.get_built_neighbor_mask(x0, x1), centrality_near, uniform, self.build_probability,
+                    self.neighboring_centrality_probability,
+                    self.isolated_centrality_probability / (self.size_x * self.size_y))
+                x, y = np.nonzero(is_candidate)
+                candidates.append((x + x0, y, new_block[x, y], density_levels[x, y]))
+        candidates = [np.concatenate(c) for c in zip(*candidates)]
+        self.timings.count('candidate_blocks', len(candidates[0]))
+        return candidates
+
+    def _update_blocks(self, x, y, is_new_block, density_level):
+        timings = self.timings
+        for x, y, is_new_block, density_level in zip(x.tolist(), y.tolist(), is_new_block.tolist(),
+                                                     density_level.tolist()):
+            with timings.phase('nature_stays_extended'):
+                is_accepted = self.nature_stays_extended(x, y)
+            timings.count('nature_stays_extended_calls')
+            if not is_accepted:
+                timings.count('nature_stays_extended_rejections')
+                continue
+            with timings.phase('nature_stays_reachable'):
+                is_accepted = self.nature_stays_reachable(x, y)
+            timings.count('nature_stays_reachable_calls')
+            if not is_accepted:
+                timings.count('nature_stays_reachable_rejections')
+                continue
+            with timings.phase('set_blocks'):
+                if is_new_block:
+                    self.set_block(x, y, BUILT, DENSITY_LEVELS[density_level])
+                else:
+                    self.set_block(x, y, CENTRALITY)
+
+    def _update_compiled(self, x, y, is_new_block, density_level):
+        sweep = compiled_isobenefit_sweep() or isobenefit_sweep
+        with self.timings.phase('compiled_checks'):
+            self.get_nature_field()
+            is_reachable = bool(self._max_built_dist2 <= self.T_star ** 2)
+            accepted = sweep(self.grid.state == NATURE, x, y, self.T_star, is_reachable)
+        self._set_candidates(x[accepted], y[accepted], is_new_block[accepted], density_level[accepted])
+
+    def _set_candidates(self, x, y, is_new_block, density_level):
+        # builds the given candidate blocks at once
+        if len(x) > 0:
+            with self.timings.phase('set_blocks'):
+                self.set_blocks_at(x[is_new_block] * self.size_y + y[is_new_block], BUILT,
+                                   DENSITY_LEVEL_CODES[density_level[is_new_block]])
+                self.set_blocks_at(x[~is_new_block] * self.size_y + y[~is_new_block], CENTRALITY)
+
+    def _tiles_apply(self):
+        # the checks of check_tile only hold on a map that is extended and reachable as a whole
+        is_extended = self.get_nature_topology().is_extended()
+        self.get_nature_field()
+        return is_extended and self._max_built_dist2 <= self.T_star ** 2
+
+    def _tile_window(self, i, j, size):
+        # bounds of the window of check_tile around tile (i, j)
+        halo = 2 * self.T_star
+        return (max(i * size - halo, 0), min((i + 1) * size + halo, self.size_x),
+                max(j * size - halo, 0), min((j + 1) * size + halo, self.size_y))
+
+    def _update_tiles(self, x, y, is_new_block, density_level):
+        size = max(self.TILE_SIZE, 2 * self.T_star)
+        tile_x, tile_y = x // size, y // size
+        for color in self.TILE_COLORS:
+            in_color = np.flatnonzero((tile_x % 2 == color[0]) & (tile_y % 2 == color[1]))
+            tile = tile_x[in_color] * self.size_y + tile_y[in_color]
+            in_color = in_color[np.argsort(tile, kind='stable')]
+            groups = np.split(in_color, np.flatnonzero(np.diff(np.sort(tile))) + 1) if len(in_color) > 0 else []
+            if len(groups) == 0:
+                continue
+            windows = [self._tile_window(tile_x[group[0]], tile_y[group[0]], size) for group in groups]
+            with self.timings.phase('compiled_checks'):
+                field = self.get_nature_field()
+                if self.workers > 1:
+                    specs = self.share_arrays(state=self.grid.state, nearest=field.nearest)
+                    results = self.map_tiles(check_shared_tile, [specs] * len(groups), [self.T_star] * len(groups),
+                                             windows, [x[group] for group in groups], [y[group] for group in groups])
+                else:
+                    results = [check_tile(self.grid.state, field.nearest, self.T_star, window, x[group], y[group])
+                               for window, group in zip(windows, groups)]
+
+            accepted = np.concatenate([group[a] for group, (a, *_) in zip(groups, results)]).astype(int)
+            deferred = np.concatenate([group[d] for group, (_, d, *_) in zip(groups, results)]).astype(int)
+            if len(accepted) > 0:
+                removal = tuple(np.concatenate(arrays) for arrays in zip(*[result[2:] for result in results]))
+                self.remove_nature_sources(x[accepted], y[accepted], removal)
+            self._set_candidates(x[accepted], y[accepted], is_new_block[accepted], density_level[accepted])
+            self._update_blocks(x[deferred], y[deferred], is_new_block[deferred], density_level[deferred])
 
 
 class ClassicalScenario(Land):
+    KERNELS = ('python', 'vectorized')
+
     def is_any_neighbor_centrality(self, x, y):
-        return (self.map[x - 1][y].is_centrality or self.map[x + 1][y].is_centrality or self.map[x][
-            y - 1].is_centrality or
-                self.map[x][y + 1].is_centrality)
+        state = self.grid.state
+        return (state[x - 1, y] == CENTRALITY or state[x + 1, y] == CENTRALITY or state[x, y - 1] == CENTRALITY or
+                state[x, y + 1] == CENTRALITY)
 
     def update_map(self):
-        added_blocks = 0
-        added_centrality = 0
-        copy_land = copy.deepcopy(self)
-        for x in range(self.T_star, self.size_x - self.T_star):
-            for y in range(self.T_star, self.size_y - self.T_star):
-                block = self.map[x][y]
-                assert (block.is_nature and not block.is_built) or (
-                        block.is_built and not block.is_nature), f"({x},{y}) block has ambiguous coordinates"
-                if block.is_nature:
-                    if copy_land.is_any_neighbor_built(x, y):
-                        if np.random.rand() < self.build_probability:
-                            density_level = np.random.choice(DENSITY_LEVELS, p=self.probability_distribution)
-                            block.is_nature = False
-                            block.is_built = True
-                            block.set_block_population(self.block_pop, density_level, self.population_density)
-                            added_blocks += 1
-
-                    else:
-                        if np.random.rand() < self.isolated_centrality_probability / np.sqrt(
-                                self.size_x * self.size_y) and (
-                                self.current_built_blocks / self.current_centralities) > 100:
-                            block.is_centrality = True
-                            block.is_built = True
-                            block.is_nature = False
-                            block.set_block_population(self.block_pop, 'empty', self.population_density)
-                            added_centrality += 1
-                else:
-                    if not block.is_centrality:
-                        if block.density_level == 'low':
-                            if np.random.rand() < 0.1:
-                                block.set_block_population(self.block_pop, 'medium', self.population_density)
-                        elif block.density_level == 'medium':
-                            if np.random.rand() < 0.01:
-                                block.set_block_population(self.block_pop, 'high', self.population_density)
-                        elif block.density_level == 'high' and (
-                                self.current_built_blocks / self.current_centralities) > 100:
-                            if self.is_any_neighbor_centrality(x, y):
-                                if np.random.rand() < self.neighboring_centrality_probability:
-                                    block.is_centrality = True
-                                    block.is_built = True
-                                    block.is_nature = False
-                                    block.set_block_population(self.block_pop, 'empty', self.population_density)
-                                    added_centrality += 1
-                            else:
-                                if np.random.rand() < self.isolated_centrality_probability:  # /np.sqrt(self.current_built_blocks):
-                                    block.is_centrality = True
-                                    block.is_built = True
-                                    block.is_nature = False
-                                    block.set_block_population(self.block_pop, 'empty', self.population_density)
-                                    added_centrality += 1
-
-        LOGGER.info(f"added blocks: {added_blocks}")
-        LOGGER.info(f"added centralities: {added_centrality}")
-        return added_blocks, added_centrality
+        if self.kernel == 'vectorized':
+            return self.update_map_vectorized()
+        # the candidate blocks and their rule are selected band by band on the grid as it is at the start of the
+        # step, before any of them is modified
+        self.start_step()
+        enough_built_blocks = (self.current_built_blocks / self.current_centralities) > 100
+        candidates = []
+        for x0, x1 in self.tiles():
+            with self.timings.phase('rng'):
+                uniform, density_levels = self.draw_step(x0, x1)
+            with self.timings.phase('candidates'):
+                density = self.grid.density[x0:x1]
+                built_neighbor = self.get_built_neighbor_mask(x0, x1)
+                is_nature = self.grid.state[x0:x1] == NATURE
+                is_built = self.grid.state[x0:x1] == BUILT
+                new_block = is_nature & built_neighbor & (uniform < self.build_probability)
+                isolated_centrality = is_nature & ~built_neighbor & enough_built_blocks & (
+                        uniform < self.isolated_centrality_probability / np.sqrt(self.size_x * self.size_y))
+                densified = is_built & (((density == DENSITY_CODES['low']) & (uniform < 0.1)) | (
+                        (density == DENSITY_CODES['medium']) & (uniform < 0.01)))
+                promoted = is_built & (density == DENSITY_CODES['high']) & enough_built_blocks & (
+                        uniform < max(self.neighboring_centrality_probability, self.isolated_centrality_probability))
+                is_candidate = self.get_interior_mask(x0, x1) & (
+                        new_block | isolated_centrality | densified | promoted)
+                x, y = np.nonzero(is_candidate)
+                candidates.append((x + x0, y, new_block[x, y], isolated_centrality[x, y], densified[x, y],
+                                   density[x, y], uniform[x, y], density_levels[x, y]))
+        candidates = [np.concatenate(c).tolist() for c in zip(*candidates)]
+        self.timings.count('candidate_blocks', len(candidates[0]))
+
+        with self.timings.phase('set_blocks'):
+            for x, y, is_new_block, is_isolated_centrality, is_densified, density, uniform, density_level in zip(
+                    *candidates):
+                if is_new_block:
+                    self.set_block(x, y, BUILT, DENSITY_LEVELS[density_level])
+                elif is_isolated_centrality:
+                    self.set_block(x, y, CENTRALITY)
+                elif is_densified:
+                    self.set_block(x, y, BUILT, 'medium' if density == DENSITY_CODES['low'] else 'high')
+                elif self.is_any_neighbor_centrality(x, y):
+                    if uniform < self.neighboring_centrality_probability:
+                        self.set_block(x, y, CENTRALITY)
+                elif uniform < self.isolated_centrality_probability:  # /np.sqrt(self.current_built_blocks):
+                    self.set_block(x, y, CENTRALITY)
+
+        return self.end_step()
+
+    def update_map_vectorized(self):
+        # same rules as update_map, applied to the whole map at once. Unlike in update_map, a high density block
+        # does not see the centralities created earlier in the same step next to it.
+        # Bands are computed with one row of halo on each side, whose uniform draws are set to 1 so that they never
+        # pass a probability test, and all of them are evaluated before the grid is modified.
+        self.start_step()
+        enough_built_blocks = (self.current_built_blocks / self.current_centralities) > 100
+        results = []
+        for x0, x1 in self.tiles():
+            with self.timings.phase('rng'):
+                uniform, density_levels = self.draw_step(x0, x1)
+            with self.timings.phase('candidates'):
+                h0, h1, band = self._halo(x0, x1, 1)
+                halo_uniform = np.ones(shape=(h1 - h0, self.size_y))
+                halo_uniform[band] = uniform
+                masks = classical_step(
+                    self.grid.state[h0:h1], self.grid.density[h0:h1], halo_uniform, self.get_interior_mask(h0, h1),
+                    enough_built_blocks, self.build_probability, self.neighboring_centrality_probability,
+                    self.isolated_centrality_probability,
+                    self.isolated_centrality_probability / np.sqrt(self.size_x * self.size_y))
+                new_blocks, new_centralities, to_medium, to_high = [mask[band] for mask in masks]
+                offset = x0 * self.size_y
+                results.append((np.flatnonzero(new_blocks) + offset,
+                                DENSITY_LEVEL_CODES[density_levels[new_blocks]], np.flatnonzero(to_medium) + offset,
+                                np.flatnonzero(to_high) + offset, np.flatnonzero(new_centralities) + offset))
+
+        new_blocks, density_codes, to_medium, to_high, new_centralities = [np.concatenate(r) for r in zip(*results)]
+        self.timings.count('candidate_blocks', len(new_blocks) + len(to_medium) + len(to_high) + len(new_centralities))
+        with self.timings.phase('set_blocks'):
+            self.set_blocks_at(new_blocks, BUILT, density_codes)
+            self.set_blocks_at(to_medium, BUILT, DENSITY_CODES['medium'])
+            self.set_blocks_at(to_high, BUILT, DENSITY_CODES['high'])
+            self.set_blocks_at(new_centralities, CENTRALITY)
+        return self.end_step()
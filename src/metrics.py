@@ -0,0 +1,223 @@
+import os
+
+import numpy as np
+
+COUNTS_NAME = 'current_counts'
+METRICS_FORMATS = ('csv', 'npy', 'parquet', 'memory')
+FORMAT_EXTENSIONS = {'csv': '.csv', 'npy': '.npy', 'parquet': '.parquet'}
+# number of rows buffered before they are written
+BUFFER_SIZE = 256
+
+# columns of current_counts, with their type and the Land attribute set by set_current_counts they hold. The first
+# ones are given by the simulation, the wide nature ones only belong to the classical model
+COUNTS_COLUMNS = (('iteration', np.int64, None),
+                  ('added_blocks', np.int64, None),
+                  ('added_centralities', np.int64, None),
+                  ('current_built_blocks', np.int64, 'current_built_blocks'),
+                  ('current_centralities', np.int64, 'current_centralities'),
+                  ('current_free_nature', np.int64, 'current_free_nature'),
+                  ('current_population', np.float64, 'current_population'),
+                  ('avg_dist_from_nature', np.float64, 'avg_dist_from_nature'),
+                  ('avg_dist_from_wide_nature', np.float64, 'avg_dist_from_nature_wide'),
+                  ('avg_dist_from_centr', np.float64, 'avg_dist_from_centr'),
+                  ('max_dist_from_nature', np.float64, 'max_dist_from_nature'),
+                  ('max_dist_from_wide_nature', np.float64, 'max_dist_from_nature_wide'),
+                  ('max_dist_from_centr', np.float64, 'max_dist_from_centr'))
+WIDE_NATURE_COLUMNS = ('avg_dist_from_wide_nature', 'max_dist_from_wide_nature')
+
+
+def counts_dtype(urbanism_model):
+    if urbanism_model not in ('isobenefit', 'classical'):
+        raise ValueError(f"Invalid urbanism_model value: {urbanism_model}. Must be 'classical' or 'isobenefit'.")
+    return np.dtype([(name, dtype) for name, dtype, _ in COUNTS_COLUMNS
+                     if urbanism_model == 'classical' or name not in WIDE_NATURE_COLUMNS])
+
+
+class MetricsSink:
+    # a per-step table with the columns of a record dtype. Rows are buffered in a preallocated record array and
+    # written by batches of buffer_size rows, on flush and on close. The first column is the iteration: with
+    # resume_from, a sink continues the rows already saved up to that iteration and drops the later ones.
+
+    def __init__(self, dtype, buffer_size=BUFFER_SIZE):
+        self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self._size = 0
+
+    def append(self, values):
+        # values maps every column to its value
+        self._buffer[self._size] = tuple(values[name] for name in self.dtype.names)
+        self._size += 1
+        if self._size == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        if self._size > 0:
+            self._write_rows(self._buffer[:self._size])
+            self._size = 0
+
+    def close(self):
+        self.flush()
+
+    def to_array(self):
+        # all the rows of the table, as a record array
+        raise NotImplementedError
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemorySink(MetricsSink):
+    # keeps the rows in memory, e.g. for sweeps that only need the last ones. Nothing is saved, so a resumed sink
+    # starts empty
+
+    def __init__(self, dtype, resume_from=None, buffer_size=BUFFER_SIZE):
+        super().__init__(dtype, buffer_size)
+        self._chunks = []
+
+    def _write_rows(self, rows):
+        self._chunks.append(rows.copy())
+
+    def to_array(self):
+        return np.concatenate(self._chunks + [self._buffer[:self._size]])
+
+
+class CSVSink(MetricsSink):
+    # a comma separated text file with a header, kept open while rows are appended
+
+    def __init__(self, filepath, dtype, resume_from=None, buffer_size=BUFFER_SIZE):
+        super().__init__(dtype, buffer_size)
+        self.filepath = filepath
+        if resume_from is not None and os.path.exists(filepath):
+            with open(filepath) as f:
+                header, *lines = f.readlines()
+            lines = [line for line in lines if int(line.split(',', 1)[0]) <= resume_from]
+            with open(f"{filepath}.tmp", 'w') as f:
+                f.writelines([header] + lines)
+            os.replace(f"{filepath}.tmp", filepath)
+            self._file = open(filepath, 'a')
+        else:
+            self._file = open(filepath, 'w')
+            self._file.write(",".join(self.dtype.names) + "\n")
+
+    def _write_rows(self, rows):
+        self._file.write("".join(",".join(map(str, row)) + "\n" for row in rows.tolist()))
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+    def to_array(self):
+        self.flush()
+        return load_metrics(self.filepath)
+
+
+class NpySink(MetricsSink):
+    # a .npy file of a record array. The rows are appended after a header of fixed size, which is rewritten with
+    # the number of rows on every flush, so that np.load reads the rows written so far
+
+    def __init__(self, filepath, dtype, resume_from=None, buffer_size=BUFFER_SIZE):
+        super().__init__(dtype, buffer_size)
+        self.filepath = filepath
+        previous_rows = None
+        if resume_from is not None and os.path.exists(filepath):
+            previous_rows = np.load(filepath)
+            previous_rows = previous_rows[previous_rows['iteration'] <= resume_from]
+        self._n_rows = 0
+        self._header_size = len(npy_header(self.dtype, 2 ** 63))
+        self._file = open(filepath, 'w+b')
+        self._file.write(npy_header(self.dtype, 0, self._header_size))
+        if previous_rows is not None:
+            self._write_rows(previous_rows.astype(self.dtype))
+
+    def _write_rows(self, rows):
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(rows.tobytes())
+        self._n_rows += len(rows)
+        self._file.seek(0)
+        self._file.write(npy_header(self.dtype, self._n_rows, self._header_size))
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+    def to_array(self):
+        self.flush()
+        return load_metrics(self.filepath)
+
+
+class ParquetSink(MetricsSink):
+    # a Parquet file, written with pyarrow (optional) as one row group per batch. The file can only be read once
+    # the sink is closed
+
+    def __init__(self, filepath, dtype, resume_from=None, buffer_size=BUFFER_SIZE):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        super().__init__(dtype, buffer_size)
+        self.filepath = filepath
+        self._pa = pa
+        self._schema = pa.schema([(name, pa.from_numpy_dtype(self.dtype[name])) for name in self.dtype.names])
+        previous_rows = None
+        if resume_from is not None and os.path.exists(filepath):
+            previous_rows = pq.read_table(filepath)
+            previous_rows = previous_rows.filter(pc.less_equal(previous_rows['iteration'], resume_from))
+        self._writer = pq.ParquetWriter(filepath, self._schema)
+        if previous_rows is not None:
+            self._writer.write_table(previous_rows.cast(self._schema))
+
+    def _write_rows(self, rows):
+        self._writer.write_table(self._pa.Table.from_arrays([rows[name] for name in self.dtype.names],
+                                                            schema=self._schema))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+    def to_array(self):
+        self.close()
+        return load_metrics(self.filepath)
+
+
+def npy_header(dtype, n_rows, size=None):
+    # the .npy version 1.0 header of a record array of n_rows rows, padded with spaces to size bytes, by default
+    # to the next multiple of 64
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                   'shape': (n_rows,)}).encode('latin1')
+    if size is None:
+        size = -(-(len(header) + 11) // 64) * 64
+    return (np.lib.format.magic(1, 0) + np.uint16(size - 10).tobytes() + header).ljust(size - 1) + b'\n'
+
+
+SINKS = {'csv': CSVSink, 'npy': NpySink, 'parquet': ParquetSink}
+
+
+def open_metrics(metrics_format, output_path, name, dtype, resume_from=None, buffer_size=BUFFER_SIZE):
+    # the sink of the table name in output_path, e.g. current_counts.csv
+    if metrics_format == 'memory':
+        return MemorySink(dtype, resume_from=resume_from, buffer_size=buffer_size)
+    if metrics_format not in SINKS:
+        raise ValueError(f"Invalid metrics format: {metrics_format}. Must be one of {METRICS_FORMATS}.")
+    filepath = os.path.join(output_path, name + FORMAT_EXTENSIONS[metrics_format])
+    return SINKS[metrics_format](filepath, dtype, resume_from=resume_from, buffer_size=buffer_size)
+
+
+def load_metrics(filepath):
+    # a table written by a sink, as a record array
+    if filepath.endswith('.npy'):
+        return np.load(filepath)
+    if filepath.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        table = pq.read_table(filepath)
+        rows = np.zeros(table.num_rows, dtype=[(field.name, field.type.to_pandas_dtype()) for field in table.schema])
+        for name in rows.dtype.names:
+            rows[name] = table[name].to_numpy()
+        return rows
+    return np.atleast_1d(np.genfromtxt(filepath, delimiter=',', names=True, dtype=None, encoding=None))
@@ -0,0 +1,141 @@
+import numpy as np
+from scipy.ndimage import label
+
+# the 8 blocks around a block, in circular order: consecutive blocks are 4-neighbours of each other,
+# and the odd positions are the 4-neighbours of the central block.
+RING = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+
+class NatureTopology:
+    # number of connected natural regions, and for every natural block the length of the natural run it belongs
+    # to along its row and its column, with its offset inside that run. Narrow runs (shorter than T_star) are
+    # counted per row and per column, so that removing a single natural block can be checked locally.
+
+    def __init__(self, nature_array, T_star):
+        self.T_star = T_star
+        self.nature = np.array(nature_array, dtype=bool)
+        self.shape = self.nature.shape
+        dtype = np.int16 if max(self.shape) < np.iinfo(np.int16).max else np.int32
+        self.row_length, self.row_offset = self._runs(self.nature, dtype)
+        col_length, col_offset = self._runs(self.nature.T, dtype)
+        self.col_length, self.col_offset = col_length.T, col_offset.T
+        self.narrow_rows = self._narrow_runs(self.row_length, self.row_offset)
+        self.narrow_cols = self._narrow_runs(self.col_length.T, self.col_offset.T)
+        self.narrow_rows_total = np.count_nonzero(self.narrow_rows)
+        self.narrow_cols_total = np.count_nonzero(self.narrow_cols)
+        self.components = label(self.nature)[1]
+        self._pending = None
+
+    @staticmethod
+    def _runs(nature, dtype):
+        size = nature.shape[1]
+        index = np.broadcast_to(np.arange(size), nature.shape)
+        previous = np.zeros(nature.shape, dtype=bool)
+        previous[:, 1:] = nature[:, :-1]
+        following = np.zeros(nature.shape, dtype=bool)
+        following[:, :-1] = nature[:, 1:]
+        start = np.maximum.accumulate(np.where(nature & ~previous, index, 0), axis=1)
+        end = np.minimum.accumulate(np.where(nature & ~following, index, size)[:, ::-1], axis=1)[:, ::-1]
+        length = np.where(nature, end - start + 1, 0).astype(dtype)
+        offset = np.where(nature, index - start, 0).astype(dtype)
+        return length, offset
+
+    def _narrow_runs(self, length, offset):
+        # one count per run, taken at its first block
+        is_narrow_start = (offset == 0) & (length > 0) & (length < self.T_star)
+        return is_narrow_start.sum(axis=1)
+
+    def is_extended(self):
+        return self.components == 1 and self.narrow_rows_total == 0 and self.narrow_cols_total == 0
+
+    def _split(self, length, offset):
+        # lengths of the two runs left by removing a block from its run
+        return offset, length - offset - 1
+
+    def _narrow_after(self, count, length, offset):
+        length, offset = int(length), int(offset)
+        left, right = self._split(length, offset)
+        return (count - (length < self.T_star) + (0 < left < self.T_star) + (0 < right < self.T_star)) > 0
+
+    def _is_nature(self, x, y):
+        return 0 <= x < self.shape[0] and 0 <= y < self.shape[1] and self.nature[x, y]
+
+    def _ring(self, x, y):
+        return [self._is_nature(x + dx, y + dy) for dx, dy in RING]
+
+    def splits_neighbors(self, x, y):
+        return ring_splits_neighbors(self._ring(x, y))
+
+    def _components_without(self, x, y):
+        ring = self._ring(x, y)
+        if not any(ring[k] for k in range(1, 8, 2)):
+            return self.components - 1
+        if self.splits_neighbors(x, y):
+            nature = self.nature.copy()
+            nature[x, y] = False
+            return label(nature)[1]
+        return self.components
+
+    def stays_extended_without(self, x, y):
+        if not self.nature[x, y]:
+            return self.is_extended()
+        if self._pending is not None and self._pending[0] == (x, y):
+            return self._pending[1]
+
+        narrow_row = self._narrow_after(self.narrow_rows[x], self.row_length[x, y], self.row_offset[x, y])
+        narrow_col = self._narrow_after(self.narrow_cols[y], self.col_length[x, y], self.col_offset[x, y])
+        narrow_rows = self.narrow_rows_total - (self.narrow_rows[x] > 0) + narrow_row
+        narrow_cols = self.narrow_cols_total - (self.narrow_cols[y] > 0) + narrow_col
+        components = self._components_without(x, y)
+        is_extended = components == 1 and narrow_rows == 0 and narrow_cols == 0
+        self._pending = ((x, y), is_extended, components)
+        return is_extended
+
+    def remove(self, x, y):
+        if not self.nature[x, y]:
+            return
+        if self._pending is None or self._pending[0] != (x, y):
+            self.stays_extended_without(x, y)
+        components = self._pending[2]
+        self._pending = None
+
+        self.narrow_rows_total -= self.narrow_rows[x] > 0
+        self.narrow_cols_total -= self.narrow_cols[y] > 0
+        self.narrow_rows[x] = self._remove_from_run(self.row_length[x], self.row_offset[x], y, self.narrow_rows[x])
+        self.narrow_cols[y] = self._remove_from_run(self.col_length[:, y], self.col_offset[:, y], x,
+                                                    self.narrow_cols[y])
+        self.narrow_rows_total += self.narrow_rows[x] > 0
+        self.narrow_cols_total += self.narrow_cols[y] > 0
+        self.nature[x, y] = False
+        self.components = components
+
+    def _remove_from_run(self, length, offset, i, narrow_count):
+        run_length, run_offset = int(length[i]), int(offset[i])
+        start = i - run_offset
+        left, right = self._split(run_length, run_offset)
+        narrow_count -= run_length < self.T_star
+        length[start:i] = left
+        length[i] = 0
+        offset[i] = 0
+        length[i + 1:i + 1 + right] = right
+        offset[i + 1:i + 1 + right] = np.arange(right)
+        narrow_count += (0 < left < self.T_star) + (0 < right < self.T_star)
+        return narrow_count
+
+
+def ring_splits_neighbors(ring):
+    # whether the natural 4-neighbours of a block, given the 8 blocks of its RING, lie on different arcs of natural
+    # blocks around it, in which case only a labelling of the whole map tells if removing the block disconnects them
+    neighbors = [k for k in range(1, 8, 2) if ring[k]]
+    if len(neighbors) < 2 or all(ring):
+        return False
+    first_gap = ring.index(False)
+    arcs = set()
+    arc = 0
+    for step in range(1, 9):
+        k = (first_gap + step) % 8
+        if not ring[k]:
+            arc += 1
+        elif k in neighbors:
+            arcs.add(arc)
+    return len(arcs) > 1
@@ -1,26 +1,49 @@
+import itertools
 import json
 import os
 import time
+from contextlib import ExitStack
 
 import numpy as np
 
 from src import logger
-from src.image_io import save_image_from_2Darray
+from src.checkpoint import save_checkpoint, load_checkpoint
+from src.distance_field import to_distances
+from src.grid_state import BUILT
+from src.image_io import save_image_from_2Darray, render_grid
 from src.initialization_utils import get_central_coord
 from src.land_map import MapBlock, IsobenefitScenario, ClassicalScenario, Land
+from src.metrics import COUNTS_NAME, counts_dtype, open_metrics
+from src.snapshot_writer import SnapshotWriter, snapshot_path
+from src.timings import StepTimings, NO_TIMINGS, TIMINGS_NAME, TIMINGS_DTYPE, profiled
+from src.trajectory import TrajectoryWriter
 from pathlib import Path
 
 N_AMENITIES = 1
+TRAJECTORY_FILENAME = 'trajectory.npz'
+GRID_DIRECTORY = 'grid'
+MIN_DISTANCES_FILENAME = 'minimal_distances.npz'
+MIN_DISTANCES_CSV_FILENAME = 'minimal_distances_map.csv'
+CSV_CHUNK_SIZE = 100000
+SIMULATIONS_PATH = 'simulations'
 
 
 def run_isobenefit_simulation(size_x, size_y, n_steps, output_path_prefix, build_probability,
                               neighboring_centrality_probability, isolated_centrality_probability, T_star,
                               random_seed,
                               input_filepath, initialization_mode, max_population, max_ab_km2, urbanism_model,
-                              prob_distribution, density_factors):
+                              prob_distribution, density_factors, kernel='python', snapshot_workers=1,
+                              compress_level=6, save_snapshots=False, keyframe_interval=100, storage='memory',
+                              tile_rows=None, checkpoint_interval=None, workers=1, timings=False, profiler=None,
+                              metrics_format='csv', save_distances_csv=True, consumers=()):
+    # returns the counts of every step as a record array, with the columns of metrics.counts_dtype. consumers are
+    # passed the records of the steps after the file writers, e.g. to follow the run live, see Simulation
+    # a Parquet file is only readable once closed: the counts of an interrupted run would be lost
+    if checkpoint_interval is not None and metrics_format == 'parquet':
+        raise ValueError("The 'parquet' metrics format cannot be resumed from a checkpoint: use 'csv' or 'npy' with "
+                         "checkpoint_interval.")
     logger.configure_logging()
     LOGGER = logger.get_logger()
-    np.random.seed(random_seed)
 
     output_path = make_output_path(output_path_prefix)
     metadata = {'size_x': size_x,
@@ -38,57 +61,326 @@ def run_isobenefit_simulation(size_x, size_y, n_steps, output_path_prefix, build
                 'max_ab_km2': max_ab_km2,
                 'urbanism_model': urbanism_model,
                 'prob_distribution': prob_distribution,
-                'density_factors': density_factors}
+                'density_factors': density_factors,
+                'kernel': kernel,
+                'storage': storage,
+                'tile_rows': tile_rows,
+                'workers': workers,
+                'save_snapshots': save_snapshots,
+                'keyframe_interval': keyframe_interval,
+                'checkpoint_interval': checkpoint_interval,
+                'timings': timings,
+                'metrics_format': metrics_format,
+                'save_distances_csv': save_distances_csv}
 
-    Path(output_path).mkdir(parents=True, exist_ok=True)
     save_metadata(metadata, output_path)
 
     t_zero = time.time()
-    land = initialize_land(size_x, size_y,
+    land = initialize_land_from_metadata(metadata)
+    trajectory = TrajectoryWriter(os.path.join(output_path, TRAJECTORY_FILENAME), shape=(size_x, size_y),
+                                  keyframe_interval=keyframe_interval)
+    counts = open_metrics(metrics_format, output_path, COUNTS_NAME, counts_dtype(urbanism_model))
+
+    with profiled(profiler, output_path):
+        simulate(land, metadata, trajectory, counts, iteration=0, snapshot_workers=snapshot_workers,
+                 compress_level=compress_level, consumers=consumers)
+
+    LOGGER.info(f"Simulation ended. Total duration: {time.time() - t_zero} seconds")
+    return counts.to_array()
+
+
+def resume_isobenefit_simulation(output_path, snapshot_workers=1, compress_level=6, profiler=None):
+    # continues the simulation saved in output_path from its latest checkpoint. The counts and the trajectory are
+    # cut back to the checkpoint, so that they end up identical to the ones of an uninterrupted run. Returns the
+    # counts, as run_isobenefit_simulation.
+    logger.configure_logging()
+    LOGGER = logger.get_logger()
+
+    t_zero = time.time()
+    metadata = load_metadata(output_path)
+    land = initialize_land_from_metadata(metadata)
+    i, trajectory_position = load_checkpoint(output_path, land)
+    LOGGER.info(f"Resuming the simulation in {output_path} from step {i}")
+    counts = open_metrics(metadata.get('metrics_format', 'csv'), output_path, COUNTS_NAME,
+                          counts_dtype(metadata['urbanism_model']), resume_from=i)
+    trajectory = TrajectoryWriter.resume(os.path.join(output_path, TRAJECTORY_FILENAME), trajectory_position,
+                                         keyframe_interval=metadata['keyframe_interval'])
+
+    with profiled(profiler, output_path):
+        simulate(land, metadata, trajectory, counts, iteration=i, snapshot_workers=snapshot_workers,
+                 compress_level=compress_level)
+
+    LOGGER.info(f"Simulation ended. Total duration: {time.time() - t_zero} seconds")
+    return counts.to_array()
+
+
+def simulate(land, metadata, trajectory, counts, iteration, snapshot_workers=1, compress_level=6, consumers=()):
+    # runs the simulation described by metadata from iteration, with the consumers writing its outputs: the counts
+    # sink, the trajectory and the snapshots, the timings with metadata['timings'], and the minimal distances at the
+    # end. The given consumers come after them
+    output_path = metadata['output_path']
+    file_consumers = [CountsConsumer(counts), TrajectoryConsumer(trajectory)]
+    timings = None
+    if metadata.get('timings'):
+        land.timings = StepTimings()
+        timings = open_metrics(metadata.get('metrics_format', 'csv'), output_path, TIMINGS_NAME, TIMINGS_DTYPE,
+                               resume_from=iteration if iteration > 0 else None)
+    if metadata['save_snapshots']:
+        file_consumers.append(SnapshotConsumer(SnapshotWriter(output_path, workers=snapshot_workers,
+                                                              compress_level=compress_level), land.timings))
+    consumers = file_consumers + list(consumers)
+
+    with Simulation(land, metadata['urbanism_model'], metadata['n_steps'], iteration=iteration, consumers=consumers,
+                    timings=timings, output_path=output_path,
+                    checkpoint_interval=metadata['checkpoint_interval']) as simulation:
+        for _ in simulation:
+            pass
+    save_min_distances(land, output_path, save_csv=metadata.get('save_distances_csv', True))
+
+
+def iter_simulation(size_x, size_y, n_steps, build_probability, neighboring_centrality_probability,
+                    isolated_centrality_probability, T_star, random_seed, input_filepath, initialization_mode,
+                    max_population, max_ab_km2, urbanism_model, prob_distribution, density_factors, consumers=(),
+                    **kwargs):
+    # the StepRecords of a simulation run in memory, see Simulation. Nothing is written to disk, unless the
+    # consumers do it. The other arguments (kernel, workers, ...) are passed to initialize_land. Stopping the
+    # iteration early closes the simulation.
+    land = initialize_land(size_x, size_y, build_probability, neighboring_centrality_probability,
+                           isolated_centrality_probability, T_star, max_population, max_ab_km2,
+                           mode=initialization_mode, filepath=input_filepath,
                            amenities_list=get_central_coord(size_x=size_x, size_y=size_y),
-                           neighboring_centrality_probability=neighboring_centrality_probability,
-                           isolated_centrality_probability=isolated_centrality_probability,
-                           build_probability=build_probability, T=T_star,
-                           mode=initialization_mode,
-                           filepath=input_filepath, max_population=max_population, max_ab_km2=max_ab_km2,
                            urbanism_model=urbanism_model, prob_distribution=prob_distribution,
-                           density_factors=density_factors)
-
-    canvas = np.ones(shape=(size_x, size_y, 4))
-    update_map_snapshot(land, canvas)
-    save_snapshot(canvas, output_path=output_path, step=0)
-    land.set_record_counts_header(output_path=output_path, urbanism_model=urbanism_model)
-    land.set_current_counts(urbanism_model)
-    i = 0
-    added_blocks, added_centralities = (0, 0)
-    land.record_current_counts(output_path=output_path, iteration=i, added_blocks=added_blocks,
-                               added_centralities=added_centralities, urbanism_model=urbanism_model)
-
-    while i <= n_steps and land.current_population <= land.max_population:
-        start = time.time()
-        added_blocks, added_centralities = land.update_map()
-        land.set_current_counts(urbanism_model)
-        i += 1
-        land.record_current_counts(output_path=output_path, iteration=i, added_blocks=added_blocks,
-                                   added_centralities=added_centralities, urbanism_model=urbanism_model)
-        LOGGER.info(f"step: {i}, duration: {time.time() - start} seconds")
-        LOGGER.info(f"step: {i}, current population: {land.current_population} inhabitants")
-        update_map_snapshot(land, canvas)
-        save_snapshot(canvas, output_path=output_path, step=i)
-
-    save_min_distances(land, output_path)
+                           density_factors=density_factors, random_seed=random_seed, **kwargs)
+    with Simulation(land, urbanism_model, n_steps, consumers=consumers) as simulation:
+        yield from simulation
 
-    LOGGER.info(f"Simulation ended. Total duration: {time.time() - t_zero} seconds")
+
+class StepRecord:
+    # a step of a Simulation: its iteration, its row of current_counts (see metrics.counts_dtype) and the ChangeSet
+    # of the blocks it modified, None for the initial state. grid is a read-only view of the map, which follows the
+    # later steps: grid.snapshot() keeps a copy of the map of this step.
+
+    def __init__(self, iteration, counts, changes, land):
+        self.iteration = iteration
+        self.counts = counts
+        self.changes = changes
+        self._land = land
+
+    @property
+    def grid(self):
+        return self._land.grid.view()
+
+
+class Simulation:
+    # a simulation run one step at a time by step(), or by iterating over it, which yields the StepRecord of the
+    # initial map (when starting from iteration 0) and then of every step, until n_steps steps have been run or the
+    # population exceeds land.max_population. Every record is passed to the consumers (see StepConsumer), e.g. the
+    # file writers of run_isobenefit_simulation: without them, nothing is written to disk.
+    # With timings, a metrics sink with the columns of timings.TIMINGS_DTYPE, the time spent in each phase of every
+    # step is appended to it. With checkpoint_interval, the consumers are flushed and a checkpoint is saved in
+    # output_path every checkpoint_interval steps, which needs a TrajectoryConsumer. close() closes the consumers
+    # and the land.
+
+    def __init__(self, land, urbanism_model, n_steps, iteration=0, consumers=(), timings=None, output_path=None,
+                 checkpoint_interval=None):
+        self.land = land
+        self.urbanism_model = urbanism_model
+        self.n_steps = n_steps
+        self.iteration = iteration
+        self.consumers = list(consumers)
+        self.timings = timings
+        self.output_path = output_path
+        self.checkpoint_interval = checkpoint_interval
+        if timings is not None and not isinstance(land.timings, StepTimings):
+            land.timings = StepTimings()
+        # a resumed simulation does not record its initial map again
+        self._started = iteration > 0
+
+    @property
+    def done(self):
+        return self.iteration > self.n_steps or self.land.current_population > self.land.max_population
+
+    def start(self):
+        # the record of the initial map
+        self.land.set_current_counts(self.urbanism_model)
+        record = StepRecord(self.iteration, self.land.get_current_counts(self.urbanism_model, self.iteration, 0, 0),
+                            None, self.land)
+        self._consume(record)
+        self._started = True
+        return record
+
+    def step(self):
+        LOGGER = logger.get_logger()
+        if not self._started:
+            self.start()
+        land = self.land
+        timings = land.timings
+        timings.reset()
+        with timings.phase('step'):
+            start = time.time()
+            with timings.phase('update_map'):
+                changes = land.update_map()
+            with timings.phase('counts'):
+                land.set_current_counts(self.urbanism_model)
+            self.iteration += 1
+            with timings.phase('record_counts'):
+                counts = land.get_current_counts(self.urbanism_model, self.iteration, changes.added_blocks,
+                                                 changes.added_centralities)
+            record = StepRecord(self.iteration, counts, changes, land)
+            LOGGER.info(f"step: {self.iteration}, duration: {time.time() - start} seconds")
+            LOGGER.info(f"step: {self.iteration}, current population: {land.current_population} inhabitants")
+            self._consume(record)
+            checkpoint = self.checkpoint_interval is not None and self.iteration % self.checkpoint_interval == 0
+            if checkpoint:
+                with timings.phase('checkpoint'):
+                    self.checkpoint()
+        if self.timings is not None:
+            self.timings.append(timings.row(self.iteration))
+            if checkpoint:
+                self.timings.flush()
+        return record
+
+    def _consume(self, record):
+        for consumer in self.consumers:
+            if consumer.phase is None:
+                consumer.consume(record)
+            else:
+                with self.land.timings.phase(consumer.phase):
+                    consumer.consume(record)
+
+    def checkpoint(self):
+        # flushes the consumers and saves the land at the current iteration, with the position of the trajectory
+        trajectories = [consumer for consumer in self.consumers if isinstance(consumer, TrajectoryConsumer)]
+        assert len(trajectories) == 1, "a checkpoint needs the trajectory of the simulation"
+        for consumer in self.consumers:
+            consumer.flush()
+        save_checkpoint(self.output_path, self.land, iteration=self.iteration,
+                        trajectory_position=trajectories[0].position)
+
+    def __iter__(self):
+        if not self._started:
+            yield self.start()
+        while not self.done:
+            yield self.step()
+
+    def close(self):
+        # every consumer is closed, even when one of them fails
+        with ExitStack() as stack:
+            stack.callback(self.land.grid.flush)
+            stack.callback(self.land.close)
+            if self.timings is not None:
+                stack.callback(self.timings.close)
+            for consumer in self.consumers:
+                stack.callback(consumer.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StepConsumer:
+    # receives the StepRecords of a Simulation. consume() runs under the timings phase of the consumer, if any;
+    # flush() makes everything consumed so far durable, before a checkpoint
+
+    phase = None
+
+    def consume(self, record):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CountsConsumer(StepConsumer):
+    # appends the counts of every record to a metrics sink
+    phase = 'record_counts'
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def consume(self, record):
+        self.sink.append(record.counts)
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+
+
+class TrajectoryConsumer(StepConsumer):
+    # writes every record to a TrajectoryWriter, the initial map as a keyframe. flush() syncs the file and keeps its
+    # position for the checkpoint
+    phase = 'trajectory'
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.position = None
+
+    def consume(self, record):
+        if record.changes is None:
+            self.writer.write_keyframe(record.iteration, record.grid)
+        else:
+            self.writer.write_step(record.iteration, record.grid, record.changes)
+
+    def flush(self):
+        self.position = self.writer.sync()
+
+    def close(self):
+        self.writer.close()
+
+
+class SnapshotConsumer(StepConsumer):
+    # saves the map of every record with a SnapshotWriter. The snapshots are written in the background: a step gets
+    # the render and write times of the ones finished during it
+    phase = 'snapshot'
+
+    def __init__(self, writer, timings=NO_TIMINGS):
+        self.writer = writer
+        self.timings = timings
+        self._times = (writer.render_time, writer.write_time)
+
+    def consume(self, record):
+        self.writer.submit(record.grid, step=record.iteration)
+        times = (self.writer.render_time, self.writer.write_time)
+        self.timings.add_time('render', times[0] - self._times[0])
+        self.timings.add_time('snapshot_io', times[1] - self._times[1])
+        self._times = times
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
 
 
 def make_output_path(output_path_prefix):
-    if output_path_prefix is None:
-        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
-        output_path = f"simulations/{timestamp}"
-    else:
-        output_path = f"simulations/{output_path_prefix}"
+    # creates the output folder. Timestamped folders get a numbered suffix when the timestamp is already taken,
+    # so that simulations started within the same second never share a folder.
+    if output_path_prefix is not None:
+        output_path = f"{SIMULATIONS_PATH}/{output_path_prefix}"
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        return output_path
+
+    timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+    Path(SIMULATIONS_PATH).mkdir(parents=True, exist_ok=True)
+    for k in itertools.count():
+        output_path = f"{SIMULATIONS_PATH}/{timestamp}" if k == 0 else f"{SIMULATIONS_PATH}/{timestamp}-{k}"
+        try:
+            os.mkdir(output_path)
+            return output_path
+        except FileExistsError:
+            pass
 
-    return output_path
+
+def spawn_seeds(random_seed, n):
+    # n independent integer seeds derived from random_seed
+    return [int(seed.generate_state(1, dtype=np.uint64)[0]) for seed in np.random.SeedSequence(random_seed).spawn(n)]
 
 
 def save_metadata(metadata, output_path: str):
@@ -98,10 +390,32 @@ def save_metadata(metadata, output_path: str):
         f.write(json.dumps(metadata))
 
 
+def load_metadata(output_path):
+    with open(os.path.join(output_path, 'metadata.json')) as f:
+        return json.load(f)
+
+
+def initialize_land_from_metadata(metadata):
+    return initialize_land(metadata['size_x'], metadata['size_y'],
+                           amenities_list=get_central_coord(size_x=metadata['size_x'], size_y=metadata['size_y']),
+                           neighboring_centrality_probability=metadata['neighboring_centrality_probability'],
+                           isolated_centrality_probability=metadata['isolated_centrality_probability'],
+                           build_probability=metadata['build_probability'], T=metadata['T_star'],
+                           mode=metadata['initialization_mode'], filepath=metadata['input_filepath'],
+                           max_population=metadata['max_population'], max_ab_km2=metadata['max_ab_km2'],
+                           urbanism_model=metadata['urbanism_model'],
+                           prob_distribution=metadata['prob_distribution'],
+                           density_factors=metadata['density_factors'], random_seed=metadata['random_seed'],
+                           kernel=metadata['kernel'], storage=metadata['storage'],
+                           storage_path=os.path.join(metadata['output_path'], GRID_DIRECTORY),
+                           tile_rows=metadata['tile_rows'], workers=metadata.get('workers', 1))
+
+
 def initialize_land(size_x, size_y, build_probability, neighboring_centrality_probability,
                     isolated_centrality_probability, T, max_population, max_ab_km2, mode,
                     filepath,
-                    amenities_list, urbanism_model, prob_distribution, density_factors):
+                    amenities_list, urbanism_model, prob_distribution, density_factors, random_seed=None,
+                    kernel='python', storage='memory', storage_path=None, tile_rows=None, workers=1):
     assert size_x > 2 * T and size_y > 2 * T, f"size of the map is too small: {size_x}x{size_y}. Dimensions should be larger than {2 * T}"
     assert sum(
         prob_distribution) == 1, f"pobability distribution does not sum-up to 1: sum{prob_distribution} = {sum(prob_distribution)}."
@@ -114,14 +428,18 @@ def initialize_land(size_x, size_y, build_probability, neighboring_centrality_pr
                                   isolated_centrality_probability=isolated_centrality_probability,
                                   build_probability=build_probability, T_star=T,
                                   max_population=max_population, max_ab_km2=max_ab_km2,
-                                  prob_distribution=prob_distribution, density_factors=density_factors)
+                                  prob_distribution=prob_distribution, density_factors=density_factors,
+                                  random_seed=random_seed, kernel=kernel, storage=storage,
+                                  storage_path=storage_path, tile_rows=tile_rows, workers=workers)
     elif urbanism_model == 'classical':
         land = ClassicalScenario(size_x=size_x, size_y=size_y,
                                  neighboring_centrality_probability=neighboring_centrality_probability,
                                  isolated_centrality_probability=isolated_centrality_probability,
                                  build_probability=build_probability, T_star=T,
                                  max_population=max_population, max_ab_km2=max_ab_km2,
-                                 prob_distribution=prob_distribution, density_factors=density_factors)
+                                 prob_distribution=prob_distribution, density_factors=density_factors,
+                                 random_seed=random_seed, kernel=kernel, storage=storage,
+                                 storage_path=storage_path, tile_rows=tile_rows, workers=workers)
     else:
         raise ("Invalid urbanism model. Choose one of 'isobenefit' and 'classical'")
 
@@ -137,43 +455,32 @@ def initialize_land(size_x, size_y, build_probability, neighboring_centrality_pr
 
 
 def update_map_snapshot(land, canvas):
-    for row in land.map:
-        for block in row:
-            if block.is_nature:
-                color = (0 / 255, 158 / 255, 96 / 255)  # green
-            elif block.is_centrality:
-                color = np.ones(3)
-            else:
-                if block.is_built and block.density_level == 'high':
-                    color = np.zeros(3)
-                if block.is_built and block.density_level == 'medium':
-                    color = np.ones(3) / 3
-                if block.is_built and block.density_level == 'low':
-                    color = np.ones(3) * 2 / 3
+    # canvas is a (size_x, size_y, 4) uint8 array, or a float one with colours in [0, 1]
+    render_grid(land.grid.state, land.grid.density, out=canvas)
 
-            canvas[block.y, block.x] = np.array([color[0], color[1], color[2], 1])
 
-
-def save_snapshot(canvas, output_path, step, format='png'):
-    final_path = os.path.join(output_path, f"{step:05d}.png")
-    save_image_from_2Darray(canvas, filepath=final_path, format=format)
+def save_snapshot(canvas, output_path, step, format='png', compress_level=6):
+    final_path = snapshot_path(output_path, step)
+    save_image_from_2Darray(canvas, filepath=final_path, format=format, compress_level=compress_level)
     return final_path
 
 
-def save_min_distances(land: Land, output_path):
-    land_array, population_array = land.get_map_as_array()
-    x_centr, y_centr = np.where(land_array == 2)
-    x_built, y_built = np.where(land_array == 1)
-    x_nature, y_nature = np.where(land_array == 0)
-    distances_from_nature = np.sqrt(
-        (x_built[:, None] - x_nature) ** 2 + (y_built[:, None] - y_nature) ** 2).min(
-        axis=1)
-    distances_from_centr = np.sqrt(
-        (x_built[:, None] - x_centr) ** 2 + (y_built[:, None] - y_centr) ** 2).min(
-        axis=1)
-    distances_mapping_filepath = os.path.join(output_path, "minimal_distances_map.csv")
-    array_of_data = np.concatenate(
-        [x_built.reshape(-1, 1), y_built.reshape(-1, 1), distances_from_nature.reshape(-1, 1),
-         distances_from_centr.reshape(-1, 1)], axis=1)
-    header = "X,Y,min_nature_dist, min_centr_dist"
-    np.savetxt(fname=distances_mapping_filepath, X=array_of_data, delimiter=',', newline='\n', header=header)
+def save_min_distances(land: Land, output_path, save_csv=True):
+    # distance of every block from the closest natural block and from the closest centrality, read from the distance
+    # fields of the land, as float32 rasters in minimal_distances.npz. With save_csv, the distances of the built
+    # blocks are also written to minimal_distances_map.csv, by chunks of CSV_CHUNK_SIZE blocks
+    distances_from_nature = to_distances(land.get_nature_field().dist2)
+    distances_from_centr = to_distances(land.get_centrality_field().dist2)
+    np.savez(os.path.join(output_path, MIN_DISTANCES_FILENAME), nature=distances_from_nature.astype(np.float32),
+             centrality=distances_from_centr.astype(np.float32))
+    if not save_csv:
+        return
+
+    x_built, y_built = np.nonzero(land.grid.state == BUILT)
+    distances_mapping_filepath = os.path.join(output_path, MIN_DISTANCES_CSV_FILENAME)
+    with open(distances_mapping_filepath, 'w') as f:
+        f.write("# X,Y,min_nature_dist, min_centr_dist\n")
+        for start in range(0, len(x_built), CSV_CHUNK_SIZE):
+            x, y = x_built[start:start + CSV_CHUNK_SIZE], y_built[start:start + CSV_CHUNK_SIZE]
+            np.savetxt(f, np.column_stack([x, y, distances_from_nature[x, y], distances_from_centr[x, y]]),
+                       delimiter=',', newline='\n')
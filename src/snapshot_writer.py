@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.image_io import render_grid, save_image_from_2Darray
+
+
+def snapshot_path(output_path, step):
+    return os.path.join(output_path, f"{step:05d}.png")
+
+
+class SnapshotWriter:
+    # renders and saves map snapshots on background threads (PIL releases the GIL while compressing), so that
+    # encoding and disk writes overlap with the following steps. submit() copies the grid arrays and returns at
+    # once, unless max_pending snapshots are still waiting to be written: then it blocks until one of them is done.
+    # Errors raised while writing are raised again by flush(). render_time and write_time add up the seconds spent
+    # rendering and saving the snapshots written so far.
+
+    def __init__(self, output_path, workers=1, max_pending=4, compress_level=6, format='png'):
+        assert workers >= 1 and max_pending >= 1, f"invalid writer settings: {workers} workers, {max_pending} pending"
+        self.output_path = output_path
+        self.compress_level = compress_level
+        self.format = format
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='snapshot-writer')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._times_lock = threading.Lock()
+        self.render_time = 0.0
+        self.write_time = 0.0
+
+    def submit(self, grid, step):
+        state, density = grid.state.copy(), grid.density.copy()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, state, density, step)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures = [f for f in self._futures if not f.done() or f.exception() is not None]
+        self._futures.append(future)
+        return future
+
+    def _write(self, state, density, step):
+        filepath = snapshot_path(self.output_path, step)
+        start = time.perf_counter()
+        canvas = render_grid(state, density)
+        rendered = time.perf_counter()
+        save_image_from_2Darray(canvas, filepath=filepath, format=self.format, compress_level=self.compress_level)
+        with self._times_lock:
+            self.render_time += rendered - start
+            self.write_time += time.perf_counter() - rendered
+        return filepath
+
+    def flush(self):
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
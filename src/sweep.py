@@ -0,0 +1,153 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from src import logger
+from src.checkpoint import CHECKPOINT_FILENAME
+from src.simulation import SIMULATIONS_PATH, run_isobenefit_simulation, resume_isobenefit_simulation, \
+    make_output_path, spawn_seeds
+
+RUN_SUMMARY_FILENAME = 'run_summary.json'
+SWEEP_SPEC_FILENAME = 'sweep.json'
+SWEEP_SUMMARY_FILENAME = 'summary.csv'
+
+# parameters of run_isobenefit_simulation used when the spec does not set them
+DEFAULT_PARAMETERS = {'n_steps': 100,
+                      'build_probability': 0.5,
+                      'neighboring_centrality_probability': 5e-3,
+                      'isolated_centrality_probability': 1e-1,
+                      'T_star': 10,
+                      'input_filepath': None,
+                      'initialization_mode': 'list',
+                      'max_population': 1000000,
+                      'max_ab_km2': 10000,
+                      'urbanism_model': 'isobenefit',
+                      'prob_distribution': (0.7, 0.3, 0),
+                      'density_factors': (1, 0.1, 0.01)}
+
+
+def load_sweep_spec(filepath):
+    with open(filepath) as f:
+        if filepath.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def expand_sweep(spec):
+    # list of the run parameters described by a sweep spec:
+    #   base: parameters shared by all the runs
+    #   grid: lists of values, every combination of which is run
+    #   runs: explicit list of parameter sets, run in addition to the grid
+    #   repetitions: number of runs of each parameter set, with different seeds
+    #   seed: root of the seeds given to the runs that do not set random_seed themselves
+    base = dict(DEFAULT_PARAMETERS, **spec.get('base', {}))
+    grid = spec.get('grid', {})
+    points = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())] if grid else []
+    points += spec.get('runs', [])
+    if len(points) == 0:
+        points = [{}]
+
+    repetitions = spec.get('repetitions', 1)
+    seeds = spawn_seeds(spec.get('seed'), len(points) * repetitions)
+    runs = []
+    for k, (point, repetition) in enumerate(itertools.product(points, range(repetitions))):
+        parameters = dict(base, **point)
+        if 'random_seed' not in point:
+            parameters['random_seed'] = seeds[k]
+        encoded = json.dumps(parameters, sort_keys=True)
+        digest = hashlib.sha1(encoded.encode()).hexdigest()[:8]
+        runs.append((f"run-{k:04d}-{digest}", json.loads(encoded)))
+    return runs
+
+
+def resolve_sweep_spec(spec, output_path):
+    # the spec with its root seed. A spec without seed reuses the one saved in sweep.json by a previous start of the
+    # sweep, or gets a new one, so that a restarted sweep gives its runs the same seeds and ids
+    spec_filepath = os.path.join(output_path, SWEEP_SPEC_FILENAME)
+    saved = None
+    if os.path.exists(spec_filepath):
+        with open(spec_filepath) as f:
+            saved = json.load(f)
+    spec = json.loads(json.dumps(spec))
+    if spec.get('seed') is None:
+        spec['seed'] = saved['seed'] if saved is not None else int(np.random.SeedSequence().entropy)
+    if saved is not None and saved != spec:
+        raise ValueError(f"{spec_filepath} describes a different sweep: use another output path for this one.")
+    return spec
+
+
+def run_sweep_point(output_path_prefix, run_id, parameters):
+    # runs (or resumes from its checkpoint) one simulation of the sweep and returns its summary row
+    run_path = os.path.join(SIMULATIONS_PATH, output_path_prefix, run_id)
+    summary_filepath = os.path.join(run_path, RUN_SUMMARY_FILENAME)
+    start = time.time()
+    if os.path.exists(os.path.join(run_path, CHECKPOINT_FILENAME)):
+        counts = resume_isobenefit_simulation(run_path)
+    else:
+        shutil.rmtree(run_path, ignore_errors=True)
+        counts = run_isobenefit_simulation(output_path_prefix=f"{output_path_prefix}/{run_id}", **parameters)
+
+    summary = dict({'run_id': run_id, 'status': 'finished', 'duration': time.time() - start}, **parameters)
+    summary.update(zip(counts.dtype.names, counts[-1].tolist()))
+    with open(summary_filepath, 'w') as f:
+        f.write(json.dumps(summary))
+    return summary
+
+
+def run_sweep(spec, output_path_prefix=None, workers=None):
+    # runs all the simulations of a sweep spec on a pool of processes, one per core by default. Each run writes to
+    # its own folder, named after its index and parameters; runs that already finished are not run again, and
+    # interrupted runs with a checkpoint are resumed. A summary table of all the runs is written at the end.
+    # The output path, by default the name of the spec, is needed to find the runs again when the sweep is restarted.
+    logger.configure_logging()
+    LOGGER = logger.get_logger()
+    if output_path_prefix is None:
+        output_path_prefix = spec.get('name')
+    if output_path_prefix is None:
+        raise ValueError("A sweep needs an output path, or a name in its spec, to be restarted.")
+    output_path = make_output_path(output_path_prefix)
+    output_path_prefix = os.path.relpath(output_path, SIMULATIONS_PATH)
+    spec = resolve_sweep_spec(spec, output_path)
+    with open(os.path.join(output_path, SWEEP_SPEC_FILENAME), 'w') as f:
+        f.write(json.dumps(spec))
+
+    summaries = {}
+    pending = []
+    runs = expand_sweep(spec)
+    for run_id, parameters in runs:
+        summary_filepath = os.path.join(output_path, run_id, RUN_SUMMARY_FILENAME)
+        if os.path.exists(summary_filepath):
+            with open(summary_filepath) as f:
+                summaries[run_id] = json.load(f)
+        else:
+            pending.append((run_id, parameters))
+    LOGGER.info(f"sweep {output_path}: {len(runs)} runs, {len(pending)} to run")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(run_sweep_point, output_path_prefix, run_id, parameters): (run_id, parameters)
+                   for run_id, parameters in pending}
+        for future in as_completed(futures):
+            run_id, parameters = futures[future]
+            try:
+                summaries[run_id] = future.result()
+                LOGGER.info(f"sweep {output_path}: {run_id} finished")
+            except Exception as e:
+                LOGGER.error(f"sweep {output_path}: {run_id} failed: {e!r}")
+                summaries[run_id] = dict({'run_id': run_id, 'status': 'failed'}, **parameters)
+
+    rows = [summaries[run_id] for run_id, _ in runs]
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    summary_filepath = os.path.join(output_path, SWEEP_SUMMARY_FILENAME)
+    with open(summary_filepath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return summary_filepath
@@ -0,0 +1,109 @@
+import os
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+import numpy as np
+
+TIMINGS_NAME = 'timings'
+
+# phases of a step, in seconds. The update_map phases do not overlap, update_map and step include them
+UPDATE_PHASES = ('rng', 'is_centrality_near', 'candidates', 'nature_stays_extended', 'nature_stays_reachable',
+                 'compiled_checks', 'set_blocks')
+STEP_PHASES = ('update_map', 'counts', 'record_counts', 'trajectory', 'snapshot', 'render', 'snapshot_io',
+               'checkpoint', 'step')
+COUNTERS = ('candidate_blocks', 'accepted_blocks', 'nature_stays_extended_calls', 'nature_stays_extended_rejections',
+            'nature_stays_reachable_calls', 'nature_stays_reachable_rejections')
+REJECTION_RATES = ('nature_stays_extended', 'nature_stays_reachable')
+COLUMNS = (('iteration',) + UPDATE_PHASES + STEP_PHASES + COUNTERS +
+           tuple(f"{name}_rejection_rate" for name in REJECTION_RATES))
+TIMINGS_DTYPE = np.dtype([(name, np.int64 if name == 'iteration' or name in COUNTERS else np.float64)
+                          for name in COLUMNS])
+
+
+class StepTimings:
+    # time spent in each phase of the current step, and counts of the candidate blocks and of the calls and
+    # rejections of the predicates. Land and simulate report to the one set as land.timings.
+
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+        self.reset()
+
+    def reset(self):
+        self.times = dict.fromkeys(UPDATE_PHASES + STEP_PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += perf_counter() - start
+
+    def add_time(self, name, seconds):
+        self.times[name] += seconds
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def row(self, iteration):
+        # the values of the columns of timings, the rejection rates of the predicates not called are nan
+        row = dict(self.times, iteration=iteration, **self.counts)
+        for name in REJECTION_RATES:
+            calls = self.counts[f"{name}_calls"]
+            row[f"{name}_rejection_rate"] = self.counts[f"{name}_rejections"] / calls if calls > 0 else np.nan
+        return row
+
+
+class NoTimings:
+    # does not measure anything, at the least possible cost
+
+    _context = nullcontext()
+
+    def reset(self):
+        pass
+
+    def phase(self, name):
+        return self._context
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NO_TIMINGS = NoTimings()
+
+
+@contextmanager
+def profiled(profiler, output_path):
+    # runs the enclosed code under cProfile (profile.prof and the cumulative stats in profile.txt) or pyinstrument
+    # (profile.html), which is optional. Does nothing when profiler is None.
+    if profiler is None:
+        yield
+    elif profiler == 'cprofile':
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(output_path, 'profile.prof'))
+            with open(os.path.join(output_path, 'profile.txt'), 'w') as f:
+                pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(50)
+    elif profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(os.path.join(output_path, 'profile.html'), 'w') as f:
+                f.write(profile.output_html())
+    else:
+        raise ValueError(f"Invalid profiler: {profiler}. Must be one of None, 'cprofile', 'pyinstrument'.")
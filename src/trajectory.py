@@ -0,0 +1,183 @@
+import os
+import re
+import zipfile
+
+import numpy as np
+
+from src.grid_state import GRID_ARRAYS, GridState
+from src.image_io import render_grid, save_image_from_2Darray
+from src.snapshot_writer import snapshot_path
+
+DELTA_ARRAYS = ('indices',) + GRID_ARRAYS
+# members are stamped with a fixed date so that the same run always writes the same file
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class TrajectoryWriter:
+    # stores a whole simulation in a single zip file of .npy members, readable with np.load. Every step is stored
+    # as the flat indices of the blocks it changed with their new state, density and inhabitants; the deltas of
+    # chunk_size steps are gathered in one compressed member. A keyframe with the complete grid is stored every
+    # keyframe_interval steps, so that any step can be rebuilt from the closest keyframe before it.
+    # sync() makes the file complete and readable up to the last written step; the position it returns can be
+    # passed to resume() to cut the file back to that point, e.g. after the process has been killed.
+
+    def __init__(self, filepath, shape, keyframe_interval=100, chunk_size=100, mode='w'):
+        assert keyframe_interval >= 1 and chunk_size >= 1, "keyframe interval and chunk size must be positive"
+        self.filepath = filepath
+        self.shape = tuple(shape)
+        self.keyframe_interval = keyframe_interval
+        self.chunk_size = chunk_size
+        self._zip = zipfile.ZipFile(filepath, mode=mode, compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        if mode == 'w':
+            self._write_array('shape', np.array(self.shape))
+        self._steps = []
+        self._deltas = []
+
+    @classmethod
+    def resume(cls, filepath, position, keyframe_interval=100, chunk_size=100):
+        offset, directory = position
+        with open(filepath, 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(directory)
+        with np.load(filepath) as npz:
+            shape = npz['shape']
+        return cls(filepath, shape, keyframe_interval=keyframe_interval, chunk_size=chunk_size, mode='a')
+
+    def _write_array(self, name, array):
+        info = zipfile.ZipInfo(f"{name}.npy", date_time=ZIP_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self._zip.open(info, mode='w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+
+    def write_keyframe(self, step, grid):
+        for name in GRID_ARRAYS:
+            self._write_array(f"keyframe_{step:06d}_{name}", getattr(grid, name))
+
+    def write_step(self, step, grid, changes):
+        self._steps.append(step)
+        self._deltas.append((changes.indices, changes.new_state, changes.new_density, changes.new_inhabitants))
+        if len(self._steps) == self.chunk_size:
+            self._write_chunk()
+        if step % self.keyframe_interval == 0:
+            self.write_keyframe(step, grid)
+
+    def _write_chunk(self):
+        if len(self._steps) == 0:
+            return
+        name = f"deltas_{self._steps[0]:06d}_{self._steps[-1]:06d}"
+        self._write_array(f"{name}_steps", np.array(self._steps))
+        self._write_array(f"{name}_offsets", np.cumsum([0] + [len(delta[0]) for delta in self._deltas]))
+        for k, array_name in enumerate(DELTA_ARRAYS):
+            self._write_array(f"{name}_{array_name}", np.concatenate([delta[k] for delta in self._deltas]))
+        self._steps = []
+        self._deltas = []
+
+    def sync(self):
+        # writes the pending deltas and the zip central directory, and returns the offset of the directory in the
+        # file with its content. Later members are appended over the directory.
+        self._write_chunk()
+        self._zip.close()
+        with open(self.filepath, 'rb') as f:
+            offset = zipfile.ZipFile(f).start_dir
+            f.seek(offset)
+            directory = f.read()
+            os.fsync(f.fileno())
+        self._zip = zipfile.ZipFile(self.filepath, mode='a', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        return offset, directory
+
+    def close(self):
+        self._write_chunk()
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TrajectoryReader:
+    # random access to the steps of a trajectory file written by TrajectoryWriter
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._npz = np.load(filepath, allow_pickle=False)
+        self.shape = tuple(self._npz['shape'])
+        keyframes = set()
+        self._chunks = []
+        for name in self._npz.files:
+            match = re.fullmatch(r'keyframe_(\d+)_state', name)
+            if match:
+                keyframes.add(int(match.group(1)))
+            match = re.fullmatch(r'deltas_(\d+)_(\d+)_steps', name)
+            if match:
+                self._chunks.append((int(match.group(1)), int(match.group(2))))
+        self.keyframes = sorted(keyframes)
+        self._chunks.sort()
+        self._chunk_cache = None
+        last_delta = self._chunks[-1][1] if len(self._chunks) > 0 else 0
+        self.last_step = max(self.keyframes[-1] if len(self.keyframes) > 0 else 0, last_delta)
+
+    def _load_chunk(self, chunk):
+        if self._chunk_cache is None or self._chunk_cache[0] != chunk:
+            name = f"deltas_{chunk[0]:06d}_{chunk[1]:06d}"
+            arrays = {array_name: self._npz[f"{name}_{array_name}"]
+                      for array_name in ('steps', 'offsets') + DELTA_ARRAYS}
+            self._chunk_cache = (chunk, arrays)
+        return self._chunk_cache[1]
+
+    def read(self, step):
+        # grid of the land at the end of the given step
+        if not 0 <= step <= self.last_step:
+            raise ValueError(f"step {step} is not in the trajectory, which ends at step {self.last_step}")
+        keyframe = max(k for k in self.keyframes if k <= step)
+        grid = GridState(*self.shape)
+        for name in GRID_ARRAYS:
+            getattr(grid, name)[:] = self._npz[f"keyframe_{keyframe:06d}_{name}"]
+        for chunk in self._chunks:
+            if chunk[1] <= keyframe or chunk[0] > step:
+                continue
+            arrays = self._load_chunk(chunk)
+            for k, delta_step in enumerate(arrays['steps']):
+                if keyframe < delta_step <= step:
+                    start, end = arrays['offsets'][k], arrays['offsets'][k + 1]
+                    indices = arrays['indices'][start:end]
+                    for name in GRID_ARRAYS:
+                        getattr(grid, name).flat[indices] = arrays[name][start:end]
+        return grid
+
+    def replay(self):
+        # (step, grid) for every step of the trajectory in order. The same grid is updated and yielded each time.
+        grid = self.read(0)
+        yield 0, grid
+        for chunk in self._chunks:
+            arrays = self._load_chunk(chunk)
+            for k, step in enumerate(arrays['steps']):
+                start, end = arrays['offsets'][k], arrays['offsets'][k + 1]
+                indices = arrays['indices'][start:end]
+                for name in GRID_ARRAYS:
+                    getattr(grid, name).flat[indices] = arrays[name][start:end]
+                yield int(step), grid
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_snapshots(trajectory_filepath, output_path, steps=None, format='png', compress_level=6):
+    # renders the given steps of a trajectory (all of them by default) as {step:05d}.png images
+    paths = []
+    with TrajectoryReader(trajectory_filepath) as reader:
+        grids = reader.replay() if steps is None else ((step, reader.read(step)) for step in steps)
+        for step, grid in grids:
+            final_path = snapshot_path(output_path, step)
+            save_image_from_2Darray(render_grid(grid.state, grid.density), filepath=final_path, format=format,
+                                    compress_level=compress_level)
+            paths.append(final_path)
+    return paths
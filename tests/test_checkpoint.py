@@ -0,0 +1,39 @@
+import os
+import tempfile
+from unittest import TestCase
+import numpy as np
+
+from src.checkpoint import CHECKPOINT_FILENAME, load_checkpoint, save_checkpoint
+from src.land_map import ClassicalScenario, IsobenefitScenario, MapBlock
+
+
+class TestCheckpoint(TestCase):
+    def test_save_and_load_checkpoint(self):
+        attributes = ['current_built_blocks', 'current_centralities', 'current_population', 'avg_dist_from_nature',
+                      'avg_dist_from_centr', 'max_dist_from_nature', 'max_dist_from_centr']
+        for scenario, urbanism_model in [(IsobenefitScenario, 'isobenefit'), (ClassicalScenario, 'classical')]:
+            lands = [scenario(size_x=30, size_y=25, T_star=3, build_probability=0.4,
+                              neighboring_centrality_probability=0.1, prob_distribution=(0.2, 0.3, 0.5),
+                              random_seed=seed) for seed in [2, 0]]
+            lands[0].set_centralities([MapBlock(12, 12)])
+            for _ in range(4):
+                lands[0].set_current_counts(urbanism_model)
+                lands[0].update_map()
+            lands[0].set_current_counts(urbanism_model)
+            with tempfile.TemporaryDirectory() as output_path:
+                filepath = save_checkpoint(output_path, lands[0], 4, (123, b'directory'))
+                self.assertEqual(os.path.join(output_path, CHECKPOINT_FILENAME), filepath)
+                self.assertEqual([CHECKPOINT_FILENAME], os.listdir(output_path))
+                iteration, position = load_checkpoint(output_path, lands[1])
+            self.assertEqual(4, iteration)
+            self.assertEqual((123, b'directory'), position)
+
+            # the restored land carries on with the same random draws and counts
+            for _ in range(4):
+                for land in lands:
+                    land.update_map()
+                    land.set_current_counts(urbanism_model)
+                for name in ['state', 'density', 'inhabitants']:
+                    np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(lands[1].grid, name))
+                for attribute in attributes:
+                    self.assertEqual(getattr(lands[0], attribute), getattr(lands[1], attribute))
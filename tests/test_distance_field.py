@@ -0,0 +1,75 @@
+from unittest import TestCase
+import numpy as np
+
+from src.distance_field import NO_SOURCE, DistanceField, to_distances
+from src.grid_state import BUILT, NATURE
+from src.land_map import Land
+
+
+def nature_stays_reachable_brute_force(land, x, y):
+    land_array = land.get_map_as_array()[0].copy()
+    land_array[x, y] = 1
+    x_built, y_built = np.where(land_array > 0)
+    x_nature, y_nature = np.where(land_array == 0)
+    return np.sqrt((x_built[:, None] - x_nature) ** 2 + (y_built[:, None] - y_nature) ** 2).min(
+        axis=1).max() <= land.T_star
+
+
+def rebuilt(land):
+    fresh = Land(size_x=land.size_x, size_y=land.size_y, T_star=land.T_star)
+    fresh.grid.state[:] = land.grid.state
+    fresh.grid.touch()
+    return fresh
+
+
+class TestDistanceField(TestCase):
+    def test_local_updates_match_rebuild(self):
+        rng = np.random.default_rng(2)
+        sources = rng.random((30, 25)) < 0.05
+        field = DistanceField(sources)
+        for step in range(200):
+            if step == 190:
+                field.start_journal()
+                dist2 = field.dist2.copy()
+            x, y = rng.integers(0, 30), rng.integers(0, 25)
+            if field.sources[x, y]:
+                field.remove_source(x, y)
+            else:
+                field.add_source(x, y)
+            expected = DistanceField(field.sources)
+            np.testing.assert_array_equal(expected.dist2, field.dist2)
+            nearest = np.unravel_index(field.nearest, field.shape)
+            rows, cols = np.indices(field.shape)
+            np.testing.assert_array_equal(field.dist2, (rows - nearest[0]) ** 2 + (cols - nearest[1]) ** 2)
+
+        # replaying the journal backwards gives back the field before it was started
+        for indices, previous in reversed(field.journal):
+            field.dist2.flat[indices] = previous
+        np.testing.assert_array_equal(dist2, field.dist2)
+
+    def test_no_sources(self):
+        field = DistanceField(np.zeros((5, 4), dtype=bool))
+        self.assertTrue((field.dist2 == NO_SOURCE).all())
+        self.assertTrue(np.isinf(field.distances(np.ones((5, 4), dtype=bool))).all())
+        field.add_source(1, 2)
+        np.testing.assert_array_equal([0, 1, 5], field.dist2[[1, 1, 0], [2, 1, 0]])
+        field.remove_source(1, 2)
+        self.assertTrue((field.dist2 == NO_SOURCE).all())
+        self.assertEqual(2., to_distances(np.array([4]))[0])
+
+    def test_nature_stays_reachable_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        outcomes = set()
+        for T_star, built_fraction in [(1, 0.1), (2, 0.2), (3, 0.3)]:
+            land = Land(size_x=25, size_y=20, T_star=T_star)
+            land.grid.state[rng.random((25, 20)) < built_fraction] = BUILT
+            land.grid.touch()
+            for _ in range(500):
+                x, y = rng.integers(0, 25), rng.integers(0, 20)
+                expected = nature_stays_reachable_brute_force(land, x, y)
+                self.assertEqual(expected, land.nature_stays_reachable(x, y))
+                outcomes.add(expected)
+                if expected and land.grid.state[x, y] == NATURE:
+                    land.set_block(x, y, BUILT, 'high')
+            np.testing.assert_array_equal(land.get_nature_field().dist2, rebuilt(land).get_nature_field().dist2)
+        self.assertEqual({True, False}, outcomes)
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+import numpy as np
+
+from src.ensemble import ClassicalEnsemble, IsobenefitEnsemble
+from src.land_map import MapBlock, IsobenefitScenario, ClassicalScenario
+
+
+class TestEnsemble(TestCase):
+    def test_classical_ensemble(self):
+        seeds = [3, 4, 5]
+        parameters = dict(T_star=3, build_probability=0.3, neighboring_centrality_probability=0.1,
+                          isolated_centrality_probability=0.5, prob_distribution=(0.2, 0.3, 0.5),
+                          max_population=20000)
+        lands = []
+        for seed in seeds:
+            land = ClassicalScenario(size_x=30, size_y=25, random_seed=seed, kernel='vectorized', **parameters)
+            land.set_centralities([MapBlock(12, 12)])
+            land.set_current_counts(urbanism_model='classical')
+            lands.append(land)
+        ensemble = ClassicalEnsemble(lands[0].grid, seeds, **parameters)
+
+        for _ in range(12):
+            added_blocks, added_centralities = ensemble.update_map()
+            ensemble.set_current_counts()
+            for k, land in enumerate(lands):
+                if land.current_population <= land.max_population:
+                    changes = land.update_map()
+                    land.set_current_counts(urbanism_model='classical')
+                    self.assertEqual(changes.added_blocks, added_blocks[k])
+                    self.assertEqual(changes.added_centralities, added_centralities[k])
+                for name in ['state', 'density', 'inhabitants']:
+                    np.testing.assert_array_equal(getattr(land.grid, name), getattr(ensemble, name)[k])
+                for name in ['current_built_blocks', 'current_centralities', 'current_population',
+                             'avg_dist_from_nature', 'avg_dist_from_centr', 'max_dist_from_centr']:
+                    self.assertAlmostEqual(getattr(land, name), ensemble.statistics[name][k], places=9)
+                self.assertAlmostEqual(land.avg_dist_from_nature_wide,
+                                       ensemble.statistics['avg_dist_from_wide_nature'][k], places=9)
+        self.assertFalse(ensemble.active.all())
+
+    def test_isobenefit_ensemble(self):
+        seeds = [3, 4, 5]
+        parameters = dict(T_star=3, build_probability=0.3, neighboring_centrality_probability=0.1,
+                          isolated_centrality_probability=0.5, prob_distribution=(0.2, 0.3, 0.5),
+                          max_population=20000)
+        lands = []
+        for seed in seeds:
+            land = IsobenefitScenario(size_x=30, size_y=25, random_seed=seed, **parameters)
+            land.set_centralities([MapBlock(12, 12)])
+            land.set_current_counts(urbanism_model='isobenefit')
+            lands.append(land)
+        ensemble = IsobenefitEnsemble(lands[0].grid, seeds, **parameters)
+
+        for _ in range(15):
+            added_blocks, added_centralities = ensemble.update_map()
+            ensemble.set_current_counts()
+            for k, land in enumerate(lands):
+                if land.current_population <= land.max_population:
+                    changes = land.update_map()
+                    land.set_current_counts(urbanism_model='isobenefit')
+                    self.assertEqual(changes.added_blocks, added_blocks[k])
+                    self.assertEqual(changes.added_centralities, added_centralities[k])
+                for name in ['state', 'density', 'inhabitants']:
+                    np.testing.assert_array_equal(getattr(land.grid, name), getattr(ensemble, name)[k])
+                for name in ['current_built_blocks', 'current_centralities', 'current_population',
+                             'avg_dist_from_nature', 'avg_dist_from_centr', 'max_dist_from_centr']:
+                    self.assertAlmostEqual(getattr(land, name), ensemble.statistics[name][k], places=9)
+        self.assertFalse(ensemble.active.all())
+        self.assertNotIn('avg_dist_from_wide_nature', ensemble.statistics)
@@ -0,0 +1,34 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from src.grid_state import GridState
+from src.land_map import Land, MapBlock, IsobenefitScenario, ClassicalScenario
+
+
+class TestGridState(TestCase):
+    def test_grid_files_storage_and_tiles(self):
+        with tempfile.TemporaryDirectory() as storage_path:
+            for scenario, kernel in [(IsobenefitScenario, 'python'), (ClassicalScenario, 'python'),
+                                     (ClassicalScenario, 'vectorized')]:
+                lands = []
+                for storage, tile_rows in [('memory', None), ('grid-files', 4)]:
+                    land = scenario(size_x=30, size_y=25, T_star=3, build_probability=0.3,
+                                    neighboring_centrality_probability=0.1, prob_distribution=(0.2, 0.3, 0.5),
+                                    random_seed=6, kernel=kernel, storage=storage, storage_path=storage_path,
+                                    tile_rows=tile_rows)
+                    land.set_centralities([MapBlock(12, 12)])
+                    for _ in range(6):
+                        land.set_current_counts(urbanism_model='isobenefit')
+                        land.update_map()
+                    lands.append(land)
+                self.assertIsInstance(lands[1].grid.state, np.memmap)
+                lands[1].grid.flush()
+                mapped = GridState.open(storage_path)
+                self.assertFalse(mapped.state.flags.writeable)
+                for name in ['state', 'density', 'inhabitants']:
+                    np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(lands[1].grid, name))
+                    np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(mapped, name))
+                del mapped, lands
+        self.assertRaises(ValueError, Land, size_x=30, size_y=25, storage='grid-files')
@@ -0,0 +1,62 @@
+import tempfile
+import warnings
+from unittest import TestCase
+import numpy as np
+from PIL import Image
+
+from src.grid_state import BUILT, CENTRALITY, DENSITY_CODES, NATURE
+from src.image_io import FLOAT_PALETTE, PALETTE, import_2Darray_from_image, open_image, render_grid, \
+    save_image_from_2Darray
+
+
+class TestImageIO(TestCase):
+    def test_import_2Darray_from_image(self):
+        data = import_2Darray_from_image('fixtures/test_land_map.png')
+        pixels = open_image('fixtures/test_land_map.png')
+        self.assertEqual((20, 10, 4), pixels.shape)
+        self.assertEqual((20, 10), data.shape)
+        self.assertEqual(0, data.min())
+        self.assertEqual(1, data.max())
+        np.testing.assert_array_equal(data.argsort(axis=None), pixels.mean(axis=2).argsort(axis=None))
+
+        # a tiled TIFF gives the same array as the png it was made from
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = f"{directory}/test_land_map.tif"
+            Image.open('fixtures/test_land_map.png').save(filepath, compression='tiff_deflate',
+                                                          tiffinfo={322: 16, 323: 16})
+            np.testing.assert_array_equal(pixels, open_image(filepath))
+            tiff_data = import_2Darray_from_image(filepath, dtype=np.float32)
+            self.assertEqual(np.float32, tiff_data.dtype)
+            np.testing.assert_allclose(data, tiff_data, rtol=1e-6)
+
+    def test_open_image_limits(self):
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 150
+        try:
+            # the 200 pixels of the image are over the limit of Pillow, but under twice of it
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                self.assertEqual((20, 10, 4), open_image('fixtures/test_land_map.png').shape)
+            self.assertEqual(150, Image.MAX_IMAGE_PIXELS)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+        self.assertEqual((20, 10), import_2Darray_from_image('fixtures/test_land_map.png', max_pixels=200).shape)
+        self.assertRaises(ValueError, open_image, 'fixtures/test_land_map.png', max_pixels=199)
+
+    def test_render_grid(self):
+        state = np.array([[NATURE, BUILT], [BUILT, CENTRALITY]], dtype=np.int8)
+        density = np.array([[0, DENSITY_CODES['high']], [DENSITY_CODES['low'], 0]], dtype=np.int8)
+        canvas = render_grid(state, density)
+        self.assertEqual((2, 2, 4), canvas.shape)
+        self.assertEqual(np.uint8, canvas.dtype)
+        np.testing.assert_array_equal([0, 0, 0, 255], canvas[0, 1])
+        np.testing.assert_array_equal([255, 255, 255, 255], canvas[1, 1])
+
+        float_canvas = render_grid(state, density, out=np.zeros((2, 2, 4), dtype=np.float32))
+        np.testing.assert_array_equal(np.uint8(255 * float_canvas), canvas)
+        np.testing.assert_array_equal(np.uint8(255 * FLOAT_PALETTE), PALETTE)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for image in [canvas, float_canvas]:
+                save_image_from_2Darray(image, f"{directory}/canvas.png", compress_level=1)
+                np.testing.assert_array_equal(canvas, open_image(f"{directory}/canvas.png"))
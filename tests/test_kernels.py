@@ -0,0 +1,39 @@
+from unittest import TestCase
+import numpy as np
+from scipy.ndimage import label
+
+from src.kernels import _neighbor_regions, _regions, compiled_isobenefit_sweep, isobenefit_sweep
+
+
+class TestKernels(TestCase):
+    def test_regions(self):
+        rng = np.random.default_rng(0)
+        for fraction in [0.4, 0.55, 0.7]:
+            nature = rng.random((30, 25)) < fraction
+            labels = np.zeros(nature.shape, dtype=np.int32)
+            queue = np.empty(nature.size, dtype=np.int64)
+            self.assertEqual(label(nature)[1], _regions(nature, labels, queue))
+            self.assertFalse(labels.any())
+
+            for x, y in rng.integers(0, [30, 25], size=(60, 2)).tolist():
+                removed = nature.copy()
+                removed[x, y] = False
+                regions = label(removed)[0]
+                expected = {regions[i, j] for i, j in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
+                            if 0 <= i < 30 and 0 <= j < 25 and removed[i, j]}
+                if len(expected) > 0:
+                    self.assertEqual(len(expected), _neighbor_regions(removed, x, y, labels, queue))
+                    self.assertFalse(labels.any())
+
+    def test_compiled_isobenefit_sweep(self):
+        sweep = compiled_isobenefit_sweep()
+        if sweep is None:
+            self.skipTest("numba is not installed")
+        rng = np.random.default_rng(1)
+        nature = np.ones((40, 35), dtype=bool)
+        nature[15:25, 10:20] = False
+        xs, ys = rng.integers(3, [37, 32], size=(300, 2)).T
+        expected = isobenefit_sweep(nature.copy(), xs, ys, 3, True)
+        self.assertGreater(np.count_nonzero(expected), 20)
+        np.testing.assert_array_equal(expected, sweep(nature.copy(), xs, ys, 3, True))
+        self.assertFalse(sweep(nature.copy(), xs, ys, 3, False).any())
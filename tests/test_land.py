@@ -1,7 +1,11 @@
+import tempfile
 from unittest import TestCase
 import numpy as np
+from PIL import Image
+from scipy.ndimage import distance_transform_edt
 
-from src.land_map import Land, MapBlock, is_nature_wide_along_axis
+from src.grid_state import BUILT, CENTRALITY, NATURE
+from src.land_map import Land, MapBlock, IsobenefitScenario, ClassicalScenario, is_nature_wide_along_axis
 
 
 class TestLand(TestCase):
@@ -63,6 +67,15 @@ class TestLand(TestCase):
         self.assertFalse(land.is_centrality_near(14, 7))
         self.assertRaises(AssertionError, land.is_centrality_near, x=4, y=4)
 
+    def test_candidate_masks(self):
+        land = self.get_land()
+        land.set_block(14, 10, CENTRALITY)
+        built_neighbor = land.get_built_neighbor_mask()
+        centrality_near = land.get_centrality_near_mask()
+        for x, y in np.argwhere(land.get_interior_mask()):
+            self.assertEqual(land.is_any_neighbor_built(x, y), built_neighbor[x, y])
+            self.assertEqual(land.is_centrality_near(x, y), centrality_near[x, y])
+
     def test_is_nature_wide_along_axis(self):
         land_array_1d = np.array([1, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 1])
 
@@ -95,6 +108,114 @@ class TestLand(TestCase):
                 land.map[i][j].is_nature = False
         self.assertFalse(land.nature_stays_reachable(15, 14))
 
+    @staticmethod
+    def rebuilt(land):
+        fresh = Land(size_x=land.size_x, size_y=land.size_y, T_star=land.T_star)
+        fresh.grid.state[:] = land.grid.state
+        fresh.grid.touch()
+        return fresh
+
+    def test_update_map_is_reproducible(self):
+        for scenario in [IsobenefitScenario, ClassicalScenario]:
+            maps = []
+            for seed in [3, 3, 4]:
+                land = scenario(size_x=30, size_y=30, T_star=3, neighboring_centrality_probability=0.1,
+                                random_seed=seed)
+                land.set_centralities([MapBlock(15, 15)])
+                for _ in range(5):
+                    land.set_current_counts(urbanism_model='isobenefit')
+                    land.update_map()
+                maps.append(land.get_map_as_array()[0].copy())
+            np.testing.assert_array_equal(maps[0], maps[1])
+            self.assertFalse(np.array_equal(maps[0], maps[2]))
+
+    def test_incremental_counts(self):
+        attributes = ['current_built_blocks', 'current_centralities', 'current_free_nature', 'current_population',
+                      'avg_dist_from_nature', 'avg_dist_from_centr', 'max_dist_from_nature', 'max_dist_from_centr']
+        wide_attributes = ['avg_dist_from_nature_wide', 'max_dist_from_nature_wide']
+        for scenario, urbanism_model in [(IsobenefitScenario, 'isobenefit'), (ClassicalScenario, 'classical')]:
+            land = scenario(size_x=30, size_y=30, T_star=3, build_probability=0.3,
+                            neighboring_centrality_probability=0.1, prob_distribution=(0.2, 0.3, 0.5), random_seed=5)
+            land.set_centralities([MapBlock(15, 15)])
+            land.set_current_counts(urbanism_model)
+            added_blocks = 0
+            for _ in range(6):
+                changes = land.update_map()
+                land.set_current_counts(urbanism_model)
+                added_blocks += changes.added_blocks
+                self.assertEqual(len(changes), len(np.unique(changes.indices)))
+
+                fresh = Land(size_x=land.size_x, size_y=land.size_y, T_star=land.T_star)
+                for name in ['state', 'density', 'inhabitants']:
+                    getattr(fresh.grid, name)[:] = getattr(land.grid, name)
+                fresh.grid.touch()
+                fresh.set_current_counts(urbanism_model)
+                for attribute in attributes + (wide_attributes if urbanism_model == 'classical' else []):
+                    self.assertAlmostEqual(getattr(fresh, attribute), getattr(land, attribute), places=9)
+            self.assertGreater(added_blocks, 0)
+            self.assertEqual(np.count_nonzero(land.grid.state == BUILT), added_blocks)
+
+    def test_classical_vectorized_kernel(self):
+        lands = []
+        for kernel in ['python', 'vectorized']:
+            land = ClassicalScenario(size_x=40, size_y=40, T_star=3, build_probability=0.3,
+                                     neighboring_centrality_probability=0, isolated_centrality_probability=0,
+                                     prob_distribution=(0.2, 0.3, 0.5), random_seed=7, kernel=kernel)
+            land.set_centralities([MapBlock(20, 20)])
+            for _ in range(8):
+                land.set_current_counts(urbanism_model='classical')
+                land.update_map()
+            lands.append(land)
+        for name in ['state', 'density', 'inhabitants']:
+            np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(lands[1].grid, name))
+        self.assertRaises(ValueError, IsobenefitScenario, size_x=40, size_y=40, kernel='vectorized')
+
+    def test_isobenefit_numba_kernel(self):
+        # with or without numba installed, the kernel gives the same maps as the python one
+        for T_star, prob_distribution in [(2, (0.7, 0.3, 0)), (3, (0.2, 0.3, 0.5))]:
+            lands = []
+            for kernel in ['python', 'numba']:
+                land = IsobenefitScenario(size_x=40, size_y=35, T_star=T_star, build_probability=0.6,
+                                          neighboring_centrality_probability=0.05, prob_distribution=prob_distribution,
+                                          random_seed=9, kernel=kernel)
+                land.set_centralities([MapBlock(15, 15), MapBlock(25, 20)])
+                lands.append(land)
+            for _ in range(15):
+                changes = []
+                for land in lands:
+                    land.set_current_counts(urbanism_model='isobenefit')
+                    changes.append(land.update_map())
+                np.testing.assert_array_equal(changes[0].indices, changes[1].indices)
+                for name in ['state', 'density', 'inhabitants']:
+                    np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(lands[1].grid, name))
+            self.assertGreater(np.count_nonzero(lands[0].grid.state == BUILT), 50)
+
+    def test_isobenefit_tiled_kernel(self):
+        lands = []
+        for workers in [1, 2]:
+            land = IsobenefitScenario(size_x=60, size_y=50, T_star=3, build_probability=0.5,
+                                      neighboring_centrality_probability=0.05, random_seed=8, kernel='tiled',
+                                      workers=workers)
+            land.TILE_SIZE = 8
+            land.set_centralities([MapBlock(20, 20), MapBlock(40, 30)])
+            for _ in range(12):
+                land.set_current_counts(urbanism_model='isobenefit')
+                land.update_map()
+                nature_array = land.grid.state == NATURE
+                fresh = self.rebuilt(land)
+                self.assertTrue(fresh.get_nature_topology().is_extended())
+                self.assertLessEqual(distance_transform_edt(~nature_array).max(), land.T_star)
+                # the structures of the land are updated with the results of the tiles
+                np.testing.assert_array_equal(land.get_nature_field().dist2, fresh.get_nature_field().dist2)
+                for name in ['row_length', 'row_offset', 'col_length', 'col_offset']:
+                    np.testing.assert_array_equal(getattr(land.get_nature_topology(), name),
+                                                  getattr(fresh.get_nature_topology(), name))
+            land.close()
+            lands.append(land)
+        self.assertGreater(np.count_nonzero(lands[0].grid.state == BUILT), 50)
+        for name in ['state', 'density', 'inhabitants']:
+            np.testing.assert_array_equal(getattr(lands[0].grid, name), getattr(lands[1].grid, name))
+
     def test_set_current_counts_isobenefit(self):
         land = Land(size_x=30, size_y=30)
         for i in range(10, 20):
@@ -141,6 +262,22 @@ class TestLand(TestCase):
         for x, y in expected_centralities:
             assert land.map[x][y].is_centrality == True
 
+    def test_initialize_map_from_tiff(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = f"{directory}/test_land_map.tif"
+            Image.open('fixtures/test_land_map.png').save(filepath, compression='tiff_deflate',
+                                                          tiffinfo={322: 16, 323: 16})
+            land = Land(20, 10)
+            land.set_configuration_from_image(filepath)
+            np.testing.assert_array_equal(self.get_expected_array(), land.get_map_as_array()[0])
+
+            # the natural blocks of the image are darker than half the scale
+            land = Land(20, 10)
+            land.set_configuration_from_image(filepath, thresholds=(0.5, 1))
+            expected_array = self.get_expected_array()
+            expected_array[expected_array == 0] = 1
+            np.testing.assert_array_equal(expected_array, land.get_map_as_array()[0])
+
     def test_logger(self):
         from src import logger
         LOGGER = logger.get_logger()
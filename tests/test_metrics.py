@@ -0,0 +1,38 @@
+import tempfile
+from unittest import TestCase
+import numpy as np
+
+from src.metrics import MemorySink, counts_dtype, load_metrics, open_metrics
+
+
+class TestMetrics(TestCase):
+    def test_metrics_sinks(self):
+        dtype = counts_dtype('isobenefit')
+        self.assertNotIn('avg_dist_from_wide_nature', dtype.names)
+        self.assertIn('avg_dist_from_wide_nature', counts_dtype('classical').names)
+        self.assertRaises(ValueError, counts_dtype, 'other')
+
+        rows = np.zeros(10, dtype=dtype)
+        rows['iteration'] = np.arange(10)
+        rows['current_population'] = np.linspace(0, 1000, 10) / 3
+        rows['avg_dist_from_nature'][3] = np.inf
+        with tempfile.TemporaryDirectory() as output_path:
+            for metrics_format in ['csv', 'npy']:
+                sink = open_metrics(metrics_format, output_path, 'counts', dtype, buffer_size=4)
+                for row in rows[:7]:
+                    sink.append(dict(zip(dtype.names, row)))
+                # the rows are written by batches of 4
+                self.assertEqual(4, len(load_metrics(sink.filepath)))
+                sink.close()
+                np.testing.assert_array_equal(rows[:7], load_metrics(sink.filepath).astype(dtype))
+
+                # resuming drops the rows after the given iteration
+                with open_metrics(metrics_format, output_path, 'counts', dtype, resume_from=4) as sink:
+                    for row in rows[5:]:
+                        sink.append(dict(zip(dtype.names, row)))
+                    np.testing.assert_array_equal(rows, sink.to_array().astype(dtype))
+
+        sink = MemorySink(dtype, buffer_size=3)
+        for row in rows:
+            sink.append(dict(zip(dtype.names, row)))
+        np.testing.assert_array_equal(rows, sink.to_array())
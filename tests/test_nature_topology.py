@@ -0,0 +1,64 @@
+from functools import partial
+from unittest import TestCase
+import numpy as np
+from scipy.ndimage import label
+
+from src.grid_state import BUILT, NATURE
+from src.land_map import Land, is_nature_wide_along_axis
+from src.nature_topology import NatureTopology
+
+
+def nature_stays_extended_brute_force(land, x, y):
+    nature_array = np.where(land.get_map_as_array()[0] == 0, 1, 0)
+    nature_array[x, y] = 0
+    is_wide_enough = [np.apply_along_axis(partial(is_nature_wide_along_axis, T_star=land.T_star), axis=axis,
+                                          arr=nature_array).all() for axis in [0, 1]]
+    return label(nature_array)[1] == 1 and all(is_wide_enough)
+
+
+def assert_same_topology(expected, topology):
+    assert expected.components == topology.components
+    for name in ['row_length', 'row_offset', 'col_length', 'col_offset', 'narrow_rows', 'narrow_cols']:
+        np.testing.assert_array_equal(getattr(expected, name), getattr(topology, name))
+    assert expected.narrow_rows_total == topology.narrow_rows_total
+    assert expected.narrow_cols_total == topology.narrow_cols_total
+
+
+class TestNatureTopology(TestCase):
+    def test_runs(self):
+        nature = np.ones((4, 6), dtype=bool)
+        nature[1, 2] = False
+        nature[:, 4] = False
+        topology = NatureTopology(nature, T_star=2)
+        np.testing.assert_array_equal([4, 4, 4, 4, 0, 1], topology.row_length[0])
+        np.testing.assert_array_equal([2, 2, 0, 1, 0, 1], topology.row_length[1])
+        np.testing.assert_array_equal([0, 1, 0, 0, 0, 0], topology.row_offset[1])
+        np.testing.assert_array_equal([1, 0, 2, 2], topology.col_length[:, 2])
+        self.assertEqual(2, topology.components)
+        self.assertFalse(topology.is_extended())
+
+    def test_remove_matches_rebuild(self):
+        rng = np.random.default_rng(3)
+        topology = NatureTopology(np.ones((15, 12), dtype=bool), T_star=2)
+        for _ in range(80):
+            x, y = rng.integers(0, 15), rng.integers(0, 12)
+            stays_extended = topology.stays_extended_without(x, y)
+            topology.remove(x, y)
+            expected = NatureTopology(topology.nature, T_star=2)
+            self.assertEqual(expected.is_extended(), stays_extended)
+            assert_same_topology(expected, topology)
+
+    def test_nature_stays_extended_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        outcomes = set()
+        for T_star in [1, 2, 3]:
+            land = Land(size_x=20, size_y=18, T_star=T_star)
+            for _ in range(250):
+                x, y = rng.integers(0, 20), rng.integers(0, 18)
+                expected = nature_stays_extended_brute_force(land, x, y)
+                self.assertEqual(expected, land.nature_stays_extended(x, y))
+                outcomes.add(expected)
+                if land.grid.state[x, y] == NATURE and (expected or rng.random() < 0.2):
+                    land.set_block(x, y, BUILT, 'high')
+            assert_same_topology(NatureTopology(land.grid.state == NATURE, T_star), land.get_nature_topology())
+        self.assertEqual({True, False}, outcomes)
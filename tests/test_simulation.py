@@ -1,10 +1,14 @@
-import os, shutil
+import csv, os, shutil
 from unittest import TestCase
 
 import numpy as np
 
 from isobenefit_cities.image_io import import_2Darray_from_image
-from isobenefit_cities.simulation import run_isobenefit_simulation
+from isobenefit_cities.simulation import run_isobenefit_simulation, resume_isobenefit_simulation, make_output_path, \
+    iter_simulation, initialize_land, update_map_snapshot
+from isobenefit_cities.trajectory import TrajectoryReader, export_snapshots
+from isobenefit_cities.metrics import load_metrics
+from isobenefit_cities.ensemble import run_ensemble_simulation
 
 
 class TestSimulation(TestCase):
@@ -46,9 +50,11 @@ class TestSimulation(TestCase):
 
         last_iteration = results[-1, 0]
         final_population = results[-1, 6]
-        self.assertEqual(40, last_iteration)
-        self.assertEqual(263840, final_population)
+        self.assertEqual(30, last_iteration)
+        self.assertEqual(250080, final_population)
 
+        # the snapshots are rendered from the trajectory
+        export_snapshots("simulations/tmp/trajectory.npz", "simulations/tmp", steps=[int(last_iteration)])
         result_image = import_2Darray_from_image(f"simulations/tmp/{int(last_iteration):05d}.png")
         test_image_path = 'fixtures/test_simulation_final_map.png'
         test_image = import_2Darray_from_image(test_image_path)
@@ -57,3 +63,128 @@ class TestSimulation(TestCase):
         final_min_dist = np.loadtxt("simulations/tmp/minimal_distances_map.csv", skiprows=1, delimiter=',')
         test_final_min_dist = np.loadtxt("fixtures/test_minimal_distances_map.csv", skiprows=1, delimiter=',')
         np.testing.assert_equal(test_final_min_dist, final_min_dist)
+        with np.load("simulations/tmp/minimal_distances.npz") as distances:
+            x, y = final_min_dist[:, :2].astype(int).T
+            self.assertEqual(np.float32, distances['nature'].dtype)
+            np.testing.assert_equal(final_min_dist[:, 2].astype(np.float32), distances['nature'][x, y])
+            np.testing.assert_equal(final_min_dist[:, 3].astype(np.float32), distances['centrality'][x, y])
+
+    def test_resume_from_checkpoint(self):
+        for urbanism_model, kernel in [('isobenefit', 'python'), ('classical', 'python'), ('classical', 'vectorized')]:
+            run_isobenefit_simulation(60, 60, 10, f'tmp/{kernel}_{urbanism_model}', 0.5, 0.1, 0.1, 3, 0, None,
+                                      'list', 250000, 10000, urbanism_model, (0.5, 0.3, 0.2), (1, 0.1, 0.01),
+                                      kernel=kernel, save_snapshots=True, keyframe_interval=4,
+                                      checkpoint_interval=3)
+            # the run ends at step 11 and its last checkpoint is at step 9: resuming a copy of it replays the
+            # last two steps
+            output_path = f"simulations/tmp/{kernel}_{urbanism_model}"
+            resumed_path = f"{output_path}_resumed"
+            shutil.copytree(output_path, resumed_path)
+            with open(os.path.join(resumed_path, 'metadata.json')) as f:
+                metadata = f.read().replace(output_path, resumed_path)
+            with open(os.path.join(resumed_path, 'metadata.json'), 'w') as f:
+                f.write(metadata)
+            resume_isobenefit_simulation(resumed_path)
+
+            for filename in ['current_counts.csv', 'trajectory.npz', 'minimal_distances_map.csv', '00011.png']:
+                with open(os.path.join(output_path, filename), 'rb') as f, \
+                        open(os.path.join(resumed_path, filename), 'rb') as g:
+                    self.assertEqual(f.read(), g.read())
+
+    def test_metrics_format(self):
+        parameters = (60, 60, 10)
+        arguments = (0.5, 0.1, 0.1, 3, 0, None, 'list', 250000, 10000, 'isobenefit', (0.5, 0.3, 0.2), (1, 0.1, 0.01))
+        csv_counts = run_isobenefit_simulation(*parameters, 'tmp/csv', *arguments)
+        npy_counts = run_isobenefit_simulation(*parameters, 'tmp/npy', *arguments, checkpoint_interval=4,
+                                               metrics_format='npy')
+        memory_counts = run_isobenefit_simulation(*parameters, 'tmp/memory', *arguments, metrics_format='memory')
+        self.assertEqual(12, len(npy_counts))
+        np.testing.assert_array_equal(npy_counts, csv_counts)
+        np.testing.assert_array_equal(npy_counts, memory_counts)
+        np.testing.assert_array_equal(npy_counts, load_metrics("simulations/tmp/npy/current_counts.npy"))
+        self.assertFalse(os.path.exists("simulations/tmp/memory/current_counts.csv"))
+        with self.assertRaises(ValueError):
+            run_isobenefit_simulation(*parameters, 'tmp/parquet', *arguments, checkpoint_interval=4,
+                                      metrics_format='parquet')
+        self.assertFalse(os.path.exists("simulations/tmp/parquet"))
+
+        output_path = "simulations/tmp/npy"
+        resumed_path = f"{output_path}_resumed"
+        shutil.copytree(output_path, resumed_path)
+        with open(os.path.join(resumed_path, 'metadata.json')) as f:
+            metadata = f.read().replace(output_path, resumed_path)
+        with open(os.path.join(resumed_path, 'metadata.json'), 'w') as f:
+            f.write(metadata)
+        np.testing.assert_array_equal(npy_counts, resume_isobenefit_simulation(resumed_path))
+
+    def test_iter_simulation(self):
+        arguments = (0.5, 0.1, 0.1, 3, 0, None, 'list', 250000, 10000, 'classical', (0.5, 0.3, 0.2), (1, 0.1, 0.01))
+        records = [(record.iteration, record.counts, record.changes, record.grid.snapshot())
+                   for record in iter_simulation(60, 60, 10, *arguments)]
+        counts = run_isobenefit_simulation(60, 60, 10, 'tmp/iter', *arguments)
+        self.assertEqual(list(range(12)), [record[0] for record in records])
+        self.assertIsNone(records[0][2])
+        np.testing.assert_array_equal(counts, np.array([record[1] for record in records]))
+        with TrajectoryReader("simulations/tmp/iter/trajectory.npz") as reader:
+            for iteration, _, _, grid in records:
+                np.testing.assert_array_equal(reader.read(iteration).state, grid.state)
+
+        for record in iter_simulation(60, 60, 10, *arguments):
+            with self.assertRaises(ValueError):
+                record.grid.state[0, 0] = 1
+            if record.iteration == 3:
+                break
+        self.assertEqual(3, record.iteration)
+        self.assertEqual(records[3][2].added_blocks, record.changes.added_blocks)
+
+    def test_update_map_snapshot(self):
+        land = initialize_land(20, 30, 0.5, 0.1, 0.1, 3, 250000, 10000, 'list', None, [(10, 15)], 'isobenefit',
+                               (0.7, 0.3, 0), (1, 0.1, 0.01), random_seed=0)
+        for _ in range(3):
+            land.update_map()
+        canvas = np.empty((20, 30, 4), dtype=np.uint8)
+        update_map_snapshot(land, canvas)
+        # float canvases, as np.ones((size_x, size_y, 4)), get the colours in [0, 1]
+        float_canvas = np.ones((20, 30, 4))
+        update_map_snapshot(land, float_canvas)
+        np.testing.assert_array_equal(canvas, np.uint8(255 * float_canvas))
+        np.testing.assert_array_equal([0, 158 / 255, 96 / 255, 1], float_canvas[0, 0])
+        self.assertEqual((1, 1, 1, 1), tuple(float_canvas[10, 15]))
+
+    def test_make_output_path(self):
+        output_paths = [make_output_path(None) for _ in range(3)]
+        for output_path in output_paths:
+            self.assertTrue(os.path.isdir(output_path))
+            os.rmdir(output_path)
+        self.assertEqual(3, len(set(output_paths)))
+
+    def test_ensemble_simulation(self):
+        output_path = run_ensemble_simulation(40, 40, 5, 'tmp/ensemble', 4, 0.5, 0.01, 0.1, 3, 0, None, 'list',
+                                              250000, 10000, (0.7, 0.3, 0), (1, 0.1, 0.01))
+        with open(os.path.join(output_path, 'members.csv')) as f:
+            members = list(csv.DictReader(f))
+        with open(os.path.join(output_path, 'aggregate.csv')) as f:
+            aggregate = list(csv.DictReader(f))
+        self.assertEqual(7, len(aggregate))
+        self.assertEqual(7 * 4, len(members))
+        last_populations = [float(row['current_population']) for row in members if row['iteration'] == '6']
+        self.assertEqual(4, len(set(last_populations)))
+        self.assertAlmostEqual(np.mean(last_populations), float(aggregate[-1]['current_population_mean']))
+        self.assertAlmostEqual(np.median(last_populations), float(aggregate[-1]['current_population_q0.5']))
+
+    def test_timings(self):
+        for urbanism_model in ['isobenefit', 'classical']:
+            output_path = f"simulations/tmp/timings_{urbanism_model}"
+            run_isobenefit_simulation(50, 50, 8, f'tmp/timings_{urbanism_model}', 0.5, 0.1, 0.1, 3, 0, None, 'list',
+                                      250000, 10000, urbanism_model, (0.7, 0.3, 0), (1, 0.1, 0.01), timings=True,
+                                      profiler='cprofile')
+            with open(os.path.join(output_path, 'timings.csv')) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(list(range(1, 10)), [int(row['iteration']) for row in rows])
+            for row in rows:
+                self.assertGreaterEqual(int(row['candidate_blocks']), int(row['accepted_blocks']))
+                self.assertGreaterEqual(float(row['step']), float(row['update_map']))
+                self.assertGreaterEqual(float(row['update_map']), float(row['rng']) + float(row['candidates']))
+            calls = sum(int(row['nature_stays_extended_calls']) for row in rows)
+            self.assertEqual(urbanism_model == 'isobenefit', calls > 0)
+            self.assertTrue(os.path.exists(os.path.join(output_path, 'profile.prof')))
@@ -0,0 +1,29 @@
+import tempfile
+from unittest import TestCase
+import numpy as np
+from PIL import Image
+
+from src.image_io import render_grid
+from src.land_map import IsobenefitScenario, MapBlock
+from src.snapshot_writer import SnapshotWriter, snapshot_path
+
+
+class TestSnapshotWriter(TestCase):
+    def test_snapshot_writer(self):
+        land = IsobenefitScenario(size_x=20, size_y=30, T_star=3, random_seed=2)
+        land.set_centralities([MapBlock(10, 10)])
+        expected = []
+        with tempfile.TemporaryDirectory() as output_path:
+            with SnapshotWriter(output_path, workers=2, max_pending=2, compress_level=1) as writer:
+                for step in range(4):
+                    land.set_current_counts(urbanism_model='isobenefit')
+                    land.update_map()
+                    writer.submit(land.grid, step=step)
+                    expected.append(render_grid(land.grid.state, land.grid.density))
+            for step, canvas in enumerate(expected):
+                image = np.asarray(Image.open(snapshot_path(output_path, step)))
+                np.testing.assert_array_equal(canvas, image)
+
+        writer = SnapshotWriter('does/not/exist')
+        writer.submit(land.grid, step=0)
+        self.assertRaises(FileNotFoundError, writer.close)
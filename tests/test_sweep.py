@@ -0,0 +1,64 @@
+import csv, json, os, shutil
+from unittest import TestCase
+
+from src.sweep import DEFAULT_PARAMETERS, RUN_SUMMARY_FILENAME, SWEEP_SPEC_FILENAME, expand_sweep, run_sweep
+
+
+class TestSweep(TestCase):
+    def tearDown(self) -> None:
+        shutil.rmtree("simulations/tmp/sweep", ignore_errors=True)
+
+    def test_expand_sweep(self):
+        spec = {'base': {'size_x': 30, 'size_y': 30},
+                'grid': {'build_probability': [0.3, 0.6], 'T_star': [3, 4, 5]},
+                'runs': [{'build_probability': 0.1, 'random_seed': 7}],
+                'repetitions': 2, 'seed': 1}
+        runs = expand_sweep(spec)
+        self.assertEqual(14, len(runs))
+        self.assertEqual(14, len({run_id for run_id, _ in runs}))
+        self.assertEqual(runs, expand_sweep(spec))
+        self.assertEqual({0.3, 0.6, 0.1}, {parameters['build_probability'] for _, parameters in runs})
+        self.assertEqual([7, 7], [parameters['random_seed'] for _, parameters in runs[-2:]])
+        self.assertEqual(12, len({parameters['random_seed'] for _, parameters in runs[:-2]}))
+        self.assertEqual(DEFAULT_PARAMETERS['n_steps'], runs[0][1]['n_steps'])
+        self.assertNotEqual(runs, expand_sweep(dict(spec, seed=2)))
+
+    def test_sweep(self):
+        spec = {'base': {'size_x': 30, 'size_y': 30, 'n_steps': 3, 'T_star': 3},
+                'grid': {'build_probability': [0.3, 0.6], 'urbanism_model': ['isobenefit', 'classical']},
+                'repetitions': 2, 'seed': 1}
+        summary_filepath = run_sweep(spec, output_path_prefix='tmp/sweep', workers=2)
+        with open(summary_filepath) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(8, len(rows))
+        self.assertEqual({'finished'}, {row['status'] for row in rows})
+        self.assertEqual(8, len({row['random_seed'] for row in rows}))
+        self.assertEqual(8, len({row['run_id'] for row in rows}))
+        for row in rows:
+            self.assertTrue(os.path.exists(f"simulations/tmp/sweep/{row['run_id']}/trajectory.npz"))
+
+        # finished runs are not run again
+        summary_filepath = run_sweep(spec, output_path_prefix='tmp/sweep', workers=2)
+        with open(summary_filepath) as f:
+            self.assertEqual(rows, list(csv.DictReader(f)))
+
+    def test_restart_sweep_without_seed(self):
+        spec = {'base': {'size_x': 30, 'size_y': 30, 'n_steps': 2, 'T_star': 3, 'metrics_format': 'memory'},
+                'repetitions': 3}
+        self.assertRaises(ValueError, run_sweep, spec, workers=1)
+        summary_filepath = run_sweep(spec, output_path_prefix='tmp/sweep', workers=1)
+        with open(summary_filepath) as f:
+            rows = list(csv.DictReader(f))
+        with open(f"simulations/tmp/sweep/{SWEEP_SPEC_FILENAME}") as f:
+            seed = json.load(f)['seed']
+        self.assertEqual([run_id for run_id, _ in expand_sweep(dict(spec, seed=seed))],
+                         [row['run_id'] for row in rows])
+
+        # the restarted sweep finds its runs with the saved seed and only reruns the missing one
+        os.remove(f"simulations/tmp/sweep/{rows[1]['run_id']}/{RUN_SUMMARY_FILENAME}")
+        summary_filepath = run_sweep(spec, output_path_prefix='tmp/sweep', workers=1)
+        with open(summary_filepath) as f:
+            restarted_rows = list(csv.DictReader(f))
+        self.assertEqual([row['run_id'] for row in rows], [row['run_id'] for row in restarted_rows])
+        self.assertEqual(rows[0], restarted_rows[0])
+        self.assertRaises(ValueError, run_sweep, dict(spec, repetitions=2), output_path_prefix='tmp/sweep')
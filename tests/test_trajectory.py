@@ -0,0 +1,41 @@
+import tempfile
+from unittest import TestCase
+import numpy as np
+from PIL import Image
+
+from src.image_io import render_grid
+from src.land_map import ClassicalScenario, MapBlock
+from src.trajectory import TrajectoryReader, TrajectoryWriter, export_snapshots
+
+
+class TestTrajectory(TestCase):
+    def test_trajectory(self):
+        for kernel in ['python', 'vectorized']:
+            land = ClassicalScenario(size_x=25, size_y=20, T_star=3, build_probability=0.3,
+                                     neighboring_centrality_probability=0.05, prob_distribution=(0.2, 0.3, 0.5),
+                                     random_seed=4, kernel=kernel)
+            land.set_centralities([MapBlock(10, 10)])
+            grids = [land.grid.snapshot()]
+            with tempfile.TemporaryDirectory() as output_path:
+                filepath = f"{output_path}/trajectory.npz"
+                with TrajectoryWriter(filepath, shape=(25, 20), keyframe_interval=5, chunk_size=3) as trajectory:
+                    trajectory.write_keyframe(0, land.grid)
+                    for step in range(1, 13):
+                        land.set_current_counts(urbanism_model='classical')
+                        trajectory.write_step(step, land.grid, land.update_map())
+                        grids.append(land.grid.snapshot())
+
+                with TrajectoryReader(filepath) as reader:
+                    self.assertEqual(12, reader.last_step)
+                    self.assertEqual([0, 5, 10], reader.keyframes)
+                    for step in [7, 12, 0, 3, 10, 11]:
+                        grid = reader.read(step)
+                        for name in ['state', 'density', 'inhabitants']:
+                            np.testing.assert_array_equal(getattr(grids[step], name), getattr(grid, name))
+                    self.assertRaises(ValueError, reader.read, 13)
+
+                paths = export_snapshots(filepath, output_path)
+                self.assertEqual(13, len(paths))
+                for step in [0, 6, 12]:
+                    np.testing.assert_array_equal(render_grid(grids[step].state, grids[step].density),
+                                                  np.asarray(Image.open(paths[step])))